@@ -0,0 +1,176 @@
+'''
+Compare the threaded processing daemon with the asyncio daemon:
+CPU time used while idle, delay between a finished job and the next
+submission round and the time needed to shut down.
+
+Needs mopro to be installed, e.g. `pip install -e .`.
+No cluster is needed, the submitter only records its iterations
+and the database is a temporary sqlite file.
+
+    python benchmarks/daemon.py --idle 10 --interval 10
+'''
+import asyncio
+import os
+import resource
+import tempfile
+import time
+
+import click
+import zmq
+import zmq.asyncio
+
+from mopro.config import config, DatabaseConfig
+from mopro.database import (
+    database, initialize_database, setup_database, CorsikaSettings, CorsikaRun, Status,
+)
+from mopro.processing.monitor import JobMonitor
+from mopro.processing.submitter import JobSubmitter
+from mopro.processing.daemon import ProcessingDaemon
+
+
+PORT = 12797
+
+
+class FakeCluster:
+    max_walltime = None
+
+    def terminate(self):
+        pass
+
+
+class BenchmarkSubmitter(JobSubmitter):
+    ''' Submitter only recording the time of its iterations '''
+
+    def __init__(self, interval):
+        super().__init__(
+            interval=interval, max_queued_jobs=0, mopro_directory='.',
+            host='localhost', port=PORT, cluster=FakeCluster(),
+        )
+        self.ticks = []
+
+    def reconcile_with_cluster(self):
+        pass
+
+    def process_pending_jobs(self):
+        self.ticks.append(time.monotonic())
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def setup(directory):
+    config.database = DatabaseConfig(
+        kind='sqlite', database=os.path.join(directory, 'benchmark.sqlite')
+    )
+    initialize_database()
+    setup_database()
+    with database.connection_context():
+        settings = CorsikaSettings.create(
+            name='benchmark', config_h='', inputcard_template='',
+        )
+        CorsikaRun.create(
+            corsika_settings=settings,
+            primary_particle=1,
+            zenith_min=0, zenith_max=5,
+            azimuth_min=0, azimuth_max=10,
+            energy_min=100, energy_max=200e3,
+            spectral_index=-2.7,
+            max_radius=300,
+            status=Status.get(name='running'),
+        )
+
+
+def first_tick_after(ticks, start):
+    return next((t - start for t in ticks if t > start), None)
+
+
+def benchmark_threaded(idle, interval):
+    submitter = BenchmarkSubmitter(interval)
+    monitor = JobMonitor(port=PORT)
+    monitor.start()
+    submitter.start()
+    time.sleep(1)
+
+    cpu_before = cpu_time()
+    time.sleep(idle)
+    idle_cpu = cpu_time() - cpu_before
+
+    context = zmq.Context()
+    socket = context.socket(zmq.REQ)
+    socket.connect(f'tcp://localhost:{PORT}')
+    start = time.monotonic()
+    socket.send_pyobj({'program': 'corsika', 'job_id': 1, 'status': 'success'})
+    socket.recv_pyobj()
+    while first_tick_after(submitter.ticks, start) is None:
+        time.sleep(0.001)
+    latency = first_tick_after(submitter.ticks, start)
+    socket.close()
+    context.term()
+
+    start = time.monotonic()
+    submitter.terminate()
+    submitter.join()
+    monitor.terminate()
+    monitor.join()
+    shutdown = time.monotonic() - start
+
+    return idle_cpu, latency, shutdown
+
+
+def benchmark_asyncio(idle, interval):
+    submitter = BenchmarkSubmitter(interval)
+    daemon = ProcessingDaemon(JobMonitor(port=PORT), submitter, FakeCluster())
+    results = {}
+
+    async def client():
+        await asyncio.sleep(1)
+
+        cpu_before = cpu_time()
+        await asyncio.sleep(idle)
+        results['idle_cpu'] = cpu_time() - cpu_before
+
+        context = zmq.asyncio.Context()
+        socket = context.socket(zmq.REQ)
+        socket.connect(f'tcp://localhost:{PORT}')
+        start = time.monotonic()
+        await socket.send_pyobj({'program': 'corsika', 'job_id': 1, 'status': 'success'})
+        await socket.recv_pyobj()
+        while first_tick_after(submitter.ticks, start) is None:
+            await asyncio.sleep(0.001)
+        results['latency'] = first_tick_after(submitter.ticks, start)
+        socket.close()
+        context.term()
+
+        results['stop'] = time.monotonic()
+        daemon.request_stop()
+
+    async def main():
+        await asyncio.gather(daemon.run(), client())
+        results['shutdown'] = time.monotonic() - results['stop']
+
+    asyncio.run(main())
+    return results['idle_cpu'], results['latency'], results['shutdown']
+
+
+@click.command()
+@click.option('--idle', default=10.0, help='Seconds to measure the idle CPU usage')
+@click.option('--interval', default=10.0, help='Submission interval in seconds')
+def main(idle, interval):
+    with tempfile.TemporaryDirectory() as directory:
+        print(f'{"mode":<10} {"idle cpu":>10} {"wakeup latency":>16} {"shutdown":>10}')
+        modes = (('threaded', benchmark_threaded), ('asyncio', benchmark_asyncio))
+        for mode, benchmark in modes:
+            setup(directory)
+            idle_cpu, latency, shutdown = benchmark(idle, interval)
+            print(
+                f'{mode:<10} {idle_cpu / idle:>9.1%} {latency * 1e3:>14.1f}ms'
+                f' {shutdown * 1e3:>8.1f}ms'
+            )
+            database.close()
+            os.remove(config.database.database)
+
+
+if __name__ == '__main__':
+    main()
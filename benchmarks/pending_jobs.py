@@ -0,0 +1,144 @@
+'''
+Compare fetching pending runs as peewee model instances, as
+`get_pending_jobs` did before, with the compact job specs:
+time to fetch the runs and to compute their directories and basenames,
+as the submitter does in each iteration, and the memory held by the result.
+
+Needs mopro to be installed, e.g. `pip install -e .`.
+The database is a temporary sqlite file.
+
+    python benchmarks/pending_jobs.py --n-runs 10000
+'''
+import heapq
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from itertools import islice
+from operator import attrgetter
+
+import click
+
+from mopro.config import config, DatabaseConfig
+from mopro.database import (
+    database, initialize_database, setup_database,
+    CorsikaSettings, CorsikaRun, CeresSettings, CeresRun, Status,
+)
+from mopro.queries import get_pending_jobs
+from mopro.scheduling import PriorityPolicy, FairSharePolicy
+from mopro.scripts.simulate_scheduling import fill_database, LOCATION
+
+
+@database.connection_context()
+def get_pending_models(max_jobs, location, policy):
+    ''' The query of `get_pending_jobs` returning model instances '''
+    created = Status.select().where(Status.name == 'created')
+    success = Status.select().where(Status.name == 'success')
+    now = datetime.utcnow()
+
+    corsika_query = (
+        CorsikaRun
+        .select(
+            CorsikaRun,
+            CorsikaSettings.name,
+            CorsikaSettings.version,
+            CorsikaSettings.id,
+            CorsikaSettings.inputcard_template,
+        )
+        .join(CorsikaSettings)
+        .where(CorsikaRun.status == created)
+        .where(CorsikaRun.not_before.is_null() | (CorsikaRun.not_before <= now))
+    )
+    corsika_jobs = list(policy.order_corsika(corsika_query).limit(max_jobs))
+
+    ceres_query = (
+        CeresRun
+        .select(
+            CeresRun,
+            CeresSettings.id, CeresSettings.name, CeresSettings.revision,
+            CorsikaRun.id, CorsikaRun.result_file,
+            CorsikaRun.zenith_min, CorsikaRun.zenith_max,
+            CorsikaRun.azimuth_min, CorsikaRun.azimuth_max,
+            CorsikaRun.primary_particle, CorsikaRun.viewcone,
+            CorsikaSettings.name, CorsikaSettings.version,
+        )
+        .join(CeresSettings)
+        .switch(CeresRun)
+        .join(CorsikaRun)
+        .join(CorsikaSettings)
+        .where(CorsikaRun.status == success)
+        .where(CorsikaRun.location == location)
+        .where(CeresRun.status == created)
+        .where(CeresRun.not_before.is_null() | (CeresRun.not_before <= now))
+    )
+    ceres_jobs = list(policy.order_ceres(ceres_query).limit(max_jobs))
+
+    jobs = heapq.merge(corsika_jobs, ceres_jobs, key=attrgetter('score'))
+    return list(islice(jobs, max_jobs))
+
+
+def setup(directory, n_runs):
+    config.database = DatabaseConfig(
+        kind='sqlite', database=os.path.join(directory, 'benchmark.sqlite')
+    )
+    initialize_database()
+    setup_database()
+    # inputcard template of realistic size, shared by all runs
+    template = open('examples/inputcard_template.txt').read()
+    with database.connection_context():
+        fill_database([
+            dict(
+                program='corsika', settings='epos', primary='proton', n_runs=n_runs // 2,
+            ),
+            dict(
+                program='corsika', settings='epos', primary='gamma', n_runs=n_runs // 4,
+            ),
+            dict(
+                program='ceres', settings='ceres_12', primary='gamma', n_runs=n_runs // 4,
+            ),
+        ], datetime.utcnow())
+        CorsikaSettings.update(inputcard_template=template).execute()
+
+
+def measure(fetch, n_runs, policy, repetitions):
+    durations = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        jobs = fetch(n_runs, LOCATION, policy)
+        for job in jobs:
+            job.directory_name
+            job.basename
+        durations.append(time.perf_counter() - start)
+        del jobs
+
+    tracemalloc.start()
+    jobs = fetch(n_runs, LOCATION, policy)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(jobs) == n_runs
+    return min(durations), memory
+
+
+@click.command()
+@click.option('--n-runs', default=10000, help='Number of pending runs')
+@click.option('--repetitions', default=5, help='Number of timed iterations per mode')
+def main(n_runs, repetitions):
+    with tempfile.TemporaryDirectory() as directory:
+        setup(directory, n_runs)
+
+        print(f'{"policy":<12} {"mode":<8} {"time / tick":>12} {"memory / run":>14}')
+        policies = (('priority', PriorityPolicy()), ('fair_share', FairSharePolicy()))
+        modes = (('models', get_pending_models), ('specs', get_pending_jobs))
+        for name, policy in policies:
+            for mode, fetch in modes:
+                duration, memory = measure(fetch, n_runs, policy, repetitions)
+                print(
+                    f'{name:<12} {mode:<8} {duration * 1e3:>10.1f}ms'
+                    f' {memory / n_runs:>12.0f} B'
+                )
+        database.close()
+
+
+if __name__ == '__main__':
+    main()
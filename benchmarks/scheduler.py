@@ -0,0 +1,421 @@
+'''
+Benchmark suite for the submission loop and the job monitor,
+running without Slurm and without executors.
+
+The submitter benchmark fills the database with CORSIKA runs and drives
+`JobSubmitter.process_pending_jobs` against a `SyntheticCluster`,
+that starts jobs in its slots and finishes them after a random number
+of ticks, reporting the status updates to the `JobMonitor` like the executors.
+It measures ticks, submissions and status updates per second
+and the latencies of the queries used in each tick.
+
+The monitor benchmark runs a `JobMonitor` thread and synthetic zmq clients,
+each sending the running, heartbeat and success messages of its share of runs,
+and measures the messages and status updates handled per second.
+
+By default, the database is a temporary sqlite file. To benchmark another
+database, e.g. a local MySQL server, pass a config file with its database
+section. That database must be empty, its tables are dropped afterwards.
+
+Needs mopro to be installed, e.g. `pip install -e .`.
+
+    python benchmarks/scheduler.py --n-runs 1000
+    python benchmarks/scheduler.py --json baseline.json
+    python benchmarks/scheduler.py --baseline baseline.json --tolerance 0.3
+
+With `--baseline`, the exit code is 1 if any metric is worse than the
+baseline by more than the tolerance, so the suite can run in CI.
+'''
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from functools import wraps
+
+import click
+import zmq
+
+from mopro.cluster import Cluster, parse_job_name
+from mopro.config import config, DatabaseConfig
+from mopro.database import (
+    database, initialize_database, setup_database, MODELS,
+    Status, CorsikaSettings, CorsikaRun,
+)
+from mopro.processing import submitter as submitter_module
+from mopro.processing.corsika import corsika_directory
+from mopro.processing.monitor import JobMonitor
+from mopro.processing.submitter import JobSubmitter
+from mopro.queries import reconcile_job_counts
+
+
+LOCATION = 'benchmark'
+# queries of the submitter, timed during the submitter benchmark
+TIMED_QUERIES = ('get_pending_jobs', 'get_job_counts', 'update_job_status')
+INPUTCARD_TEMPLATE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    os.pardir, 'examples', 'inputcard_template.txt',
+)
+
+
+class SyntheticCluster(Cluster):
+    '''
+    Cluster with `slots` job slots, advanced by hand one tick at a time.
+    Each job runs for a random number of ticks, exponentially distributed
+    with mean `mean_duration`.
+    '''
+
+    def __init__(self, slots, mean_duration, seed=0):
+        self.slots = slots
+        self.mean_duration = mean_duration
+        self.random = random.Random(seed)
+        self.tick = 0
+        self.queued = deque()
+        # job name -> tick it ends in
+        self.running = {}
+        self.n_submitted = 0
+
+    def submit_job(self, executable, *args, job_name=None, **kwargs):
+        self.queued.append(job_name)
+        self.n_submitted += 1
+
+    def advance(self):
+        '''
+        Go to the next tick, returns the names of the finished jobs
+        and of the jobs started in free slots
+        '''
+        self.tick += 1
+        finished = [name for name, end in self.running.items() if end <= self.tick]
+        for name in finished:
+            del self.running[name]
+
+        started = []
+        while self.queued and len(self.running) < self.slots:
+            name = self.queued.popleft()
+            duration = max(1, round(self.random.expovariate(1 / self.mean_duration)))
+            self.running[name] = self.tick + duration
+            started.append(name)
+
+        return finished, started
+
+    @property
+    def n_running(self):
+        return len(self.running)
+
+    @property
+    def n_queued(self):
+        return len(self.queued)
+
+    def get_running_jobs(self):
+        return list(self.running)
+
+    def get_queued_jobs(self):
+        return list(self.queued)
+
+    def kill_job(self, job_name):
+        self.running.pop(job_name, None)
+
+    def cancel_job(self, job_name):
+        if job_name in self.queued:
+            self.queued.remove(job_name)
+
+    def terminate(self):
+        pass
+
+
+class QueryTimer:
+    ''' Records the duration of each call to the wrapped functions '''
+
+    def __init__(self):
+        self.durations = defaultdict(list)
+
+    @contextmanager
+    def patch(self, module, names):
+        ''' Time the functions `names` of `module` while in the context '''
+        originals = {name: getattr(module, name) for name in names}
+        for name, function in originals.items():
+            setattr(module, name, self.wrap(name, function))
+        try:
+            yield self
+        finally:
+            for name, function in originals.items():
+                setattr(module, name, function)
+
+    def wrap(self, name, function):
+        @wraps(function)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.durations[name].append(time.perf_counter() - start)
+        return timed
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+@contextmanager
+def benchmark_database(config_file):
+    '''
+    Initialize and set up the benchmark database, the database of
+    `config_file` if given, else a temporary sqlite file
+    '''
+    with tempfile.TemporaryDirectory(prefix='mopro_benchmark_') as directory:
+        if config_file is not None:
+            config.load_yaml(config_file)
+        else:
+            config.database = DatabaseConfig(
+                kind='sqlite', database=os.path.join(directory, 'benchmark.sqlite')
+            )
+        initialize_database()
+        setup_database()
+
+        with database.connection_context():
+            if CorsikaRun.select().exists():
+                raise click.UsageError('The benchmark database must be empty')
+        try:
+            yield directory
+        finally:
+            with database.connection_context():
+                database.drop_tables(MODELS)
+            database.close()
+
+
+def insert_runs(n_runs, status='created'):
+    ''' Insert `n_runs` CORSIKA runs in `status`, returns their settings '''
+    with open(INPUTCARD_TEMPLATE) as f:
+        inputcard_template = f.read()
+
+    with database.connection_context():
+        settings = CorsikaSettings.create(
+            name='benchmark', config_h='', inputcard_template=inputcard_template,
+        )
+        status = Status.get(name=status)
+        with database.atomic():
+            for i in range(0, n_runs, 1000):
+                CorsikaRun.insert_many([
+                    dict(
+                        corsika_settings=settings,
+                        primary_particle=1,
+                        zenith_min=0, zenith_max=5,
+                        azimuth_min=0, azimuth_max=10,
+                        energy_min=100, energy_max=200e3,
+                        spectral_index=-2.7,
+                        max_radius=300,
+                        status=status,
+                        location=LOCATION if status.name != 'created' else None,
+                    )
+                    for _ in range(min(1000, n_runs - i))
+                ]).execute()
+    reconcile_job_counts()
+    return settings
+
+
+def clear_runs():
+    with database.connection_context():
+        CorsikaRun.delete().execute()
+        CorsikaSettings.delete().execute()
+    reconcile_job_counts()
+
+
+def benchmark_submitter(mopro_directory, n_runs, slots, max_queued_jobs, mean_duration):
+    '''
+    Submit and finish `n_runs` runs, returns the metrics
+    and the durations of the timed queries
+    '''
+    settings = insert_runs(n_runs)
+    # pretend CORSIKA is installed
+    os.makedirs(corsika_directory(settings, mopro_directory), exist_ok=True)
+
+    cluster = SyntheticCluster(slots, mean_duration)
+    submitter = JobSubmitter(
+        interval=0, max_queued_jobs=max_queued_jobs, mopro_directory=mopro_directory,
+        host='localhost', port=0, cluster=cluster, location=LOCATION,
+    )
+    monitor = JobMonitor()
+
+    def report(job_name, status):
+        program, job_ids = parse_job_name(job_name)
+        for job_id in job_ids:
+            monitor.update_job({'program': program, 'job_id': job_id, 'status': status})
+
+    timer = QueryTimer()
+    tick_time = update_time = 0
+    n_ticks = n_updates = n_finished = 0
+    with timer.patch(submitter_module, TIMED_QUERIES):
+        while n_finished < n_runs:
+            start = time.perf_counter()
+            finished, started = cluster.advance()
+            for job_name in finished:
+                report(job_name, 'success')
+            for job_name in started:
+                report(job_name, 'running')
+            update_time += time.perf_counter() - start
+            n_updates += len(finished) + len(started)
+            n_finished += len(finished)
+
+            start = time.perf_counter()
+            submitter.process_pending_jobs()
+            tick_time += time.perf_counter() - start
+            n_ticks += 1
+
+            if cluster.n_submitted == 0:
+                raise RuntimeError('No jobs were submitted, check the log')
+
+    clear_runs()
+    metrics = {
+        'submitter.ticks_per_second': n_ticks / tick_time,
+        'submitter.submissions_per_second': cluster.n_submitted / tick_time,
+        'submitter.updates_per_second': n_updates / update_time,
+    }
+    for name, durations in timer.durations.items():
+        metrics[f'query.{name}.median_ms'] = statistics.median(durations) * 1e3
+        metrics[f'query.{name}.p95_ms'] = percentile(durations, 0.95) * 1e3
+    return metrics
+
+
+def send_messages(port, job_ids, n_heartbeats):
+    ''' One executor-like client sending the messages of `job_ids` '''
+    context = zmq.Context()
+    socket = context.socket(zmq.REQ)
+    socket.connect(f'tcp://localhost:{port}')
+
+    def send(message):
+        socket.send_pyobj(message)
+        socket.recv_pyobj()
+
+    for job_id in job_ids:
+        send({'program': 'corsika', 'job_id': job_id, 'status': 'running'})
+        for i in range(n_heartbeats):
+            send({
+                'program': 'corsika', 'job_ids': [job_id],
+                'heartbeat': True, 'progress': (i + 1) / (n_heartbeats + 1),
+            })
+        send({'program': 'corsika', 'job_id': job_id, 'status': 'success'})
+
+    socket.close()
+    context.term()
+
+
+def benchmark_monitor(n_runs, n_clients, n_heartbeats, port):
+    ''' Send the messages of `n_runs` queued runs from `n_clients` clients '''
+    insert_runs(n_runs, status='queued')
+    with database.connection_context():
+        job_ids = [run.id for run in CorsikaRun.select(CorsikaRun.id)]
+
+    monitor = JobMonitor(port=port, flush_interval=1)
+    monitor.start()
+    clients = [
+        threading.Thread(
+            target=send_messages, args=(port, job_ids[i::n_clients], n_heartbeats)
+        )
+        for i in range(n_clients)
+    ]
+
+    start = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    duration = time.perf_counter() - start
+
+    monitor.terminate()
+    monitor.join()
+
+    with database.connection_context():
+        success = Status.get(name='success')
+        n_success = CorsikaRun.select().where(CorsikaRun.status == success).count()
+    if n_success != n_runs:
+        raise RuntimeError(f'Only {n_success} of {n_runs} runs were updated to success')
+
+    clear_runs()
+    n_messages = n_runs * (n_heartbeats + 2)
+    return {
+        'monitor.messages_per_second': n_messages / duration,
+        'monitor.updates_per_second': 2 * n_runs / duration,
+    }
+
+
+def higher_is_better(name):
+    return name.endswith('_per_second')
+
+
+def compare(metrics, baseline, tolerance):
+    ''' Names of the metrics worse than `baseline` by more than `tolerance` '''
+    regressions = []
+    for name, value in metrics.items():
+        if name not in baseline:
+            continue
+        reference = baseline[name]
+        if higher_is_better(name):
+            worse = value < reference * (1 - tolerance)
+        else:
+            worse = value > reference * (1 + tolerance)
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+@click.command()
+@click.option('--n-runs', default=1000, show_default=True, help='Runs to submit')
+@click.option('--slots', default=200, show_default=True, help='Job slots of the cluster')
+@click.option(
+    '--max-queued-jobs', default=100, show_default=True,
+    help='Queue limit of the submitter',
+)
+@click.option(
+    '--mean-duration', default=5.0, show_default=True, help='Mean job duration in ticks',
+)
+@click.option(
+    '--clients', default=8, show_default=True, help='zmq clients for the monitor',
+)
+@click.option(
+    '--heartbeats', default=2, show_default=True,
+    help='Heartbeats per run sent to the monitor',
+)
+@click.option('--port', default=12798, show_default=True, help='Port of the monitor')
+@click.option(
+    '--config-file', '-c', type=click.Path(dir_okay=False, exists=True),
+    help='Config file with the database to use instead of a temporary sqlite file',
+)
+@click.option('--json', 'json_file', help='Write the metrics to this file')
+@click.option('--baseline', type=click.File(), help='Metrics to compare against')
+@click.option(
+    '--tolerance', default=0.25, show_default=True,
+    help='Allowed relative regression compared to the baseline',
+)
+def main(
+    n_runs, slots, max_queued_jobs, mean_duration, clients, heartbeats, port,
+    config_file, json_file, baseline, tolerance,
+):
+    with benchmark_database(config_file) as directory:
+        metrics = benchmark_submitter(
+            directory, n_runs, slots, max_queued_jobs, mean_duration,
+        )
+        metrics.update(benchmark_monitor(n_runs, clients, heartbeats, port))
+
+    baseline = json.load(baseline) if baseline is not None else {}
+    print(f'{"metric":<42} {"value":>10} {"baseline":>10}')
+    for name, value in sorted(metrics.items()):
+        reference = f'{baseline[name]:>10.2f}' if name in baseline else ''
+        print(f'{name:<42} {value:>10.2f} {reference}')
+
+    if json_file is not None:
+        with open(json_file, 'w') as f:
+            json.dump(metrics, f, indent=2, sort_keys=True)
+
+    regressions = compare(metrics, baseline, tolerance)
+    if regressions:
+        print(f'Regressions of more than {tolerance:.0%}: {", ".join(regressions)}')
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
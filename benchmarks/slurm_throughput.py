@@ -0,0 +1,125 @@
+'''
+Load test of the `SlurmCluster` against the fake Slurm of `mopro.fake_slurm`:
+sbatch submissions per second, the duration of the squeue calls,
+and the duration and number of squeue calls of a submitter iteration,
+once with the normal latency of the fake slurmctld and once slowed down.
+
+Needs mopro to be installed, e.g. `pip install -e .`.
+The database is a temporary sqlite file, see `scheduler.py`.
+
+    python benchmarks/slurm_throughput.py --n-jobs 500 --latency 0.01 --slowdown 0.2
+'''
+import os
+import statistics
+import tempfile
+import time
+
+import click
+
+from mopro.fake_slurm import FakeSlurm, FakeSlurmDaemon
+from mopro.processing.corsika import corsika_directory
+from mopro.processing.submitter import JobSubmitter
+from mopro.slurm import SlurmCluster
+
+from scheduler import benchmark_database, insert_runs, clear_runs, LOCATION
+
+
+PARTITIONS = {'short': 60, 'long': 2880}
+
+
+def benchmark_sbatch(cluster, n_jobs, script):
+    start = time.perf_counter()
+    for i in range(n_jobs):
+        cluster.submit_job(script, job_name=f'benchmark_{i}', walltime=30)
+    return n_jobs / (time.perf_counter() - start)
+
+
+def benchmark_squeue(cluster, n_calls):
+    durations = []
+    for _ in range(n_calls):
+        start = time.perf_counter()
+        cluster.get_jobs()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def benchmark_tick(submitter, slurm):
+    ''' Duration and squeue calls of one submitter iteration '''
+    calls = slurm.calls['squeue']
+    start = time.perf_counter()
+    submitter.process_pending_jobs()
+    return time.perf_counter() - start, slurm.calls['squeue'] - calls
+
+
+def run(directory, slurm, n_jobs, max_queued_jobs):
+    cluster = SlurmCluster(partitions=PARTITIONS)
+    script = os.path.join(directory, 'job.sh')
+    open(script, 'w').close()
+
+    results = {
+        'sbatch_per_second': benchmark_sbatch(cluster, n_jobs, script),
+        'squeue_ms': benchmark_squeue(cluster, 10) * 1e3,
+    }
+
+    settings = insert_runs(max_queued_jobs)
+    os.makedirs(corsika_directory(settings, directory), exist_ok=True)
+    submitter = JobSubmitter(
+        interval=0, max_queued_jobs=n_jobs + max_queued_jobs, mopro_directory=directory,
+        host='localhost', port=0, cluster=cluster, location=LOCATION,
+    )
+    # first iteration submits the runs, the second only checks the queue
+    results['submitting_tick_s'], results['submitting_tick_squeue'] = benchmark_tick(
+        submitter, slurm,
+    )
+    submitter.max_queued_jobs = 0
+    results['idle_tick_s'], results['idle_tick_squeue'] = benchmark_tick(submitter, slurm)
+
+    clear_runs()
+    with slurm.lock:
+        slurm.jobs.clear()
+    return results
+
+
+@click.command()
+@click.option(
+    '--n-jobs', default=200, show_default=True, help='Jobs submitted with sbatch',
+)
+@click.option(
+    '--max-queued-jobs', default=50, show_default=True,
+    help='Runs submitted by the submitter iteration',
+)
+@click.option('--slots', default=10, show_default=True, help='Job slots per partition')
+@click.option('--latency', default=0.005, show_default=True, help='Seconds per command')
+@click.option(
+    '--slowdown', default=0.1, show_default=True,
+    help='Seconds per command of the slowed down slurmctld',
+)
+def main(n_jobs, max_queued_jobs, slots, latency, slowdown):
+    slurm = FakeSlurm(
+        {name: (max_walltime, slots) for name, max_walltime in PARTITIONS.items()},
+        latency=latency, job_duration=3600,
+    )
+
+    with tempfile.TemporaryDirectory(prefix='mopro_slurm_') as directory:
+        daemon = FakeSlurmDaemon(directory, slurm)
+        daemon.start()
+        os.environ['PATH'] = daemon.bin_directory + os.pathsep + os.environ['PATH']
+
+        results = {}
+        try:
+            with benchmark_database(None) as db_directory:
+                for name, seconds in (('normal', latency), ('slow', slowdown)):
+                    slurm.latency = seconds
+                    results[name] = run(db_directory, slurm, n_jobs, max_queued_jobs)
+        finally:
+            daemon.stop()
+
+    print(f'{"metric":<26} {"normal":>10} {"slow":>10}')
+    print(f'{"latency [ms]":<26} {latency * 1e3:>10.1f} {slowdown * 1e3:>10.1f}')
+    for metric in results['normal']:
+        normal, slow = results['normal'][metric], results['slow'][metric]
+        print(f'{metric:<26} {normal:>10.3g} {slow:>10.3g}')
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,7 @@ from mopro.database import (
     CeresRun,
     Status,
 )
+from mopro.queries import insert_runs
 from peewee import JOIN
 
 initialize_database()
@@ -25,12 +26,13 @@ with database.connection_context():
     print('CORSIKA without corresponding ceres run:', len(corsika_runs))
     print(corsika_runs[0])
 
-    print(CeresRun.insert_many((
+    created = Status.get(Status.name == 'created')
+    print('Inserted', insert_runs(CeresRun, (
         dict(
             corsika_run_id=corsika_run.id,
             ceres_settings=ceres_settings,
-            status=Status.select(Status.id).where(Status.name == 'created'),
+            status=created,
             off_target_distance=6,
             diffuse=True,
         ) for corsika_run in corsika_runs),
-    ).execute())
+    ), 'new jobs')
@@ -5,11 +5,12 @@ from mopro.database import (
     CorsikaRun,
     Status,
 )
+from mopro.queries import insert_runs
 
 initialize_database()
 
 with database.connection_context():
-    print('New job with id', CorsikaRun.insert(
+    print('Inserted', insert_runs(CorsikaRun, [dict(
         corsika_settings=CorsikaSettings.select(CorsikaSettings.id).limit(1),
         primary_particle=14,
         n_showers=100,
@@ -23,5 +24,5 @@ with database.connection_context():
         max_radius=500,
         viewcone=0,
         reuse=20,
-        status=Status.select(Status.id).where(Status.name == 'created'),
-    ).execute(), 'inserted')
+        status=Status.get(Status.name == 'created'),
+    )]), 'new job')
@@ -5,6 +5,7 @@ from mopro.database import (
     CorsikaRun,
     Status,
 )
+from mopro.queries import insert_runs
 
 initialize_database()
 
@@ -31,7 +32,6 @@ options = dict(
     viewcone=0,
     reuse=20,
     corsika_settings=corsika_settings,
-    status=Status.select(Status.id).where(Status.name == 'created'),
 )
 
 
@@ -49,6 +49,5 @@ def generator():
 
 
 with database.connection_context():
-    print(CorsikaRun.insert_many(
-        generator(),
-    ).execute())
+    options['status'] = Status.get(Status.name == 'created')
+    print('Inserted', insert_runs(CorsikaRun, generator()), 'new jobs')
@@ -5,11 +5,12 @@ from mopro.database import (
     CorsikaRun,
     Status,
 )
+from mopro.queries import insert_runs
 
 initialize_database()
 
 with database.connection_context():
-    print('New job with id', CorsikaRun.insert(
+    print('Inserted', insert_runs(CorsikaRun, [dict(
         corsika_settings=CorsikaSettings.select(CorsikaSettings.id).limit(1),
         primary_particle=6,
         n_showers=1000,
@@ -23,5 +24,5 @@ with database.connection_context():
         max_radius=1,
         viewcone=1,
         reuse=1,
-        status=Status.select(Status.id).where(Status.name == 'created'),
-    ).execute(), 'inserted')
+        status=Status.get(Status.name == 'created'),
+    )]), 'new job')
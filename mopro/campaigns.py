@@ -0,0 +1,124 @@
+'''
+Progress, throughput and ETA of campaigns.
+
+Everything is computed by aggregate queries on the
+(campaign, status, finished_at) indexes of the run tables,
+no runs are loaded, so reports stay fast for campaigns of millions of runs.
+The throughput is the number of runs finished successfully in a sliding
+window before now, the ETA extrapolates it to the remaining runs.
+'''
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from peewee import fn
+
+from .database import database, Campaign, Status, CorsikaRun
+from .queries import programs
+
+
+ProgramProgress = namedtuple(
+    'ProgramProgress',
+    [
+        'n_runs',           # all runs of the campaign
+        'status_counts',    # dict mapping status name to number of runs
+        'n_events',         # simulated showers of the successful CORSIKA runs
+        'runs_per_hour',    # successful runs per hour in the window
+        'events_per_hour',  # simulated showers per hour in the window
+        'eta',              # expected time until all runs succeeded
+    ],
+)
+
+CampaignProgress = namedtuple(
+    'CampaignProgress',
+    ['name', 'target_events', 'events_eta', 'programs'],
+)
+
+
+@database.connection_context()
+def create_campaign(name, target_events=None, description=None):
+    return Campaign.create(
+        name=name, target_events=target_events, description=description,
+    )
+
+
+@database.connection_context()
+def assign_runs(campaign, model, *conditions):
+    '''
+    Add the runs of `model` matching all `conditions` to `campaign`,
+    returns their number
+    '''
+    campaign_id = Campaign.get(Campaign.name == campaign).id
+    return model.update(campaign=campaign_id).where(*conditions).execute()
+
+
+def estimate_eta(remaining, per_hour):
+    if remaining <= 0:
+        return timedelta(0)
+    if not per_hour:
+        return None
+    return timedelta(hours=remaining / per_hour)
+
+
+def program_progress(model, campaign_id, since, window_hours):
+    status_names = dict(Status.select(Status.id, Status.name).tuples())
+    success = Status.get(Status.name == 'success').id
+    status_counts = {
+        status_names[status_id]: n_runs
+        for status_id, n_runs in
+        model
+        .select(model.status, fn.COUNT(model.id))
+        .where(model.campaign == campaign_id)
+        .group_by(model.status)
+        .tuples()
+    }
+    n_runs = sum(status_counts.values())
+
+    done = (model.campaign == campaign_id) & (model.status == success)
+    recent = done & (model.finished_at >= since)
+    runs_per_hour = model.select(fn.COUNT(model.id)).where(recent).scalar() / window_hours
+
+    n_events = events_per_hour = None
+    if model is CorsikaRun:
+        events = fn.SUM(CorsikaRun.n_showers * CorsikaRun.reuse)
+        n_events = model.select(events).where(done).scalar() or 0
+        n_recent_events = model.select(events).where(recent).scalar() or 0
+        events_per_hour = n_recent_events / window_hours
+
+    return ProgramProgress(
+        n_runs=n_runs,
+        status_counts=status_counts,
+        n_events=n_events,
+        runs_per_hour=runs_per_hour,
+        events_per_hour=events_per_hour,
+        eta=estimate_eta(n_runs - status_counts.get('success', 0), runs_per_hour),
+    )
+
+
+@database.connection_context()
+def get_campaign_progress(name, window=timedelta(hours=24), now=None):
+    '''
+    Progress of the campaign `name`, the throughput is measured over
+    the `window` before `now`, default is the current time.
+    '''
+    now = now or datetime.utcnow()
+    campaign = Campaign.get(Campaign.name == name)
+    window_hours = window.total_seconds() / 3600
+
+    progress = {
+        program: program_progress(model, campaign.id, now - window, window_hours)
+        for program, model in programs.items()
+    }
+
+    events_eta = None
+    if campaign.target_events is not None:
+        corsika = progress['corsika']
+        events_eta = estimate_eta(
+            campaign.target_events - corsika.n_events, corsika.events_per_hour
+        )
+
+    return CampaignProgress(
+        name=campaign.name,
+        target_events=campaign.target_events,
+        events_eta=events_eta,
+        programs=progress,
+    )
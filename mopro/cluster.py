@@ -6,9 +6,26 @@ from .queries import update_job_status
 from .database import CorsikaRun, CeresRun
 
 
+def parse_job_name(job_name):
+    '''
+    Get program and run ids from the name of a mopro job,
+    group jobs have all run ids in their name, e.g. mopro_ceres_12_13_14.
+    Returns None for other jobs.
+    '''
+    m = re.match(r'mopro_(corsika|ceres)_(\d+(?:_\d+)*)$', job_name)
+    if m is None:
+        return None
+
+    program, job_ids = m.groups()
+    return program, [int(job_id) for job_id in job_ids.split('_')]
+
+
 class Cluster(metaclass=ABCMeta):
     log = logging.getLogger(__name__)
 
+    # longest walltime in minutes a job can request, None for no limit
+    max_walltime = None
+
     @abstractmethod
     def submit_job(
         self,
@@ -51,6 +68,15 @@ class Cluster(metaclass=ABCMeta):
         Get the names of the currently queued jobs in the cluster
         '''
 
+    def get_jobs(self):
+        '''
+        Get the names of all current mopro jobs in the cluster
+        as dict mapping job name to "queued" or "running"
+        '''
+        jobs = {name: 'queued' for name in self.get_queued_jobs()}
+        jobs.update({name: 'running' for name in self.get_running_jobs()})
+        return jobs
+
     @abstractmethod
     def terminate(self):
         pass
@@ -64,18 +90,17 @@ class Cluster(metaclass=ABCMeta):
         pass
 
     def set_to_created(self, job_name):
-        m = re.match(r'mopro_(corsika|ceres)_(\d+)', job_name)
-        if m is None:
+        parsed = parse_job_name(job_name)
+        if parsed is None:
             return
 
-        program, job_id = m.groups()
-        job_id = int(job_id)
-
-        self.log.info(f'Setting job {job_id} to "created"')
-        if program == 'corsika':
-            update_job_status(CorsikaRun, job_id, 'created', location=None)
-        elif program == 'ceres':
-            update_job_status(CeresRun, job_id, 'created', location=None)
+        program, job_ids = parsed
+        for job_id in job_ids:
+            self.log.info(f'Setting job {job_id} to "created"')
+            if program == 'corsika':
+                update_job_status(CorsikaRun, job_id, 'created', location=None)
+            elif program == 'ceres':
+                update_job_status(CeresRun, job_id, 'created', location=None)
 
     def cancel_queued(self):
         '''
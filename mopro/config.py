@@ -33,23 +33,115 @@ DatabaseConfig.__new__.__defaults__ = ('sqlite', None, None, None, None, ':memor
 
 SubmitterConfig = namedtuple(
     'SubmitterConfig',
-    ['interval', 'max_queued_jobs', 'host', 'port', 'mode'],
+    [
+        'interval', 'max_queued_jobs', 'host', 'port', 'mode',
+        'reconcile_interval', 'group_ceres',
+    ],
 )
 SubmitterConfig.__new__.__defaults__ = (
-    60, 300, 'localhost', 1337, 'local'
+    60, 300, 'localhost', 1337, 'local', 3600, False,
 )
 
 SlurmConfig = namedtuple(
     'SlurmConfig',
-    ['partitions', 'cpus', 'mail_settings', 'mail_address'],
+    ['partitions', 'cpus', 'mail_settings', 'mail_address', 'export'],
 )
 SlurmConfig.__new__.__defaults__ = (
-    1, '8G', 'NONE', os.environ['USER'] + '@localhost'
+    1, '8G', 'NONE', os.environ['USER'] + '@localhost', 'all',
 )
 
-LocalConfig = namedtuple('LocalConfig', ['cores'])
+LocalConfig = namedtuple('LocalConfig', ['cores', 'journal'])
 LocalConfig.__new__.__defaults__ = (
-    None,
+    None, None,
+)
+
+StagingConfig = namedtuple('StagingConfig', ['directory', 'max_size'])
+StagingConfig.__new__.__defaults__ = (
+    None, '50G'
+)
+
+SchedulingConfig = namedtuple(
+    'SchedulingConfig',
+    ['policy', 'weights', 'settings_weights', 'aging', 'ceres_bonus'],
+)
+SchedulingConfig.__new__.__defaults__ = (
+    'priority', None, None, 0.0, 0.0,
+)
+
+RetryConfig = namedtuple(
+    'RetryConfig',
+    ['max_retries', 'backoff', 'walltime_factor'],
+)
+RetryConfig.__new__.__defaults__ = (
+    0, 600, 2,
+)
+
+WalltimeConfig = namedtuple(
+    'WalltimeConfig',
+    ['estimate', 'safety_factor', 'margin', 'min_runs', 'max_runs', 'refit_interval'],
+)
+WalltimeConfig.__new__.__defaults__ = (
+    False, 1.5, 30, 20, 5000, 3600,
+)
+
+HeartbeatConfig = namedtuple(
+    'HeartbeatConfig',
+    ['interval', 'timeout', 'flush_interval'],
+)
+HeartbeatConfig.__new__.__defaults__ = (
+    None, 1800, 60,
+)
+
+SIZE_UNITS = {'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+
+
+def parse_size(size):
+    '''
+    Convert a size like "16G" into bytes, units are K, M, G, T (powers of 1024).
+    Numbers without unit are taken as bytes.
+    '''
+    if isinstance(size, (int, float)):
+        return int(size)
+
+    size = size.strip().upper().rstrip('B')
+    if size[-1] in SIZE_UNITS:
+        return int(float(size[:-1]) * SIZE_UNITS[size[-1]])
+    return int(size)
+
+
+DownloadConfig = namedtuple('DownloadConfig', ['cache_dir', 'mirror', 'checksums'])
+DownloadConfig.__new__.__defaults__ = (
+    None, None, None,
+)
+
+
+BundleConfig = namedtuple('BundleConfig', ['directory', 'export'])
+BundleConfig.__new__.__defaults__ = (
+    None, False,
+)
+
+
+BuildConfig = namedtuple('BuildConfig', ['max_parallel', 'timeout'])
+BuildConfig.__new__.__defaults__ = (
+    None, 1800,
+)
+
+
+StorageConfig = namedtuple(
+    'StorageConfig',
+    ['min_free', 'tmp_min_free', 'safety_factor', 'refresh_interval', 'shared_tmp'],
+)
+StorageConfig.__new__.__defaults__ = (
+    None, None, 1.2, 600, False,
+)
+
+
+RetentionConfig = namedtuple(
+    'RetentionConfig',
+    ['ceres_settings', 'action', 'archive_directory', 'batch_size'],
+)
+RetentionConfig.__new__.__defaults__ = (
+    None, 'delete', None, 1000,
 )
 
 
@@ -61,6 +153,16 @@ class Config():
     submitter = SubmitterConfig()
     local = LocalConfig()
     slurm = SlurmConfig(partitions={})
+    staging = StagingConfig()
+    scheduling = SchedulingConfig()
+    retry = RetryConfig()
+    walltime = WalltimeConfig()
+    heartbeat = HeartbeatConfig()
+    download = DownloadConfig()
+    bundles = BundleConfig()
+    builds = BuildConfig()
+    storage = StorageConfig()
+    retention = RetentionConfig()
     mopro_directory = os.path.abspath(os.getcwd())
     debug = False
     location = None
@@ -103,6 +205,36 @@ class Config():
         if config.get('local') is not None:
             self.local = LocalConfig(**config['local'])
 
+        if config.get('staging') is not None:
+            self.staging = StagingConfig(**config['staging'])
+
+        if config.get('scheduling') is not None:
+            self.scheduling = SchedulingConfig(**config['scheduling'])
+
+        if config.get('retry') is not None:
+            self.retry = RetryConfig(**config['retry'])
+
+        if config.get('walltime') is not None:
+            self.walltime = WalltimeConfig(**config['walltime'])
+
+        if config.get('heartbeat') is not None:
+            self.heartbeat = HeartbeatConfig(**config['heartbeat'])
+
+        if config.get('download') is not None:
+            self.download = DownloadConfig(**config['download'])
+
+        if config.get('bundles') is not None:
+            self.bundles = BundleConfig(**config['bundles'])
+
+        if config.get('builds') is not None:
+            self.builds = BuildConfig(**config['builds'])
+
+        if config.get('storage') is not None:
+            self.storage = StorageConfig(**config['storage'])
+
+        if config.get('retention') is not None:
+            self.retention = RetentionConfig(**config['retention'])
+
         self.location = config.get('location') or self.location
         self.mopro_directory = config.get('mopro_directory') or self.mopro_directory
         self.mopro_directory = os.path.abspath(self.mopro_directory)
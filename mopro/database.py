@@ -1,11 +1,13 @@
 from peewee import Proxy, Model, SqliteDatabase, MySQLDatabase, ConnectionContext
 from peewee import (
-    CharField, TextField, IntegerField, FloatField, Check,
-    ForeignKeyField, BooleanField,
+    CharField, TextField, IntegerField, BigIntegerField, FloatField, Check,
+    ForeignKeyField, BooleanField, DateTimeField,
     BlobField
 )
+from playhouse.migrate import SchemaMigrator, migrate, make_index_name
 from jinja2 import Template, StrictUndefined
 import os
+from datetime import datetime
 import subprocess as sp
 import shutil
 
@@ -36,6 +38,37 @@ class Status(BaseModel):
     name = CharField(unique=True)
 
 
+class JobCount(BaseModel):
+    '''
+    Number of runs per program and status.
+
+    Kept up to date in the same transaction as every insert of runs
+    and every status change (see `mopro.queries.insert_runs` and
+    `mopro.queries.change_job_status`), so reading the current
+    numbers does not need a COUNT over the run tables.
+    Drift, e.g. from runs inserted directly into the database,
+    is corrected by `mopro.queries.reconcile_job_counts`.
+
+    Attributes
+    ----------
+    program: str
+        "corsika" or "ceres"
+    status: Status
+        the status that is counted
+    count: int
+        number of runs of `program` in `status`
+    '''
+    program = CharField()
+    status = ForeignKeyField(Status)
+    count = IntegerField(default=0)
+
+    class Meta:
+        table_name = 'job_counts'
+        indexes = (
+            (('program', 'status'), True),
+        )
+
+
 class CorsikaSettings(BaseModel):
     '''
     Attributes
@@ -47,12 +80,15 @@ class CorsikaSettings(BaseModel):
         Run ./coconut to create this file in the corsika include directory
     inputcard_template: str
         Jinja2 template for the inputcard
+    build_duration: float
+        seconds it took to build CORSIKA for these settings
     '''
     name = CharField()
     version = IntegerField(default=76900)
     config_h = TextField()
     inputcard_template = TextField()
     additional_files = BlobField(null=True)
+    build_duration = FloatField(null=True)
 
     def format_input_card(self, run, output_file):
         return Template(self.inputcard_template, undefined=StrictUndefined).render(
@@ -66,6 +102,23 @@ class CorsikaSettings(BaseModel):
         )
 
 
+class Campaign(BaseModel):
+    '''
+    A group of CORSIKA and CERES runs simulated for the same purpose,
+    e.g. the diffuse gammas of an analysis, to track their progress.
+
+    Attributes
+    ----------
+    target_events: int
+        number of simulated air showers the campaign should reach, compared
+        with `n_showers * reuse` summed over its successful CORSIKA runs
+    '''
+    name = CharField(unique=True)
+    description = TextField(null=True)
+    target_events = BigIntegerField(null=True)
+    created_at = DateTimeField(default=datetime.utcnow)
+
+
 class CorsikaRun(BaseModel):
     '''
     Attributes
@@ -119,9 +172,42 @@ class CorsikaRun(BaseModel):
     duration = IntegerField(null=True)
     status = ForeignKeyField(Status)
     walltime = IntegerField(default=2880)
+    # set if the walltime was estimated from past runs by the submitter
+    walltime_estimated = BooleanField(default=False)
     result_file = TextField(null=True)
+    created_at = DateTimeField(default=datetime.utcnow, null=True)
+    # automatic retries of failed runs
+    attempts = IntegerField(default=0)
+    not_before = DateTimeField(null=True)
+    queued_at = DateTimeField(null=True)
+    started_at = DateTimeField(null=True)
+    # written by the monitor from the heartbeats of the executor
+    last_heartbeat = DateTimeField(null=True)
+    progress = IntegerField(null=True)
+    # resources used by the job, reported by the executor
+    peak_rss = BigIntegerField(null=True)
+    cpu_user = FloatField(null=True)
+    cpu_system = FloatField(null=True)
+    bytes_read = BigIntegerField(null=True)
+    bytes_written = BigIntegerField(null=True)
+    tmp_high_water = BigIntegerField(null=True)
+    # set when the result file was deleted or archived by the retention policy
+    cleaned_at = DateTimeField(null=True)
+    archive_file = TextField(null=True)
+    campaign = ForeignKeyField(Campaign, null=True)
+    # time of the last status update other than running
+    finished_at = DateTimeField(null=True)
 
     class Meta:
+        indexes = (
+            # pending runs ordered by priority and grouped for fair share scheduling
+            (('status', 'priority'), False),
+            (('status', 'corsika_settings', 'primary_particle', 'priority'), False),
+            # successful runs with result files for the retention policy
+            (('status', 'location', 'cleaned_at'), False),
+            # progress and throughput of campaigns
+            (('campaign', 'status', 'finished_at'), False),
+        )
         constraints = [
             Check('n_showers >= 1'),
             Check('zenith_min >= 0'),
@@ -273,12 +359,38 @@ class CeresRun(BaseModel):
     priority = IntegerField(default=4)
     result_events_file = TextField(null=True)
     result_runheader_file = TextField(null=True)
+    # whether the input file was already in the node-local staging cache
+    staging_hit = BooleanField(null=True)
+    created_at = DateTimeField(default=datetime.utcnow, null=True)
+    # automatic retries of failed runs
+    attempts = IntegerField(default=0)
+    not_before = DateTimeField(null=True)
+    queued_at = DateTimeField(null=True)
+    started_at = DateTimeField(null=True)
+    # written by the monitor from the heartbeats of the executor
+    last_heartbeat = DateTimeField(null=True)
+    progress = IntegerField(null=True)
+    # resources used by the job, reported by the executor
+    peak_rss = BigIntegerField(null=True)
+    cpu_user = FloatField(null=True)
+    cpu_system = FloatField(null=True)
+    bytes_read = BigIntegerField(null=True)
+    bytes_written = BigIntegerField(null=True)
+    tmp_high_water = BigIntegerField(null=True)
+    campaign = ForeignKeyField(Campaign, null=True)
+    # time of the last status update other than running
+    finished_at = DateTimeField(null=True)
 
     class Meta:
         database = database
         indexes = (
             # unique index corsika run / ceres settings / off_target_distance / diffuse
             (('corsika_run', 'ceres_settings', 'off_target_distance', 'diffuse'), True),
+            # pending runs ordered by priority and grouped for fair share scheduling
+            (('status', 'priority'), False),
+            (('status', 'ceres_settings', 'priority'), False),
+            # progress and throughput of campaigns
+            (('campaign', 'status', 'finished_at'), False),
         )
 
     def build_mode_string(self):
@@ -337,6 +449,61 @@ class CeresRun(BaseModel):
         )
 
 
+# width of the zenith bins of the output file catalogue in degree
+ZENITH_BIN_WIDTH = 5
+
+
+def zenith_bin(zenith_min, zenith_max):
+    return int(0.5 * (zenith_min + zenith_max) // ZENITH_BIN_WIDTH)
+
+
+class OutputFile(BaseModel):
+    '''
+    Catalogue of the result files of successful runs, written by the monitor
+    from the status updates of the executors, so downstream analyses can
+    find files without walking and stat-ing the output directories.
+    The run parameters are denormalized into this table to select files
+    with a single indexed query.
+
+    Attributes
+    ----------
+    kind: str
+        "corsika", "ceres_events" or "ceres_runheader"
+    mode: str
+        the CERES mode as in the directory name, e.g. "diffuse_6d", None for CORSIKA
+    zenith_bin: int
+        index of the `ZENITH_BIN_WIDTH` bin containing the center of the zenith range
+    sha256: str
+        checksum of the compressed file, computed while compressing
+    n_events: int
+        number of simulated showers for CORSIKA, of events in the table for CERES files
+    '''
+    kind = CharField(max_length=16)
+    path = CharField(max_length=512, unique=True)
+    corsika_run = ForeignKeyField(CorsikaRun)
+    ceres_run = ForeignKeyField(CeresRun, null=True)
+    corsika_settings = ForeignKeyField(CorsikaSettings)
+    ceres_settings = ForeignKeyField(CeresSettings, null=True)
+    primary_particle = IntegerField()
+    mode = CharField(max_length=32, null=True)
+    zenith_bin = IntegerField()
+    size = BigIntegerField()
+    sha256 = CharField(max_length=64)
+    n_events = IntegerField(null=True)
+    created_at = DateTimeField(default=datetime.utcnow)
+
+    class Meta:
+        indexes = (
+            (
+                (
+                    'kind', 'ceres_settings', 'corsika_settings',
+                    'primary_particle', 'mode', 'zenith_bin',
+                ),
+                False,
+            ),
+        )
+
+
 status_names = (
     'created',
     'queued',
@@ -350,8 +517,11 @@ status_names = (
 def initialize_database():
     db_config = config.database
 
-    if db_config.kind == 'sqlite' and db_config.database != ':memory:':
-        os.makedirs(os.path.dirname(os.path.abspath(db_config.database)), exist_ok=True)
+    if db_config.kind == 'sqlite':
+        if db_config.database != ':memory:':
+            os.makedirs(
+                os.path.dirname(os.path.abspath(db_config.database)), exist_ok=True
+            )
         database.initialize(SqliteDatabase(db_config.database))
 
     elif config.database.kind == 'mysql':
@@ -367,11 +537,62 @@ def initialize_database():
         raise ValueError(f'Unsupported database kind: "{db_config.kind}"')
 
 
+MODELS = [
+    Status, JobCount, Campaign, CorsikaSettings, CorsikaRun,
+    CeresSettings, CeresRun, OutputFile,
+]
+
+
+def index_columns(model):
+    ''' Column names and uniqueness of all indexes of `model` '''
+    indexes = [
+        ((field.column_name, ), field.unique)
+        for field in model._meta.sorted_fields
+        if (field.index or field.unique) and not field.primary_key
+    ]
+    for fields, unique in model._meta.indexes:
+        columns = tuple(model._meta.fields[name].column_name for name in fields)
+        indexes.append((columns, unique))
+    return indexes
+
+
+def migrate_database():
+    '''
+    Add the columns and indexes of the models missing in existing tables,
+    created by an older version of mopro.
+    `create_tables` only creates missing tables, so new columns must be added here.
+    Only additions are supported, new columns must be nullable or have a default.
+    '''
+    migrator = SchemaMigrator.from_database(database.obj)
+
+    for model in MODELS:
+        table = model._meta.table_name
+        if not database.table_exists(table):
+            continue
+
+        columns = {column.name for column in database.get_columns(table)}
+        migrate(*[
+            migrator.add_column(table, field.column_name, field)
+            for field in model._meta.sorted_fields
+            if field.column_name not in columns
+        ])
+
+        # added foreign keys come with their index, so look up the indexes afterwards
+        indexes = {index.name for index in database.get_indexes(table)}
+        migrate(*[
+            migrator.add_index(table, columns, unique)
+            for columns, unique in index_columns(model)
+            if make_index_name(table, columns) not in indexes
+        ])
+
+
 def setup_database():
+    # new tables first, the migrated columns may reference them
     with database.atomic():
-        database.create_tables([
-            Status, CorsikaSettings, CorsikaRun, CeresSettings, CeresRun
-        ], safe=True)
+        database.create_tables(
+            [model for model in MODELS if not model.table_exists()], safe=True,
+        )
+    migrate_database()
 
     with database.atomic():
         for name in status_names:
@@ -0,0 +1,601 @@
+'''
+Local stand-in for Slurm, to test and load-test the `SlurmCluster`
+without a real cluster.
+
+A `FakeSlurmDaemon` keeps the job queue in memory and serves requests on
+a unix socket. The `sbatch`, `squeue` and `scancel` shims it writes into
+its `bin` directory forward their arguments to the daemon, so putting that
+directory first on the PATH makes the `SlurmCluster` talk to the daemon.
+
+Supported are the options used by mopro, array jobs (`--array`),
+partitions with a maximum walltime and a number of job slots,
+and the pending and running states. The job scripts are not executed,
+jobs run for `job_duration` seconds and then disappear from the queue.
+Each request waits `latency` seconds while holding the lock of the daemon,
+so an increased latency behaves like a slow, overloaded slurmctld.
+
+Only the standard library is used, the shims start quickly.
+'''
+import getpass
+import json
+import os
+import re
+import socket
+import socketserver
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+
+# squeue format field -> (header, attribute of FakeJob)
+SQUEUE_FIELDS = {
+    'i': ('JOBID', 'job_id_string'),
+    'A': ('JOBID', 'job_id'),
+    'K': ('ARRAY_TASK_ID', 'task_id_string'),
+    'j': ('NAME', 'name'),
+    'P': ('PARTITION', 'partition'),
+    'S': ('START_TIME', 'start_time_string'),
+    'T': ('STATE', 'state'),
+    't': ('ST', 'compact_state'),
+    'p': ('PRIORITY', 'priority_string'),
+    'u': ('USER', 'user'),
+    'V': ('SUBMIT_TIME', 'submit_time_string'),
+    'l': ('TIME_LIMIT', 'time_limit_string'),
+    'M': ('TIME', 'time_used_string'),
+    'D': ('NODES', 'n_nodes'),
+    'R': ('NODELIST(REASON)', 'reason'),
+}
+DEFAULT_SQUEUE_FORMAT = '%.18i %.9P %.8j %.8u %.2t %.10M %.6D %R'
+COMPACT_STATES = {'PENDING': 'PD', 'RUNNING': 'R'}
+
+# sbatch options taking a value, long name -> short name
+SBATCH_OPTIONS = {
+    'job-name': 'J', 'partition': 'p', 'output': 'o', 'error': 'e',
+    'time': 't', 'array': 'a', 'chdir': 'D', 'mem': None, 'mail-user': None,
+    'mail-type': None, 'export': None, 'nice': None,
+}
+SBATCH_FLAGS = {'get-user-env', 'parsable'}
+
+
+class SlurmError(Exception):
+    ''' Error of a slurm command, printed to stderr with exit code 1 '''
+
+
+def format_time(timestamp):
+    if timestamp is None:
+        return 'N/A'
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    if days:
+        return f'{days}-{hours:02d}:{minutes:02d}:{seconds:02d}'
+    if hours:
+        return f'{hours}:{minutes:02d}:{seconds:02d}'
+    return f'{minutes}:{seconds:02d}'
+
+
+def parse_time_limit(value):
+    '''
+    Parse an sbatch time limit into minutes, supported formats are
+    "minutes", "minutes:seconds", "hours:minutes:seconds",
+    "days-hours", "days-hours:minutes" and "days-hours:minutes:seconds"
+    '''
+    try:
+        days = 0
+        if '-' in value:
+            days, value = value.split('-')
+            parts = [int(p) for p in value.split(':')] + [0, 0]
+            hours, minutes, seconds = parts[:3]
+        else:
+            parts = [int(p) for p in value.split(':')]
+            if len(parts) == 3:
+                hours, minutes, seconds = parts
+            elif len(parts) <= 2:
+                hours = 0
+                minutes, seconds = (parts + [0])[:2]
+            else:
+                raise ValueError(value)
+    except ValueError:
+        raise SlurmError(f'sbatch: error: Invalid --time specification: {value}')
+    total = ((int(days) * 24 + hours) * 60 + minutes) * 60 + seconds
+    return -(-total // 60)
+
+
+def parse_array(value):
+    ''' Parse an array specification like "0-9", "1,3,5-7:2" or "0-99%10" '''
+    limit = None
+    if '%' in value:
+        value, limit = value.split('%')
+        limit = int(limit)
+
+    task_ids = []
+    try:
+        for part in value.split(','):
+            step = 1
+            if ':' in part:
+                part, step = part.split(':')
+                step = int(step)
+            first, _, last = part.partition('-')
+            task_ids.extend(range(int(first), int(last or first) + 1, step))
+    except ValueError:
+        raise SlurmError('sbatch: error: Invalid job array specification')
+    return sorted(set(task_ids)), limit
+
+
+def compress_ranges(ids):
+    ''' Format sorted ints like squeue, e.g. [1, 2, 3, 5] -> "1-3,5" '''
+    ranges = []
+    for i in ids:
+        if ranges and ranges[-1][1] == i - 1:
+            ranges[-1][1] = i
+        else:
+            ranges.append([i, i])
+    return ','.join(str(a) if a == b else f'{a}-{b}' for a, b in ranges)
+
+
+def split_options(args, options, flags, command):
+    '''
+    Split `args` into a dict of options and the positional arguments.
+    `options` maps long names of options taking a value to their short
+    name or None, `flags` are the long names of options without value.
+    Parsing stops at the first positional argument, like sbatch does.
+    '''
+    short_names = {short: name for name, short in options.items() if short}
+    parsed = {}
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg.startswith('--'):
+            name, has_value, value = arg[2:].partition('=')
+            if name in flags:
+                parsed[name] = True
+            elif name in options:
+                if not has_value:
+                    i += 1
+                    if i == len(args):
+                        raise SlurmError(
+                            f"{command}: option '--{name}' requires an argument"
+                        )
+                    value = args[i]
+                parsed[name] = value
+            else:
+                raise SlurmError(f"{command}: unrecognized option '{arg}'")
+        elif arg.startswith('-') and len(arg) > 1:
+            short = arg[1]
+            if short in flags:
+                parsed[short] = True
+            elif short in short_names:
+                value = arg[2:]
+                if not value:
+                    i += 1
+                    if i == len(args):
+                        raise SlurmError(
+                            f"{command}: option requires an argument -- '{short}'"
+                        )
+                    value = args[i]
+                parsed[short_names[short]] = value
+            else:
+                raise SlurmError(f"{command}: invalid option -- '{short}'")
+        else:
+            return parsed, args[i:]
+        i += 1
+    return parsed, []
+
+
+class FakeJob:
+    __slots__ = (
+        'job_id', 'task_id', 'array_limit', 'name', 'partition', 'user', 'nice',
+        'time_limit', 'submit_time', 'start_time', 'script', 'args',
+    )
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            setattr(self, name, kwargs.get(name))
+
+    @property
+    def state(self):
+        return 'PENDING' if self.start_time is None else 'RUNNING'
+
+    @property
+    def compact_state(self):
+        return COMPACT_STATES[self.state]
+
+    @property
+    def job_id_string(self):
+        if self.task_id is None:
+            return str(self.job_id)
+        return f'{self.job_id}_{self.task_id}'
+
+    @property
+    def task_id_string(self):
+        return 'N/A' if self.task_id is None else str(self.task_id)
+
+    @property
+    def priority_string(self):
+        return f'{max(0.0, 1 - 1e-4 * self.nice - 1e-8 * self.job_id):.8f}'
+
+    @property
+    def start_time_string(self):
+        return format_time(self.start_time)
+
+    @property
+    def submit_time_string(self):
+        return format_time(self.submit_time)
+
+    @property
+    def time_limit_string(self):
+        return format_duration(self.time_limit * 60)
+
+    @property
+    def time_used_string(self):
+        if self.start_time is None:
+            return '0:00'
+        return format_duration(time.time() - self.start_time)
+
+    @property
+    def n_nodes(self):
+        return 1
+
+    @property
+    def reason(self):
+        return '(Priority)' if self.start_time is None else 'fakenode'
+
+    @property
+    def sort_key(self):
+        return (self.nice, self.job_id, self.task_id or 0)
+
+
+class FakeSlurm:
+    '''
+    State of the fake cluster.
+
+    Parameters
+    ----------
+    partitions: dict
+        maps partition name to a tuple of the maximum walltime in minutes
+        and the number of job slots. The first partition is the default.
+    latency: float
+        seconds each command takes
+    job_duration: float
+        seconds a job runs, at most its time limit
+    '''
+
+    def __init__(self, partitions, latency=0, job_duration=60):
+        if not partitions:
+            raise ValueError('At least one partition is needed')
+        self.partitions = dict(partitions)
+        self.latency = latency
+        self.job_duration = job_duration
+        self.jobs = []
+        self.next_job_id = 1
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def handle(self, command, args, user):
+        ''' Run `command`, returns exit code, stdout and stderr '''
+        with self.lock:
+            self.calls[command] += 1
+            if self.latency:
+                time.sleep(self.latency)
+            self.schedule(time.time())
+            try:
+                if command == 'control':
+                    return 0, self.control(args), ''
+                if command not in ('sbatch', 'squeue', 'scancel'):
+                    raise SlurmError(f'Unknown command {command}')
+                return 0, getattr(self, command)(args, user), ''
+            except SlurmError as e:
+                return 1, '', str(e) + '\n'
+
+    def schedule(self, now):
+        ''' Remove finished jobs and start pending jobs in free slots '''
+        self.jobs = [
+            job for job in self.jobs
+            if job.start_time is None
+            or now - job.start_time < min(self.job_duration, job.time_limit * 60)
+        ]
+
+        started = [job for job in self.jobs if job.start_time is not None]
+        running = Counter(job.partition for job in started)
+        running_tasks = Counter(job.job_id for job in started if job.task_id is not None)
+        pending = sorted(
+            (job for job in self.jobs if job.start_time is None),
+            key=lambda job: job.sort_key,
+        )
+        for job in pending:
+            if running[job.partition] >= self.partitions[job.partition][1]:
+                continue
+            limit = job.array_limit
+            if limit is not None and running_tasks[job.job_id] >= limit:
+                continue
+            job.start_time = now
+            running[job.partition] += 1
+            if job.task_id is not None:
+                running_tasks[job.job_id] += 1
+
+    def sbatch(self, args, user):
+        options, positional = split_options(args, SBATCH_OPTIONS, SBATCH_FLAGS, 'sbatch')
+        if not positional:
+            raise SlurmError('sbatch: error: Batch script is empty!')
+        script, script_args = positional[0], positional[1:]
+        if not os.path.isfile(script):
+            raise SlurmError(f'sbatch: error: Unable to open file {script}')
+
+        partition = options.get('partition', next(iter(self.partitions)))
+        if partition not in self.partitions:
+            raise SlurmError(
+                'sbatch: error: Batch job submission failed: '
+                'Invalid partition name specified'
+            )
+
+        max_walltime = self.partitions[partition][0]
+        time_limit = max_walltime
+        if 'time' in options:
+            time_limit = parse_time_limit(options['time'])
+        if time_limit > max_walltime:
+            raise SlurmError(
+                'sbatch: error: Batch job submission failed: '
+                'Requested time limit is invalid (missing or exceeds some limit)'
+            )
+
+        task_ids, array_limit = [None], None
+        if 'array' in options:
+            task_ids, array_limit = parse_array(options['array'])
+
+        job_id = self.next_job_id
+        self.next_job_id += 1
+        now = time.time()
+        for task_id in task_ids:
+            self.jobs.append(FakeJob(
+                job_id=job_id,
+                task_id=task_id,
+                array_limit=array_limit,
+                name=options.get('job-name', os.path.basename(script)),
+                partition=partition,
+                user=user,
+                nice=int(options.get('nice', 0)),
+                time_limit=time_limit,
+                submit_time=now,
+                start_time=None,
+                script=script,
+                args=script_args,
+            ))
+
+        if options.get('parsable'):
+            return f'{job_id}\n'
+        return f'Submitted batch job {job_id}\n'
+
+    def select(self, options, positional=()):
+        ''' Jobs matching the filter options of squeue and scancel '''
+        jobs = self.jobs
+        if options.get('user'):
+            users = set(options['user'].split(','))
+            jobs = [job for job in jobs if job.user in users]
+        if options.get('name'):
+            names = set(options['name'].split(','))
+            jobs = [job for job in jobs if job.name in names]
+        if options.get('partition'):
+            partitions = set(options['partition'].split(','))
+            jobs = [job for job in jobs if job.partition in partitions]
+        if options.get('states'):
+            states = {s.upper() for s in options['states'].split(',')}
+            jobs = [
+                job for job in jobs
+                if job.state in states or job.compact_state in states
+            ]
+        job_ids = set(positional)
+        if options.get('jobs'):
+            job_ids.update(options['jobs'].split(','))
+        if job_ids:
+            jobs = [
+                job for job in jobs
+                if str(job.job_id) in job_ids or job.job_id_string in job_ids
+            ]
+        return jobs
+
+    def squeue(self, args, user):
+        options, positional = split_options(
+            args,
+            {
+                'user': 'u', 'format': 'o', 'name': 'n', 'partition': 'p',
+                'states': 't', 'jobs': 'j',
+            },
+            {'noheader', 'h', 'array', 'r'},
+            'squeue',
+        )
+        if positional:
+            raise SlurmError(f'squeue: error: Unrecognized option: {positional[0]}')
+
+        jobs = sorted(self.select(options), key=lambda job: job.sort_key)
+        rows = []
+        pending_tasks = {}
+        if options.get('array') or options.get('r'):
+            rows = jobs
+        else:
+            # pending tasks of an array job are shown in one line
+            for job in jobs:
+                if job.task_id is not None and job.start_time is None:
+                    if job.job_id not in pending_tasks:
+                        pending_tasks[job.job_id] = []
+                        rows.append(job)
+                    pending_tasks[job.job_id].append(job.task_id)
+                else:
+                    rows.append(job)
+
+        fmt = options.get('format') or DEFAULT_SQUEUE_FORMAT
+        fields = re.findall(r'%(\.?)(\d*)([a-zA-Z])|([^%]+)', fmt)
+
+        def render(values):
+            line = []
+            for (right, width, code, literal), value in zip(fields, values):
+                if literal:
+                    line.append(literal)
+                elif width:
+                    width = int(width)
+                    value = value[:width]
+                    line.append(value.rjust(width) if right else value.ljust(width))
+                else:
+                    line.append(value)
+            return ''.join(line)
+
+        for _, _, code, _ in fields:
+            if code and code not in SQUEUE_FIELDS:
+                raise SlurmError(f'squeue: error: Unsupported format field %{code}')
+
+        lines = []
+        if not (options.get('noheader') or options.get('h')):
+            lines.append(render([
+                SQUEUE_FIELDS[code][0] if code else '' for _, _, code, _ in fields
+            ]))
+
+        for job in rows:
+            values = []
+            for _, _, code, _ in fields:
+                if not code:
+                    values.append('')
+                    continue
+                value = str(getattr(job, SQUEUE_FIELDS[code][1]))
+                if job.start_time is None and job.job_id in pending_tasks:
+                    task_ids = pending_tasks[job.job_id]
+                    if code == 'i':
+                        value = f'{job.job_id}_[{compress_ranges(task_ids)}]'
+                    elif code == 'K':
+                        value = compress_ranges(task_ids)
+                values.append(value)
+            lines.append(render(values))
+
+        return ''.join(line + '\n' for line in lines)
+
+    def scancel(self, args, user):
+        options, positional = split_options(
+            args,
+            {'name': 'n', 'user': 'u', 'partition': 'p', 'states': 't'},
+            set(),
+            'scancel',
+        )
+        if not (options or positional):
+            raise SlurmError('scancel: error: No job identification provided')
+
+        cancelled = set(map(id, self.select(options, positional)))
+        self.jobs = [job for job in self.jobs if id(job) not in cancelled]
+        return ''
+
+    def control(self, args):
+        '''
+        Change or show the state of the daemon:
+        "latency SECONDS", "duration SECONDS" or "stats"
+        '''
+        if args[:1] == ['latency'] and len(args) == 2:
+            self.latency = float(args[1])
+        elif args[:1] == ['duration'] and len(args) == 2:
+            self.job_duration = float(args[1])
+        elif args != ['stats']:
+            raise SlurmError('Usage: control latency SECONDS|duration SECONDS|stats')
+
+        return json.dumps({
+            'latency': self.latency,
+            'job_duration': self.job_duration,
+            'calls': dict(self.calls),
+            'pending': sum(job.start_time is None for job in self.jobs),
+            'running': sum(job.start_time is not None for job in self.jobs),
+        }) + '\n'
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        returncode, stdout, stderr = self.server.slurm.handle(
+            request['command'], request['args'], request['user'],
+        )
+        response = {'returncode': returncode, 'stdout': stdout, 'stderr': stderr}
+        self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+class FakeSlurmServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, slurm):
+        super().__init__(path, RequestHandler)
+        self.slurm = slurm
+
+
+SHIM_TEMPLATE = '''#!{python}
+import sys
+sys.path.insert(0, {package_directory!r})
+from mopro.fake_slurm import run_client
+sys.exit(run_client({socket_path!r}, {command!r}, sys.argv[1:]))
+'''
+
+
+class FakeSlurmDaemon:
+    '''
+    Serves a `FakeSlurm` on `directory/slurm.sock` in a thread
+    and writes the shims into `directory/bin`.
+    '''
+
+    def __init__(self, directory, slurm):
+        self.slurm = slurm
+        self.socket_path = os.path.join(directory, 'slurm.sock')
+        self.bin_directory = os.path.join(directory, 'bin')
+        self.server = None
+        self.thread = None
+
+    def write_shims(self):
+        os.makedirs(self.bin_directory, exist_ok=True)
+        package_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        for command in ('sbatch', 'squeue', 'scancel'):
+            path = os.path.join(self.bin_directory, command)
+            with open(path, 'w') as f:
+                f.write(SHIM_TEMPLATE.format(
+                    python=sys.executable,
+                    package_directory=package_directory,
+                    socket_path=self.socket_path,
+                    command=command,
+                ))
+            os.chmod(path, 0o755)
+
+    def start(self):
+        self.write_shims()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.server = FakeSlurmServer(self.socket_path, self.slurm)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        os.remove(self.socket_path)
+
+
+def request(socket_path, command, args):
+    ''' Send `command` to the daemon, returns exit code, stdout and stderr '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(socket_path)
+        message = {'command': command, 'args': list(args), 'user': getpass.getuser()}
+        s.sendall(json.dumps(message).encode() + b'\n')
+        with s.makefile('rb') as f:
+            response = json.loads(f.readline())
+    return response['returncode'], response['stdout'], response['stderr']
+
+
+def run_client(socket_path, command, args):
+    ''' Entry point of the shims '''
+    try:
+        returncode, stdout, stderr = request(socket_path, command, args)
+    except OSError:
+        sys.stderr.write(
+            f'{command}: error: Unable to contact slurm controller (connect failure)\n'
+        )
+        return 1
+    sys.stdout.write(stdout)
+    sys.stderr.write(stderr)
+    return returncode
@@ -0,0 +1,265 @@
+'''
+Relocatable bundles of installed software.
+
+Building ROOT, MARS and CORSIKA takes from minutes to hours.
+A bundle is a zstd compressed tar archive of an installation directory
+with a manifest containing
+
+* the kind of software ("root", "mars" or "corsika"),
+* the key, a hash of everything the build depends on,
+  e.g. the version and `config_h` of the CORSIKA settings,
+* the sha256 checksum of every file,
+* the path the software was installed to.
+
+Importing a bundle verifies kind, key and checksums and replaces the
+original installation path in text files, e.g. `root-config` or `thisroot.sh`.
+Binaries are not modified, mopro sets PATH, LD_LIBRARY_PATH, MARSSYS
+and FLUPRO to the new location when running jobs.
+'''
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import subprocess as sp
+from datetime import datetime
+
+import click
+
+from ..config import config
+from .download import file_sha256
+
+
+log = logging.getLogger(__name__)
+
+MANIFEST = 'mopro_manifest.json'
+BUNDLE_KINDS = ('root', 'mars', 'corsika')
+
+
+def corsika_key(corsika_settings):
+    ''' Key of a CORSIKA installation for `corsika_settings` '''
+    h = hashlib.sha256()
+    h.update(str(corsika_settings.version).encode())
+    h.update(corsika_settings.config_h.encode())
+    h.update(bytes(corsika_settings.additional_files or b''))
+    return h.hexdigest()
+
+
+def mars_key(revision):
+    return hashlib.sha256(f'mars_r{revision}'.encode()).hexdigest()
+
+
+def root_key():
+    from .root import ROOT5_URL
+    return hashlib.sha256(ROOT5_URL.encode()).hexdigest()
+
+
+def bundle_name(kind, key):
+    return f'{kind}_{key[:16]}.tar.zst'
+
+
+def iter_files(directory):
+    ''' Paths of all regular files below `directory`, relative to it '''
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if os.path.isfile(path) and not os.path.islink(path):
+                yield os.path.relpath(path, directory)
+
+
+def export_bundle(directory, bundle_path, kind, key):
+    '''
+    Create the bundle `bundle_path` from the installation in `directory`.
+    The bundle is written to a temporary file first and renamed when complete.
+    '''
+    if kind not in BUNDLE_KINDS:
+        raise ValueError(f'Unknown bundle kind "{kind}"')
+
+    directory = os.path.abspath(directory)
+    manifest = {
+        'kind': kind,
+        'key': key,
+        'prefix': directory,
+        'created': datetime.utcnow().isoformat(),
+        'files': {
+            path: file_sha256(os.path.join(directory, path))
+            for path in iter_files(directory)
+            if path != MANIFEST
+        },
+    }
+
+    os.makedirs(os.path.dirname(os.path.abspath(bundle_path)), exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix='mopro_bundle_') as tmp_dir:
+        manifest_path = os.path.join(tmp_dir, MANIFEST)
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        tmp_bundle = bundle_path + '.tmp'
+        sp.run(
+            [
+                'tar', '-I', 'zstd -T0', '-cf', tmp_bundle,
+                '-C', tmp_dir, MANIFEST,
+                '-C', directory, '.',
+            ],
+            check=True, stdout=sp.PIPE, stderr=sp.PIPE,
+        )
+        os.rename(tmp_bundle, bundle_path)
+
+    log.info(f'Exported {kind} from {directory} into {bundle_path}')
+    return manifest
+
+
+def relocate(directory, old_prefix, new_prefix):
+    ''' Replace `old_prefix` with `new_prefix` in all text files '''
+    if old_prefix == new_prefix:
+        return
+
+    old, new = old_prefix.encode(), new_prefix.encode()
+    for path in iter_files(directory):
+        path = os.path.join(directory, path)
+        with open(path, 'rb') as f:
+            content = f.read()
+        # binaries are left alone
+        if b'\0' in content or old not in content:
+            continue
+        mode = os.stat(path).st_mode
+        with open(path, 'wb') as f:
+            f.write(content.replace(old, new))
+        os.chmod(path, mode)
+
+
+def import_bundle(bundle_path, directory, kind, key):
+    '''
+    Install the bundle `bundle_path` into the new `directory`,
+    after verifying it contains `kind` with the expected `key` and
+    that all files match their checksums.
+    The bundle is unpacked next to `directory` and renamed when complete.
+    '''
+    directory = os.path.abspath(directory)
+    if os.path.exists(directory):
+        raise ValueError(f'{directory} already exists')
+
+    parent = os.path.dirname(directory)
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix='.' + os.path.basename(directory) + '.', dir=parent)
+
+    try:
+        sp.run(
+            ['tar', '-I', 'zstd', '-xf', bundle_path, '-C', tmp_dir],
+            check=True, stdout=sp.PIPE, stderr=sp.PIPE,
+        )
+        with open(os.path.join(tmp_dir, MANIFEST)) as f:
+            manifest = json.load(f)
+        os.remove(os.path.join(tmp_dir, MANIFEST))
+
+        if manifest['kind'] != kind or manifest['key'] != key:
+            raise ValueError(
+                f'Bundle {bundle_path} contains'
+                f' {manifest["kind"]} {manifest["key"][:16]},'
+                f' expected {kind} {key[:16]}'
+            )
+
+        files = set(iter_files(tmp_dir))
+        if files != set(manifest['files']):
+            raise ValueError(f'Files in {bundle_path} do not match its manifest')
+        for path, checksum in manifest['files'].items():
+            if file_sha256(os.path.join(tmp_dir, path)) != checksum:
+                raise ValueError(f'Checksum mismatch for {path} in {bundle_path}')
+
+        relocate(tmp_dir, manifest['prefix'], directory)
+        os.chmod(tmp_dir, 0o755)
+        os.rename(tmp_dir, directory)
+    except:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    log.info(f'Imported {kind} from {bundle_path} into {directory}')
+    return manifest
+
+
+def install_from_bundle(directory, kind, key):
+    '''
+    Import the bundle for `kind` and `key` from `bundles.directory`
+    into `directory` if it exists. Returns True if a bundle was imported.
+    '''
+    if config.bundles.directory is None:
+        return False
+
+    bundle_path = os.path.join(config.bundles.directory, bundle_name(kind, key))
+    if not os.path.isfile(bundle_path):
+        return False
+
+    try:
+        import_bundle(bundle_path, directory, kind, key)
+    except (ValueError, OSError, sp.CalledProcessError):
+        log.exception(f'Could not import {bundle_path}, building from source')
+        return False
+    return True
+
+
+def export_if_configured(directory, kind, key):
+    ''' Export the new installation in `directory` if `bundles.export` is set '''
+    if config.bundles.directory is None or not config.bundles.export:
+        return
+
+    bundle_path = os.path.join(config.bundles.directory, bundle_name(kind, key))
+    if os.path.exists(bundle_path):
+        return
+
+    try:
+        export_bundle(directory, bundle_path, kind, key)
+    except (OSError, sp.CalledProcessError):
+        log.exception(f'Could not export {directory} into {bundle_path}')
+
+
+@click.group(name='mopro_bundle')
+def main():
+    ''' Export and import prebuilt software bundles '''
+
+
+@main.command(name='export')
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.argument('bundle', type=click.Path(dir_okay=False))
+@click.option('--kind', type=click.Choice(BUNDLE_KINDS), required=True)
+@click.option(
+    '--key', required=True, help='Hash of the build inputs, see `mopro_bundle key`',
+)
+def export_command(directory, bundle, kind, key):
+    export_bundle(directory, bundle, kind, key)
+
+
+@main.command(name='import')
+@click.argument('bundle', type=click.Path(exists=True, dir_okay=False))
+@click.argument('directory', type=click.Path(exists=False))
+@click.option('--kind', type=click.Choice(BUNDLE_KINDS), required=True)
+@click.option('--key', required=True)
+def import_command(bundle, directory, kind, key):
+    import_bundle(bundle, directory, kind, key)
+
+
+@main.command(name='key')
+@click.option('--kind', type=click.Choice(BUNDLE_KINDS), required=True)
+@click.option('--revision', type=int, help='MARS revision')
+@click.option('--corsika-settings', help='Name of the CORSIKA settings in the database')
+def key_command(kind, revision, corsika_settings):
+    ''' Print the key of a ROOT, MARS or CORSIKA installation '''
+    if kind == 'root':
+        click.echo(root_key())
+    elif kind == 'mars':
+        if revision is None:
+            raise click.UsageError('--revision is required for MARS')
+        click.echo(mars_key(revision))
+    else:
+        from ..database import database, initialize_database, CorsikaSettings
+        if corsika_settings is None:
+            raise click.UsageError('--corsika-settings is required for CORSIKA')
+        initialize_database()
+        with database.connection_context():
+            settings = CorsikaSettings.get(name=corsika_settings)
+        click.echo(corsika_key(settings))
+
+
+if __name__ == '__main__':
+    main()
@@ -6,7 +6,7 @@ from glob import glob
 import shutil
 
 from ..config import config
-from .download import download_and_unpack
+from .download import download_and_unpack, fetch_all
 
 
 log = logging.getLogger(__name__)
@@ -17,29 +17,54 @@ USER = 'corsika'
 FLUKA_URL = 'https://www.fluka.org/packages/fluka2011.2x-linux-gfor64bit-7.4-AA.tar.gz'
 
 
-def download_corsika(path, version=76900, timeout=300):
-    if os.path.exists(path):
-        raise ValueError('CORSIKA download path already exists')
-
+def corsika_url(version):
     version_dir = f'corsika-v{version // 1000:2d}0'
     basename = f'corsika-{version}'
     filename = basename + '.tar.gz'
+    return os.path.join(CORSIKA_URL, version_dir, filename)
+
+
+def corsika_auth():
+    return f'{USER}:{config.corsika_password}'
 
-    url = os.path.join(CORSIKA_URL, version_dir, filename)
-    auth = f'{USER}:{config.corsika_password}'
+
+def fluka_auth():
+    return f'{config.fluka_id}:{config.fluka_password}'
+
+
+def download_corsika(path, version=76900, timeout=300):
+    if os.path.exists(path):
+        raise ValueError('CORSIKA download path already exists')
 
     log.info(f'Downloading CORSIKA into {path}')
-    download_and_unpack(url, path, auth=auth, timeout=timeout, strip=1)
+    download_and_unpack(
+        corsika_url(version), path, auth=corsika_auth(), timeout=timeout, strip=1,
+    )
 
 
 def download_fluka(path, timeout=300):
     if os.path.exists(path):
         raise ValueError('FLUKA download path already exists')
 
-    auth = f'{config.fluka_id}:{config.fluka_password}'
-
     log.info(f'Downloading FLUKA into {path}')
-    download_and_unpack(FLUKA_URL, path, auth=auth, timeout=timeout)
+    download_and_unpack(FLUKA_URL, path, auth=fluka_auth(), timeout=timeout)
+
+
+def uses_fluka(config_h):
+    return any(
+        line.startswith('#define HAVE_FLUKA 1') for line in config_h.splitlines()
+    )
+
+
+def copy_tree(source, destination):
+    '''
+    Copy the directory `source` to `destination`, using copy-on-write
+    reflinks where the file system supports them
+    '''
+    sp.run(
+        ['cp', '-a', '--reflink=auto', source, destination],
+        check=True, stdout=sp.PIPE, stderr=sp.PIPE,
+    )
 
 
 def install_corsika(
@@ -49,8 +74,17 @@ def install_corsika(
     additional_files=None,
     download_timeout=300,
     install_timeout=120,
+    source_dir=None,
+    fluka_source_dir=None,
     stdout=sp.PIPE, stderr=sp.STDOUT,
 ):
+    '''
+    Build CORSIKA with `config_h` in `path`.
+
+    If `source_dir` (and `fluka_source_dir` for FLUKA builds) are given,
+    they are copied instead of downloading and unpacking the sources,
+    allowing multiple builds to share one unpacked source tree.
+    '''
     path = os.path.abspath(path)
     if os.path.exists(path):
         raise ValueError('CORSIKA install path already exists')
@@ -58,15 +92,26 @@ def install_corsika(
     env = os.environ.copy()
     env['F77'] = sp.check_output(['bash', '-c', 'which gfortran'])
 
-    use_fluka = False
-    for line in config_h.splitlines():
-        if line.startswith('#define HAVE_FLUKA 1'):
-            use_fluka = True
+    use_fluka = uses_fluka(config_h)
+
+    if use_fluka and (source_dir is None or fluka_source_dir is None):
+        # fill the download cache for both archives in parallel
+        fetch_all([
+            dict(url=corsika_url(version), auth=corsika_auth(), timeout=download_timeout),
+            dict(url=FLUKA_URL, auth=fluka_auth(), timeout=download_timeout),
+        ])
+
+    if source_dir is not None:
+        copy_tree(source_dir, path)
+    else:
+        download_corsika(path, version=version, timeout=download_timeout)
 
-    download_corsika(path, version=version, timeout=download_timeout)
     if use_fluka:
         fluka_dir = os.path.join(path, 'fluka')
-        download_fluka(fluka_dir, timeout=download_timeout)
+        if fluka_source_dir is not None:
+            copy_tree(fluka_source_dir, fluka_dir)
+        else:
+            download_fluka(fluka_dir, timeout=download_timeout)
         env['FLUPRO'] = fluka_dir
 
     with open(os.path.join(path, 'include', 'config.h'), 'w') as f:
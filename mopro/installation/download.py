@@ -1,41 +1,202 @@
+'''
+Downloads of the software archives with a local cache.
+
+Archives are stored in a cache directory, keyed by url and, if known,
+their sha256 checksum, so each archive is only downloaded once.
+Interrupted downloads are resumed using http range requests.
+A mirror, a local directory or any url including `file://`,
+is tried before the original url, which allows installations without
+internet access, e.g. on compute nodes.
+
+Archives are extracted into a temporary directory next to the target,
+which is renamed only after the extraction succeeded, so a failed
+or timed out extraction never leaves a half-filled directory behind.
+'''
 import subprocess as sp
 import os
+import fcntl
+import shutil
+import hashlib
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from ..config import config
+
+
+log = logging.getLogger(__name__)
+
+
+def cache_key(url, sha256=None):
+    ''' Name of the cache entry for `url` '''
+    url_hash = hashlib.sha256(url.encode()).hexdigest()[:16]
+    basename = os.path.basename(urlparse(url).path) or 'download'
+    if sha256 is not None:
+        return f'{url_hash}_{sha256[:16]}_{basename}'
+    return f'{url_hash}_{basename}'
+
 
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024**2), b''):
+            h.update(block)
+    return h.hexdigest()
 
-def download_and_unpack(url, path, auth=None, strip=0, timeout=300):
-    os.makedirs(path)
 
-    call = ['curl', '--silent', '-L', '--show-error', '--fail', '--anyauth']
+def mirror_url(url, mirror):
+    ''' Url of the archive of `url` on `mirror`, a directory or base url '''
+    basename = os.path.basename(urlparse(url).path)
+    if '://' not in mirror:
+        return 'file://' + os.path.join(os.path.abspath(mirror), basename)
+    return mirror.rstrip('/') + '/' + basename
+
+
+def curl(url, output, auth=None, timeout=300):
+    '''
+    Download `url` into `output`, continuing a partial file.
+    Raises IOError if the download fails.
+    '''
+    call = [
+        'curl', '--silent', '-L', '--show-error', '--fail',
+        '--continue-at', '-',
+        '--max-time', str(timeout),
+        '--output', output,
+    ]
     if auth is not None:
-        call.extend(['--user', auth])
+        call.extend(['--anyauth', '--user', auth])
     call.append(url)
 
-    curl = sp.Popen(
-        call,
-        stdout=sp.PIPE,
-        stderr=sp.PIPE,
-    )
-    tar = sp.Popen(
-        [
-            'tar',
-            'xz',               # uncompress
-            '-C', path,         # output into `path`
-            f'--strip={strip}'  # remove `strip` layers of toplevel directories
-        ],
-        stdin=curl.stdout,
-        stdout=sp.PIPE,
-        stderr=sp.PIPE
-    )
-
     try:
-        curl.wait(timeout=timeout)
-        tar.wait(timeout=timeout)
+        result = sp.run(call, stdout=sp.PIPE, stderr=sp.PIPE, timeout=timeout + 10)
     except sp.TimeoutExpired:
-        curl.kill()
-        tar.kill()
+        raise IOError(f'Timeout downloading {url}')
+
+    # 33: the server does not support ranges, start from scratch
+    if result.returncode == 33:
+        os.remove(output)
+        return curl(url, output, auth=auth, timeout=timeout)
+
+    if result.returncode != 0:
+        raise IOError(f'Error downloading {url}: {result.stderr.decode()}')
+
+
+def fetch(url, auth=None, sha256=None, timeout=300, cache_dir=None, mirror=None):
+    '''
+    Make sure the file at `url` is in the download cache, return its path.
+
+    Parameters
+    ----------
+    url: str
+        url of the file
+    auth: str
+        user:password for the original url, not sent to the mirror
+    sha256: str
+        expected checksum of the file, default is the entry for `url`
+        in `download.checksums` of the config. Not checked if None.
+    timeout: int
+        maximum time in seconds for each download attempt
+    cache_dir: str
+        the download cache, default is `download.cache_dir` from the config
+        or `<mopro_directory>/downloads`
+    mirror: str
+        directory or url tried before `url`, default is `download.mirror`
+    '''
+    if cache_dir is None:
+        cache_dir = config.download.cache_dir
+    if cache_dir is None:
+        cache_dir = os.path.join(config.mopro_directory, 'downloads')
+    if mirror is None:
+        mirror = config.download.mirror
+    if sha256 is None:
+        sha256 = (config.download.checksums or {}).get(url)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, cache_key(url, sha256))
+    partial = path + '.part'
+
+    # only one process downloads a file at a time
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        if os.path.isfile(path):
+            log.debug(f'Using cached download of {url}')
+            return path
+
+        sources = [(url, auth)]
+        if mirror:
+            sources.insert(0, (mirror_url(url, mirror), None))
+
+        errors = []
+        for source, source_auth in sources:
+            log.info(f'Downloading {source}')
+            try:
+                curl(source, partial, auth=source_auth, timeout=timeout)
+            except IOError as e:
+                log.warning(str(e))
+                errors.append(str(e))
+                # only partial downloads of the original url are resumed
+                if source != url and os.path.exists(partial):
+                    os.remove(partial)
+                continue
+
+            if sha256 is not None and file_sha256(partial) != sha256:
+                os.remove(partial)
+                errors.append(f'Checksum mismatch for {source}')
+                continue
+
+            os.rename(partial, path)
+            return path
+
+    raise IOError('\n'.join(errors))
+
+
+def fetch_all(downloads, max_workers=4):
+    '''
+    Fetch multiple files in parallel, `downloads` is a list of
+    dicts with the keyword arguments for `fetch`. Returns the paths.
+    '''
+    with ThreadPoolExecutor(max_workers) as pool:
+        futures = [pool.submit(fetch, **kwargs) for kwargs in downloads]
+        return [future.result() for future in futures]
+
+
+def unpack(archive, path, strip=0, timeout=300):
+    '''
+    Extract the tar.gz `archive` into the new directory `path`,
+    removing `strip` levels of toplevel directories.
+    '''
+    path = os.path.abspath(path)
+    if os.path.exists(path):
+        raise ValueError(f'{path} already exists')
+
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix='.' + os.path.basename(path) + '.', dir=parent)
+
+    try:
+        result = sp.run(
+            [
+                'tar',
+                'xzf', archive,     # uncompress
+                '-C', tmp_dir,      # output into the temporary directory
+                f'--strip={strip}'  # remove `strip` layers of toplevel directories
+            ],
+            stdout=sp.PIPE,
+            stderr=sp.PIPE,
+            timeout=timeout,
+        )
+        if result.returncode != 0:
+            raise IOError(f'Error untarring {archive}: {result.stderr.decode()}')
+
+        os.chmod(tmp_dir, 0o755)
+        os.rename(tmp_dir, path)
+    except:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
 
-    if curl.returncode != 0:
-        raise IOError(f'Error downloading {url}: {curl.stderr.read().decode()}')
 
-    if tar.returncode != 0:
-        raise IOError(f'Error untarring {url}: {tar.stderr.read().decode()}')
+def download_and_unpack(url, path, auth=None, strip=0, timeout=300, sha256=None):
+    archive = fetch(url, auth=auth, sha256=sha256, timeout=timeout)
+    unpack(archive, path, strip=strip, timeout=timeout)
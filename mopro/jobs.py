@@ -0,0 +1,179 @@
+'''
+Compact representation of the pending runs on the submit path.
+
+`get_pending_jobs` used to return full peewee model instances, each with
+its own `__data__` dict, dirty field tracking and joined model instances
+for the settings. The submitter only reads a few columns of each run,
+so the pending runs are now fetched as tuples into `__slots__` classes.
+The settings are loaded once per settings id and shared by all runs.
+
+The specs provide the attributes and properties of the models
+used by the `prepare_*_job` functions, the templates of the input cards
+and rc files, the walltime estimator and the scheduling simulation.
+`model` is the peewee model of the run, e.g. to update its status.
+'''
+from .database import CorsikaRun, CeresRun, CorsikaSettings, CeresSettings
+
+
+class JobSpec:
+    __slots__ = ()
+    model = None
+    # names of the columns selected by `columns()`, in the same order
+    fields = ()
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            setattr(self, name, kwargs.pop(name, None))
+        if kwargs:
+            raise TypeError('Unknown fields: ' + ', '.join(kwargs))
+
+    @classmethod
+    def columns(cls):
+        return [getattr(cls.model, name) for name in cls.fields]
+
+    @classmethod
+    def from_row(cls, row):
+        ''' Create a spec from a row of a query selecting `columns()` '''
+        spec = cls.__new__(cls)
+        for name, value in zip(cls.fields, row):
+            setattr(spec, name, value)
+        return spec
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join(
+            f'{name}={getattr(self, name, None)!r}' for name in self.fields
+        ))
+
+
+class CorsikaJobSpec(JobSpec):
+    model = CorsikaRun
+    fields = (
+        'id',
+        'corsika_settings_id',
+        'primary_particle',
+        'n_showers',
+        'zenith_min',
+        'zenith_max',
+        'azimuth_min',
+        'azimuth_max',
+        'energy_min',
+        'energy_max',
+        'spectral_index',
+        'viewcone',
+        'reuse',
+        'max_radius',
+        'bunch_size',
+        'priority',
+        'walltime',
+        'attempts',
+    )
+    __slots__ = fields + ('corsika_settings', 'score')
+
+    directory_name = CorsikaRun.directory_name
+    basename = CorsikaRun.basename
+    logfile = CorsikaRun.logfile
+
+
+class CeresInputSpec(JobSpec):
+    ''' The successful CORSIKA run used as input of a CERES run '''
+    model = CorsikaRun
+    fields = (
+        'id',
+        'corsika_settings_id',
+        'primary_particle',
+        'zenith_min',
+        'zenith_max',
+        'azimuth_min',
+        'azimuth_max',
+        'viewcone',
+        'result_file',
+    )
+    __slots__ = fields + ('corsika_settings', )
+
+
+class CeresJobSpec(JobSpec):
+    model = CeresRun
+    fields = (
+        'id',
+        'ceres_settings_id',
+        'corsika_run_id',
+        'off_target_distance',
+        'diffuse',
+        'priority',
+        'walltime',
+        'attempts',
+    )
+    __slots__ = fields + ('ceres_settings', 'corsika_run', 'score')
+
+    build_mode_string = CeresRun.build_mode_string
+    directory_name = CeresRun.directory_name
+    basename = CeresRun.basename
+    logfile = CeresRun.logfile
+
+
+def load_settings(model, ids, exclude=()):
+    '''
+    Map id to settings instance for all `ids`,
+    must be called with an open connection
+    '''
+    if not ids:
+        return {}
+    fields = [f for f in model._meta.sorted_fields if f.name not in exclude]
+    query = model.select(*fields).where(model.id.in_(sorted(ids)))
+    return {settings.id: settings for settings in query}
+
+
+def corsika_specs(rows):
+    '''
+    CORSIKA job specs from the rows of a query selecting
+    `CorsikaJobSpec.columns()` and the score
+    '''
+    n_fields = len(CorsikaJobSpec.fields)
+    specs = []
+    for row in rows:
+        spec = CorsikaJobSpec.from_row(row)
+        spec.score = row[n_fields]
+        specs.append(spec)
+
+    # the archive of additional files is only needed to build CORSIKA
+    settings = load_settings(
+        CorsikaSettings, {s.corsika_settings_id for s in specs},
+        exclude=('additional_files', ),
+    )
+    for spec in specs:
+        spec.corsika_settings = settings[spec.corsika_settings_id]
+    return specs
+
+
+def ceres_specs(rows):
+    '''
+    CERES job specs from the rows of a query selecting `CeresJobSpec.columns()`,
+    `CeresInputSpec.columns()` and the score
+    '''
+    n_fields = len(CeresJobSpec.fields)
+    n_input = len(CeresInputSpec.fields)
+    specs = []
+    inputs = {}
+    for row in rows:
+        spec = CeresJobSpec.from_row(row)
+        # runs of the same CORSIKA run share their input spec
+        corsika_run = inputs.get(spec.corsika_run_id)
+        if corsika_run is None:
+            corsika_run = CeresInputSpec.from_row(row[n_fields:n_fields + n_input])
+            inputs[spec.corsika_run_id] = corsika_run
+        spec.corsika_run = corsika_run
+        spec.score = row[n_fields + n_input]
+        specs.append(spec)
+
+    ceres_settings = load_settings(
+        CeresSettings, {s.ceres_settings_id for s in specs}, exclude=('resource_files', )
+    )
+    corsika_settings = load_settings(
+        CorsikaSettings, {r.corsika_settings_id for r in inputs.values()},
+        exclude=('additional_files', ),
+    )
+    for spec in specs:
+        spec.ceres_settings = ceres_settings[spec.ceres_settings_id]
+    for corsika_run in inputs.values():
+        corsika_run.corsika_settings = corsika_settings[corsika_run.corsika_settings_id]
+    return specs
@@ -1,9 +1,12 @@
-from threading import Thread, Event
+from threading import Thread, Event, Lock
+import asyncio
 import subprocess as sp
 import logging
 from collections import namedtuple, deque
 import os
-from psutil import Process
+import json
+import sqlite3
+from psutil import Process, NoSuchProcess, STATUS_ZOMBIE
 from .cluster import Cluster
 
 
@@ -13,8 +16,6 @@ Job = namedtuple(
 )
 
 
-
-
 def terminate_process_group(pid):
     '''Send sigterm to a process id and its children'''
     p = Process(pid)
@@ -23,15 +24,191 @@ def terminate_process_group(pid):
     p.terminate()
 
 
+class AdoptedProcess:
+    '''
+    Handle for a job process started by a previous instance of the
+    `LocalCluster`, offering the parts of the `Popen` interface we use.
+    Its exit code is unknown, the job status is reported by the executor anyway.
+    '''
+
+    def __init__(self, pid, create_time):
+        self.pid = pid
+        self.process = Process(pid)
+        # make sure the pid was not reused by an unrelated process
+        if abs(self.process.create_time() - create_time) > 1:
+            raise NoSuchProcess(pid)
+
+    def poll(self):
+        try:
+            if self.process.is_running() and self.process.status() != STATUS_ZOMBIE:
+                return None
+        except NoSuchProcess:
+            pass
+        return 0
+
+
+class AsyncProcess:
+    ''' Popen-like handle for a job process started in the event loop '''
+
+    def __init__(self, process):
+        self.process = process
+        self.pid = process.pid
+
+    def poll(self):
+        return self.process.returncode
+
+
+class Journal:
+    '''
+    Small SQLite file keeping the queue and the running processes
+    of a `LocalCluster`, so that both survive a restart of the submitter.
+
+    Of the job environments only the differences to the environment of the
+    submitter are stored, so credentials in the latter are not written to disk.
+    The file is only readable by its owner.
+    '''
+
+    def __init__(self, path):
+        self.lock = Lock()
+        # sqlite creates its temporary files with the permissions of the database
+        os.close(os.open(path, os.O_WRONLY | os.O_CREAT, 0o600))
+        self.connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        with self.lock:
+            self.connection.executescript('''
+                CREATE TABLE IF NOT EXISTS queue (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_name TEXT NOT NULL,
+                    job TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS running (
+                    job_name TEXT PRIMARY KEY,
+                    pid INTEGER NOT NULL,
+                    create_time REAL NOT NULL
+                );
+            ''')
+
+    def load(self):
+        '''
+        Returns the list of queued `Job`s in submission order
+        and the list of (job_name, pid, create_time) of started jobs
+        '''
+        with self.lock:
+            queued = [
+                self.decode_job(job) for job, in
+                self.connection.execute('SELECT job FROM queue ORDER BY id')
+            ]
+            running = list(self.connection.execute(
+                'SELECT job_name, pid, create_time FROM running'
+            ))
+        return queued, running
+
+    def add_queued(self, job):
+        with self.lock:
+            self.connection.execute(
+                'INSERT INTO queue (job_name, job) VALUES (?, ?)',
+                (job.job_name, self.encode_job(job)),
+            )
+
+    @staticmethod
+    def encode_job(job):
+        ''' Serialize `job` with only the changed variables of its environment '''
+        env = job.env
+        if env is not None:
+            # removed variables are stored as null
+            env = {name: None for name in os.environ if name not in env}
+            env.update({
+                name: value for name, value in job.env.items()
+                if os.environ.get(name) != value
+            })
+        return json.dumps(job._replace(env=env)._asdict())
+
+    @staticmethod
+    def decode_job(data):
+        ''' Inverse of `encode_job` '''
+        job = Job(**json.loads(data))
+        if job.env is not None:
+            env = os.environ.copy()
+            for name, value in job.env.items():
+                if value is None:
+                    env.pop(name, None)
+                else:
+                    env[name] = value
+            job = job._replace(env=env)
+        return job
+
+    def remove_queued(self, job_name):
+        with self.lock:
+            self.connection.execute('DELETE FROM queue WHERE job_name = ?', (job_name, ))
+
+    def start(self, job_name, pid, create_time):
+        with self.lock, self.connection:
+            self.connection.execute('BEGIN')
+            self.connection.execute('DELETE FROM queue WHERE job_name = ?', (job_name, ))
+            self.connection.execute(
+                'INSERT OR REPLACE INTO running VALUES (?, ?, ?)',
+                (job_name, pid, create_time),
+            )
+
+    def finish(self, job_name):
+        with self.lock:
+            self.connection.execute(
+                'DELETE FROM running WHERE job_name = ?', (job_name, )
+            )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
 class LocalCluster(Cluster, Thread):
+    '''
+    Run jobs as local processes, at most `max_workers` at a time.
+
+    If a `journal` file is given, the queue and the pids of the running
+    jobs are stored in it. A new instance using the same journal continues
+    the queue and adopts the still running processes, which run in
+    their own process group and are not affected by the restart.
+    '''
     log = logging.getLogger(__name__)
 
-    def __init__(self, max_workers):
+    def __init__(self, max_workers, journal=None):
         super().__init__()
         self.max_workers = max_workers
         self.event = Event()
         self.queue = deque()
         self.running_jobs = {}
+        self.journal = None
+        # set while running in an event loop by `run_async`
+        self.loop = None
+        self.changed = None
+
+        if journal is not None:
+            self.journal = Journal(journal)
+            self.restore()
+
+    def restore(self):
+        ''' Load the queue and adopt the running processes from the journal '''
+        queued, running = self.journal.load()
+        self.queue.extend(queued)
+
+        for job_name, pid, create_time in running:
+            try:
+                process = AdoptedProcess(pid, create_time)
+            except NoSuchProcess:
+                process = None
+
+            if process is not None and process.poll() is None:
+                self.running_jobs[job_name] = process
+            else:
+                self.journal.finish(job_name)
+
+        if self.queue or self.running_jobs:
+            self.log.info(
+                f'Restored {len(self.queue)} queued jobs and adopted'
+                f' {len(self.running_jobs)} running jobs from journal'
+            )
 
     def submit_job(
         self,
@@ -51,13 +228,21 @@ class LocalCluster(Cluster, Thread):
         if self.event.is_set():
             raise ValueError('Cluster was already terminated')
 
-        self.queue.append(Job(executable, args, env, stdout, stderr, job_name, walltime))
+        job = Job(executable, args, env, stdout, stderr, job_name, walltime)
+        if self.journal is not None:
+            self.journal.add_queued(job)
+        self.queue.append(job)
+        self.notify()
 
     def terminate(self):
         self.log.info('Local cluster terminating')
         self.event.set()
+        self.notify()
         super().terminate()
-        self.join()
+        if self.is_alive():
+            self.join()
+        if self.journal is not None:
+            self.journal.close()
 
     def kill_job(self, job_name):
         job = self.running_jobs.get(job_name)
@@ -69,6 +254,8 @@ class LocalCluster(Cluster, Thread):
             job for job in self.queue
             if job.job_name != job_name
         ])
+        if self.journal is not None:
+            self.journal.remove_queued(job_name)
 
     def start(self):
         self.log.info(f'Starting local cluster with {self.max_workers} workers max')
@@ -76,11 +263,7 @@ class LocalCluster(Cluster, Thread):
 
     def run(self):
         while not self.event.is_set():
-            # remove finished jobs from the list of running jobs
-            self.running_jobs = {
-                name: job for name, job in self.running_jobs.items()
-                if job.poll() is None
-            }
+            self.remove_finished()
 
             # check if we can start a new job
             if self.n_running < self.max_workers and self.n_queued > 0:
@@ -89,11 +272,56 @@ class LocalCluster(Cluster, Thread):
             else:
                 self.event.wait(1)
 
-    def start_job(self, job):
-        cmd = [job.executable]
-        if job.args is not None:
-            cmd.extend(job.args)
+    def notify(self):
+        ''' Wake up `run_async`, may be called from any thread '''
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.changed.set)
+
+    async def run_async(self):
+        '''
+        Run the cluster in the current event loop instead of the thread.
+        Waits for new jobs and terminating processes instead of polling,
+        only adopted processes, which are not our children, are checked every second.
+        '''
+        self.log.info(f'Running local cluster with {self.max_workers} workers max')
+        self.changed = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+
+        while not self.event.is_set():
+            self.changed.clear()
+            self.remove_finished()
 
+            while self.n_running < self.max_workers and self.n_queued > 0:
+                await self.start_job_async(self.queue.popleft())
+
+            adopted = any(
+                isinstance(job, AdoptedProcess) for job in self.running_jobs.values()
+            )
+            try:
+                await asyncio.wait_for(self.changed.wait(), 1 if adopted else None)
+            except asyncio.TimeoutError:
+                pass
+
+        self.loop = None
+
+    def remove_finished(self):
+        ''' Remove finished jobs from the list of running jobs '''
+        finished = [
+            name for name, job in self.running_jobs.items()
+            if job.poll() is not None
+        ]
+        if finished:
+            self.running_jobs = {
+                name: job for name, job in self.running_jobs.items()
+                if name not in finished
+            }
+            if self.journal is not None:
+                for name in finished:
+                    self.journal.finish(name)
+
+    @staticmethod
+    def open_output(job):
+        ''' Open the stdout and stderr files of `job` '''
         if job.stdout is not None:
             stdout = open(job.stdout, 'w')
         else:
@@ -104,12 +332,52 @@ class LocalCluster(Cluster, Thread):
         else:
             stderr = sp.STDOUT
 
+        return stdout, stderr
+
+    def start_job(self, job):
+        cmd = [job.executable]
+        if job.args is not None:
+            cmd.extend(job.args)
+
+        stdout, stderr = self.open_output(job)
         p = sp.Popen(
             cmd, env=job.env,
             stdout=stdout, stderr=stderr,
             preexec_fn=os.setpgrp,  # detach process, does not directly die on CTRL-C
         )
         self.running_jobs[job.job_name] = p
+        if self.journal is not None:
+            self.journal_start(job.job_name, p.pid)
+
+    async def start_job_async(self, job):
+        cmd = [job.executable]
+        if job.args is not None:
+            cmd.extend(job.args)
+
+        stdout, stderr = self.open_output(job)
+        process = await asyncio.create_subprocess_exec(
+            *cmd, env=job.env,
+            stdout=stdout, stderr=stderr,
+            preexec_fn=os.setpgrp,  # detach process, does not directly die on CTRL-C
+        )
+        self.running_jobs[job.job_name] = AsyncProcess(process)
+        if self.journal is not None:
+            self.journal_start(job.job_name, process.pid)
+
+        # wake up the run loop when the process terminates
+        self.loop.create_task(process.wait()).add_done_callback(
+            lambda task: self.changed.set()
+        )
+
+    def journal_start(self, job_name, pid):
+        ''' Move a started job from the queue to the running jobs of the journal '''
+        try:
+            create_time = Process(pid).create_time()
+        except NoSuchProcess:
+            # already finished and reaped, there is nothing to adopt after a restart
+            self.journal.remove_queued(job_name)
+            return
+        self.journal.start(job_name, pid, create_time)
 
     @property
     def n_running(self):
@@ -0,0 +1,4 @@
+# Keep this package free of imports:
+# the executors mopro.processing.run_corsika and run_ceres are started for every job
+# on the worker nodes and must only import the standard library, zmq and their
+# helper modules in this package, see tests/test_imports.py
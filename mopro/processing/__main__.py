@@ -1,3 +1,4 @@
+import asyncio
 import click
 import logging
 import time
@@ -6,9 +7,15 @@ import os
 from ..database import initialize_database
 from .monitor import JobMonitor
 from .submitter import JobSubmitter
+from .daemon import ProcessingDaemon
+from .builds import CorsikaBuilder
 from ..config import config
 from ..slurm import SlurmCluster
 from ..local import LocalCluster
+from ..scheduling import build_policy
+from ..walltime import WalltimeEstimator
+from ..storage import StorageThrottle
+from ..retention import RetentionPolicy
 
 log = logging.getLogger('mopro.processing.main')
 
@@ -22,7 +29,12 @@ log = logging.getLogger('mopro.processing.main')
 @click.option(
     '--verbose', '-v', help='Set log level of "erna" to debug', is_flag=True,
 )
-def main(config_file, verbose):
+@click.option(
+    '--threaded', is_flag=True,
+    help='Run monitor, submitter and local cluster in polling threads'
+    ' instead of a single asyncio event loop',
+)
+def main(config_file, verbose, threaded):
 
     if config_file is not None:
         config.load_yaml(config_file)
@@ -47,16 +59,61 @@ def main(config_file, verbose):
     initialize_database()
 
     if config.submitter.mode == 'local':
-        cluster = LocalCluster(config.local.cores)
-        cluster.start()
+        cluster = LocalCluster(config.local.cores, journal=config.local.journal)
+        if threaded:
+            cluster.start()
     else:
         cluster = SlurmCluster(
             mail_address=config.slurm.mail_address,
             mail_settings=config.slurm.mail_settings,
             partitions=config.slurm.partitions,
+            export=config.slurm.export,
+        )
+
+    walltime_estimator = None
+    if config.walltime.estimate:
+        walltime_estimator = WalltimeEstimator(
+            safety_factor=config.walltime.safety_factor,
+            margin=config.walltime.margin,
+            min_runs=config.walltime.min_runs,
+            max_runs=config.walltime.max_runs,
+            refit_interval=config.walltime.refit_interval,
+        )
+
+    storage_throttle = None
+    if config.storage.min_free is not None or config.storage.tmp_min_free is not None:
+        # on a cluster, tmp_dir is node-local unless configured as shared
+        tmp_min_free = config.storage.tmp_min_free
+        if config.submitter.mode != 'local' and not config.storage.shared_tmp:
+            if tmp_min_free is not None:
+                log.warning('Ignoring storage.tmp_min_free, tmp_dir is not shared_tmp')
+            tmp_min_free = None
+
+        storage_throttle = StorageThrottle(
+            config.mopro_directory,
+            tmp_dir=config.tmp_dir,
+            min_free=config.storage.min_free,
+            tmp_min_free=tmp_min_free,
+            safety_factor=config.storage.safety_factor,
+            refresh_interval=config.storage.refresh_interval,
+        )
+
+    retention = None
+    if config.retention.ceres_settings:
+        retention = RetentionPolicy(
+            config.retention.ceres_settings,
+            action=config.retention.action,
+            archive_directory=config.retention.archive_directory,
+            mopro_directory=config.mopro_directory,
+            batch_size=config.retention.batch_size,
         )
+        # warns early about settings missing in the database
+        retention.resolve_settings()
 
-    job_monitor = JobMonitor(port=config.submitter.port)
+    job_monitor = JobMonitor(
+        port=config.submitter.port,
+        flush_interval=config.heartbeat.flush_interval,
+    )
     job_submitter = JobSubmitter(
         mopro_directory=config.mopro_directory,
         interval=config.submitter.interval,
@@ -68,8 +125,33 @@ def main(config_file, verbose):
         tmp_dir=config.tmp_dir,
         ceres_memory=config.ceres_memory,
         corsika_memory=config.corsika_memory,
+        reconcile_interval=config.submitter.reconcile_interval,
+        staging=config.staging,
+        group_ceres=config.submitter.group_ceres,
+        policy=build_policy(config.scheduling),
+        retry=config.retry,
+        walltime_estimator=walltime_estimator,
+        heartbeat_interval=config.heartbeat.interval,
+        heartbeat_timeout=config.heartbeat.timeout,
+        builder=CorsikaBuilder(
+            config.mopro_directory,
+            max_parallel=config.builds.max_parallel,
+            install_timeout=config.builds.timeout,
+        ),
+        storage_throttle=storage_throttle,
+        retention=retention,
     )
 
+    if threaded:
+        run_threaded(job_monitor, job_submitter, cluster)
+    else:
+        daemon = ProcessingDaemon(
+            job_monitor, job_submitter, cluster, shutdown_cluster=shutdown_cluster,
+        )
+        asyncio.run(daemon.run())
+
+
+def run_threaded(job_monitor, job_submitter, cluster):
     log.info('Starting main loop')
     try:
         job_monitor.start()
@@ -83,24 +165,11 @@ def main(config_file, verbose):
         job_submitter.join()
         log.info('Submitter shut down')
 
-        cluster.cancel_queued()
-        log.info('Cancelled queued jobs')
-
-        if cluster.n_running > 0:
-            answer = click.confirm('Do you want to wait for running jobs?')
-            if not answer:
-                cluster.cancel_running()
-                log.info('Cleaned up runnig jobs')
-            else:
-                try:
-                    while cluster.n_running > 0:
-                        log.info('Waiting for {} running jobs to finish'.format(
-                            cluster.n_running
-                        ))
-                        time.sleep(10)
-                except (KeyboardInterrupt, SystemExit):
-                    cluster.cancel_running()
-                    log.info('Cleaned up runnig jobs')
+        try:
+            shutdown_cluster(cluster)
+        except (KeyboardInterrupt, SystemExit):
+            cluster.cancel_running()
+            log.info('Cleaned up runnig jobs')
 
         cluster.terminate()
         log.info('Cluster shut down')
@@ -109,5 +178,33 @@ def main(config_file, verbose):
         log.info('Monitor shut down')
 
 
+def shutdown_cluster(cluster):
+    '''
+    Cancel the queued jobs and ask whether to wait for the running jobs,
+    unless a local cluster keeps them in its journal
+    '''
+    if getattr(cluster, 'journal', None) is not None:
+        # queued and running jobs are taken over by the next start
+        log.info('Keeping {} queued and {} running jobs in the journal'.format(
+            cluster.n_queued, cluster.n_running
+        ))
+        return
+
+    cluster.cancel_queued()
+    log.info('Cancelled queued jobs')
+
+    if cluster.n_running > 0:
+        answer = click.confirm('Do you want to wait for running jobs?')
+        if not answer:
+            cluster.cancel_running()
+            log.info('Cleaned up runnig jobs')
+        else:
+            while cluster.n_running > 0:
+                log.info('Waiting for {} running jobs to finish'.format(
+                    cluster.n_running
+                ))
+                time.sleep(10)
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,135 @@
+'''
+Resource accounting for the child processes of the executors.
+
+CPU times and io are taken from `getrusage` for the terminated children.
+The peak memory of `RUSAGE_CHILDREN` is the maximum over all children
+of the executor, so children whose memory is accounted to a run are
+waited for with `ResourceMonitor.wait` or started with `run_process`,
+which take the peak memory of the single child from `os.wait4`.
+The high-water mark of the tmp directory is sampled in a background thread.
+
+The block io only counts reads and writes of local file systems,
+io over NFS or other network file systems is not included.
+
+This module is used by the executors and must only depend on the standard library.
+'''
+import os
+import time
+import resource
+import subprocess as sp
+from threading import Thread, Event
+
+
+def directory_size(path):
+    ''' Disk usage of all files below `path` in bytes '''
+    size = 0
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        size += directory_size(entry.path)
+                    else:
+                        size += entry.stat(follow_symlinks=False).st_blocks * 512
+                except FileNotFoundError:
+                    pass
+    except FileNotFoundError:
+        pass
+    return size
+
+
+class ResourceMonitor(Thread):
+    '''
+    Measure the resources used by child processes terminated between
+    `start` and `stop`, sampling the size of `tmp_dir` every `interval` seconds.
+
+    `stop` returns a dict with the columns stored for each run:
+    peak_rss, bytes_read, bytes_written, tmp_high_water in bytes,
+    cpu_user and cpu_system in seconds.
+    peak_rss is the maximum of the children passed to `wait`
+    or started by `run_process`, None if there were none.
+    '''
+
+    def __init__(self, tmp_dir, interval=30):
+        super().__init__(daemon=True)
+        self.tmp_dir = tmp_dir
+        self.interval = interval
+        self.event = Event()
+        self.tmp_high_water = 0
+        self.peak_rss = None
+        self.usage_before = None
+
+    def start(self):
+        self.usage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        super().start()
+        return self
+
+    def run(self):
+        while not self.event.is_set():
+            self.sample()
+            self.event.wait(self.interval)
+
+    def wait(self, process, timeout=None, poll_interval=0.1):
+        '''
+        Wait for the `subprocess.Popen` `process` like `process.wait`,
+        and record its peak memory.
+        Raises `TimeoutExpired` if it is still running after `timeout` seconds.
+        '''
+        if process.returncode is not None:
+            # already waited for, the resource usage is lost
+            return process.returncode
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        options = 0 if deadline is None else os.WNOHANG
+        while True:
+            pid, status, usage = os.wait4(process.pid, options)
+            if pid != 0:
+                break
+            if time.monotonic() > deadline:
+                raise sp.TimeoutExpired(process.args, timeout)
+            time.sleep(poll_interval)
+
+        if os.WIFSIGNALED(status):
+            process.returncode = -os.WTERMSIG(status)
+        else:
+            process.returncode = os.WEXITSTATUS(status)
+
+        # in KiB on linux
+        self.peak_rss = max(self.peak_rss or 0, usage.ru_maxrss * 1024)
+        return process.returncode
+
+    def run_process(self, args, timeout=None, **kwargs):
+        '''
+        Run `args` like `subprocess.run(args, check=True, timeout=timeout)`
+        and record its peak memory.
+        '''
+        with sp.Popen(args, **kwargs) as process:
+            try:
+                self.wait(process, timeout=timeout)
+            except:
+                process.kill()
+                self.wait(process)
+                raise
+
+        if process.returncode != 0:
+            raise sp.CalledProcessError(process.returncode, args)
+
+    def sample(self):
+        self.tmp_high_water = max(self.tmp_high_water, directory_size(self.tmp_dir))
+
+    def stop(self):
+        self.event.set()
+        self.join()
+        self.sample()
+
+        before = self.usage_before
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return dict(
+            peak_rss=self.peak_rss,
+            cpu_user=after.ru_utime - before.ru_utime,
+            cpu_system=after.ru_stime - before.ru_stime,
+            # block io is counted in units of 512 bytes
+            bytes_read=(after.ru_inblock - before.ru_inblock) * 512,
+            bytes_written=(after.ru_oublock - before.ru_oublock) * 512,
+            tmp_high_water=self.tmp_high_water,
+        )
@@ -0,0 +1,179 @@
+'''
+Concurrent builds of the CORSIKA settings needed by pending runs.
+
+Without this, each missing CORSIKA installation is built inside
+`prepare_corsika_job`, one after the other. The `CorsikaBuilder` collects
+all missing settings of the pending runs, unpacks the sources of each
+CORSIKA version and FLUKA only once and builds all settings in parallel
+from copy-on-write copies of these source trees.
+`coconut -b` compiles sequentially, so each build uses about one core
+and `max_parallel` is the CPU budget for builds.
+'''
+import os
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from ..database import database, CorsikaRun, CorsikaSettings
+from ..installation.bundle import corsika_key, install_from_bundle
+from ..installation.corsika import (
+    corsika_url, corsika_auth, fluka_auth, FLUKA_URL, uses_fluka,
+)
+from ..installation.download import fetch_all, unpack
+from .corsika import (
+    corsika_directory, install_log_path, install_corsika_settings,
+)
+
+
+log = logging.getLogger(__name__)
+
+
+class CorsikaBuilder:
+    '''
+    Parameters
+    ----------
+    mopro_directory: str
+    max_parallel: int
+        maximum number of concurrent builds, default is the number of cores
+    install_timeout: int
+        timeout for each build in seconds
+    download_timeout: int
+        timeout for downloading the sources in seconds
+    '''
+
+    def __init__(
+        self,
+        mopro_directory,
+        max_parallel=None,
+        install_timeout=1800,
+        download_timeout=300,
+    ):
+        self.mopro_directory = mopro_directory
+        self.max_parallel = max_parallel or os.cpu_count()
+        self.install_timeout = install_timeout
+        self.download_timeout = download_timeout
+        self.install_log_dir = os.path.join(mopro_directory, 'logs', 'installation')
+
+    def missing_settings(self, pending_jobs):
+        '''
+        CORSIKA settings of the pending CORSIKA runs that are neither
+        installed nor failed to build before
+        '''
+        missing = {}
+        for job in pending_jobs:
+            if job.model is not CorsikaRun:
+                continue
+            settings = job.corsika_settings
+            if settings.id in missing:
+                continue
+            if os.path.exists(corsika_directory(settings, self.mopro_directory)):
+                continue
+            if os.path.isfile(install_log_path(settings, self.install_log_dir)):
+                continue
+            missing[settings.id] = settings
+        return list(missing.values())
+
+    def build_missing(self, pending_jobs):
+        '''
+        Build all missing CORSIKA settings of `pending_jobs`.
+        Returns a dict mapping settings name to True for successful
+        and False for failed builds.
+        '''
+        missing = self.missing_settings(pending_jobs)
+        if not missing:
+            return {}
+
+        # the pending jobs only carry the settings without the additional files
+        with database.connection_context():
+            missing = list(
+                CorsikaSettings.select()
+                .where(CorsikaSettings.id.in_([settings.id for settings in missing]))
+            )
+
+        os.makedirs(self.install_log_dir, exist_ok=True)
+        results = {}
+        to_build = []
+        for settings in missing:
+            corsika_dir = corsika_directory(settings, self.mopro_directory)
+            if install_from_bundle(corsika_dir, 'corsika', corsika_key(settings)):
+                results[settings.name] = True
+            else:
+                to_build.append(settings)
+
+        if to_build:
+            results.update(self.build(to_build))
+        return results
+
+    def prepare_sources(self, settings_list, directory):
+        '''
+        Unpack the sources of all needed CORSIKA versions and FLUKA into `directory`.
+        Returns a dict mapping version to source directory and the FLUKA source directory.
+        '''
+        versions = sorted({settings.version for settings in settings_list})
+        need_fluka = any(uses_fluka(settings.config_h) for settings in settings_list)
+
+        downloads = [
+            dict(
+                url=corsika_url(version), auth=corsika_auth(),
+                timeout=self.download_timeout,
+            )
+            for version in versions
+        ]
+        if need_fluka:
+            downloads.append(
+                dict(url=FLUKA_URL, auth=fluka_auth(), timeout=self.download_timeout)
+            )
+        archives = fetch_all(downloads)
+
+        sources = {}
+        for version, archive in zip(versions, archives):
+            sources[version] = os.path.join(directory, f'corsika-{version}')
+            unpack(archive, sources[version], strip=1)
+
+        fluka_source = None
+        if need_fluka:
+            fluka_source = os.path.join(directory, 'fluka')
+            unpack(archives[-1], fluka_source)
+
+        return sources, fluka_source
+
+    def build(self, settings_list):
+        software_dir = os.path.join(self.mopro_directory, 'software', 'corsika')
+        os.makedirs(software_dir, exist_ok=True)
+
+        log.info('Building CORSIKA settings {} with up to {} parallel builds'.format(
+            ', '.join(settings.name for settings in settings_list), self.max_parallel,
+        ))
+
+        results = {}
+        # on the same file system as the installations, so copies can be reflinks
+        with tempfile.TemporaryDirectory(prefix='.sources_', dir=software_dir) as tmp_dir:
+            try:
+                sources, fluka_source = self.prepare_sources(settings_list, tmp_dir)
+            except (IOError, ValueError):
+                log.exception('Could not prepare CORSIKA sources')
+                return {settings.name: False for settings in settings_list}
+
+            with ThreadPoolExecutor(self.max_parallel) as pool:
+                futures = {
+                    pool.submit(
+                        install_corsika_settings,
+                        settings,
+                        corsika_directory(settings, self.mopro_directory),
+                        self.install_log_dir,
+                        source_dir=sources[settings.version],
+                        fluka_source_dir=fluka_source,
+                        install_timeout=self.install_timeout,
+                    ): settings
+                    for settings in settings_list
+                }
+                for future in as_completed(futures):
+                    settings = futures[future]
+                    try:
+                        future.result()
+                        results[settings.name] = True
+                    except Exception:
+                        log.exception(f'Building CORSIKA settings {settings.name} failed')
+                        results[settings.name] = False
+
+        return results
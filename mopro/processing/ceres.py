@@ -1,40 +1,38 @@
 import os
+import json
 import logging
 from pkg_resources import resource_filename
 import shutil
+from functools import lru_cache
 
+from ..config import parse_size
 from ..database import database, CeresSettings
 from ..installation import install_root, install_mars
+from ..installation.bundle import (
+    root_key, mars_key, install_from_bundle, export_if_configured
+)
+from .preparation import PreparationContext, run_directories
 
 log = logging.getLogger(__name__)
 
 
-def prepare_ceres_job(
-    ceres_run,
-    mopro_directory,
-    submitter_host,
-    submitter_port,
-    tmp_dir=None,
-):
-    ceres_settings = ceres_run.ceres_settings
-    corsika_run = ceres_run.corsika_run
-
-    script = resource_filename('mopro', 'resources/run_ceres.sh')
-    directory = ceres_run.directory_name
-    basename = ceres_run.basename
-
-    output_dir = os.path.join(mopro_directory, directory)
-    log_dir = os.path.join(mopro_directory, 'logs', directory)
-    os.makedirs(output_dir, exist_ok=True)
-    os.makedirs(log_dir, exist_ok=True)
-
-    log_file = os.path.join(log_dir, basename + '.log')
+def prepare_ceres_software(ceres_settings, mopro_directory, context):
+    '''
+    Make sure ROOT, MARS and the resource files for `ceres_settings`
+    are available, installing them if necessary.
 
+    Returns
+    -------
+    root_dir: str
+    mars_dir: str
+    resource_dir: str
+    '''
     root_dir = os.path.join(mopro_directory, 'software', 'root')
     install_log_dir = os.path.join(mopro_directory, 'logs', 'installation')
-    os.makedirs(install_log_dir, exist_ok=True)
 
-    if not os.path.exists(root_dir):
+    installed = context.exists(root_dir)
+    if not installed and not install_from_bundle(root_dir, 'root', root_key()):
+        context.makedirs(install_log_dir)
         install_logfile = os.path.join(install_log_dir, 'root.log')
         if os.path.isfile(install_logfile):
             raise ValueError(
@@ -42,11 +40,15 @@ def prepare_ceres_job(
             )
         with open(install_logfile, 'w') as f:
             install_root(root_dir, stdout=f, stderr=f)
+        export_if_configured(root_dir, 'root', root_key())
+    context.add(root_dir)
 
     mars_dir = os.path.join(
         mopro_directory, 'software', 'mars', str(ceres_settings.revision),
     )
-    if not os.path.exists(mars_dir):
+    mars = mars_key(ceres_settings.revision)
+    if not context.exists(mars_dir) and not install_from_bundle(mars_dir, 'mars', mars):
+        context.makedirs(install_log_dir)
         install_logfile = os.path.join(
             install_log_dir,
             f'mars_r{ceres_settings.revision}.log'
@@ -68,6 +70,8 @@ def prepare_ceres_job(
             # clean up after failed installation
             shutil.rmtree(mars_dir)
             raise
+        export_if_configured(mars_dir, 'mars', mars)
+    context.add(mars_dir)
 
     resource_dir = os.path.join(
         mopro_directory,
@@ -75,40 +79,113 @@ def prepare_ceres_job(
         ceres_settings.name,
         f'r{ceres_settings.revision}',
     )
-    if not os.path.exists(resource_dir):
+    if not context.exists(resource_dir):
         with database.connection_context():
             ceres_settings = CeresSettings.get(id=ceres_settings.id)
         log.info(f'Writing ceres resources into {resource_dir}')
         ceres_settings.write_resources(resource_dir)
+        context.add(resource_dir)
+
+    return root_dir, mars_dir, resource_dir
 
+
+def prepare_ceres_rc(ceres_run, resource_dir, context):
+    ''' Write the rc file for `ceres_run` if needed and return its path '''
+    ceres_settings = ceres_run.ceres_settings
     rc_file = ceres_settings.rc_path(ceres_run, resource_dir)
-    if not os.path.isfile(rc_file):
-        ceres_settings = CeresSettings.get(id=ceres_settings.id)
+    if not context.exists(rc_file):
+        with database.connection_context():
+            ceres_settings = CeresSettings.get(id=ceres_settings.id)
         log.info(f'Writing ceres rc to {rc_file}')
         ceres_settings.write_rc(ceres_run, resource_dir)
+        context.add(rc_file)
+    return rc_file
+
+
+def prepare_output_directories(ceres_run, mopro_directory, context):
+    ''' Create output and log directory, return output directory and log file '''
+    output_dir, log_dir = run_directories(ceres_run, mopro_directory)
+    context.makedirs(output_dir)
+    context.makedirs(log_dir)
+
+    return output_dir, os.path.join(log_dir, ceres_run.basename + '.log')
 
+
+@lru_cache()
+def base_environment(root_dir, mars_dir):
+    '''
+    Environment of the submitter with ROOT and MARS added,
+    computed once per MARS installation. Must not be modified.
+    '''
     env = os.environ.copy()
     env['PATH'] = ':'.join([os.path.join(root_dir, 'bin'), mars_dir, env['PATH']])
     ld_library_paths = [os.path.join(root_dir, 'lib'), mars_dir]
     if env.get('LD_LIBRARY_PATH') is not None:
         ld_library_paths.append(env['LD_LIBRARY_PATH'])
     env['LD_LIBRARY_PATH'] = ':'.join(ld_library_paths)
+    env['MARSSYS'] = mars_dir
+    return env
+
+
+def build_environment(root_dir, mars_dir):
+    ''' A copy of the base environment to add the job variables to '''
+    return dict(base_environment(root_dir, mars_dir))
+
+
+def add_common_variables(
+    env, submitter_host, submitter_port, tmp_dir, staging, heartbeat_interval,
+):
+    env.update({
+        'MOPRO_SUBMITTER_HOST': submitter_host,
+        'MOPRO_SUBMITTER_PORT': str(submitter_port),
+    })
+
+    if tmp_dir is not None:
+        env['MOPRO_TMP_DIR'] = tmp_dir
+
+    if staging is not None and staging.directory is not None:
+        env['MOPRO_STAGING_DIR'] = staging.directory
+        env['MOPRO_STAGING_MAX_SIZE'] = str(parse_size(staging.max_size))
+
+    if heartbeat_interval:
+        env['MOPRO_HEARTBEAT_INTERVAL'] = str(heartbeat_interval)
+
+
+def prepare_ceres_job(
+    ceres_run,
+    mopro_directory,
+    submitter_host,
+    submitter_port,
+    tmp_dir=None,
+    staging=None,
+    heartbeat_interval=None,
+    context=None,
+):
+    context = context or PreparationContext()
+    ceres_settings = ceres_run.ceres_settings
+    corsika_run = ceres_run.corsika_run
 
+    script = resource_filename('mopro', 'resources/run_ceres.sh')
+    output_dir, log_file = prepare_output_directories(ceres_run, mopro_directory, context)
+
+    root_dir, mars_dir, resource_dir = prepare_ceres_software(
+        ceres_settings, mopro_directory, context
+    )
+    rc_file = prepare_ceres_rc(ceres_run, resource_dir, context)
+
+    env = build_environment(root_dir, mars_dir)
     env.update({
-        'MARSSYS': mars_dir,
         'MOPRO_JOB_ID': str(ceres_run.id),
         'MOPRO_CERES_RC': rc_file,
         'MOPRO_CORSIKA_RUN': str(corsika_run.id),
         'MOPRO_INPUTFILE': corsika_run.result_file,
         'MOPRO_OUTPUTDIR': output_dir,
-        'MOPRO_OUTPUTBASENAME': basename,
+        'MOPRO_OUTPUTBASENAME': ceres_run.basename,
         'MOPRO_WALLTIME': str(ceres_run.walltime * 60),
-        'MOPRO_SUBMITTER_HOST': submitter_host,
-        'MOPRO_SUBMITTER_PORT': str(submitter_port),
     })
-
-    if tmp_dir is not None:
-        env['MOPRO_TMP_DIR'] = tmp_dir
+    add_common_variables(
+        env, submitter_host, submitter_port, tmp_dir, staging, heartbeat_interval,
+    )
 
     return dict(
         executable=script,
@@ -117,3 +194,73 @@ def prepare_ceres_job(
         job_name='mopro_ceres_{}'.format(ceres_run.id),
         walltime=ceres_run.walltime,
     )
+
+
+def prepare_ceres_group_job(
+    ceres_runs,
+    mopro_directory,
+    submitter_host,
+    submitter_port,
+    tmp_dir=None,
+    staging=None,
+    heartbeat_interval=None,
+    context=None,
+):
+    '''
+    Prepare a single job running CERES for all `ceres_runs`,
+    which must share the same CORSIKA run.
+    The input file is only decompressed once by the executor.
+
+    The runs are passed to the executor as json in `MOPRO_CERES_JOBS`,
+    the job name contains all run ids, e.g. `mopro_ceres_12_13_14`.
+    The requested walltime is the sum of the walltimes of all runs,
+    `JobSubmitter.group_jobs` keeps it below the longest walltime of the cluster.
+    '''
+    corsika_run = ceres_runs[0].corsika_run
+    if any(r.corsika_run.id != corsika_run.id for r in ceres_runs):
+        raise ValueError('All CERES runs of a group job need the same CORSIKA run')
+
+    context = context or PreparationContext()
+    script = resource_filename('mopro', 'resources/run_ceres.sh')
+
+    jobs = []
+    log_file = None
+    for ceres_run in ceres_runs:
+        output_dir, run_log_file = prepare_output_directories(
+            ceres_run, mopro_directory, context
+        )
+        # the log of the group job goes next to the log of the first run
+        log_file = log_file or run_log_file
+
+        root_dir, mars_dir, resource_dir = prepare_ceres_software(
+            ceres_run.ceres_settings, mopro_directory, context
+        )
+        jobs.append({
+            'job_id': ceres_run.id,
+            'rc_file': prepare_ceres_rc(ceres_run, resource_dir, context),
+            'mars_dir': mars_dir,
+            'output_dir': output_dir,
+            'output_basename': ceres_run.basename,
+        })
+
+    walltime = sum(r.walltime for r in ceres_runs)
+
+    # ROOT is shared, the executor puts the MARS of each run first in PATH
+    env = build_environment(root_dir, mars_dir)
+    env.update({
+        'MOPRO_CERES_JOBS': json.dumps(jobs),
+        'MOPRO_CORSIKA_RUN': str(corsika_run.id),
+        'MOPRO_INPUTFILE': corsika_run.result_file,
+        'MOPRO_WALLTIME': str(walltime * 60),
+    })
+    add_common_variables(
+        env, submitter_host, submitter_port, tmp_dir, staging, heartbeat_interval,
+    )
+
+    return dict(
+        executable=script,
+        env=env,
+        stdout=log_file,
+        job_name='mopro_ceres_' + '_'.join(str(r.id) for r in ceres_runs),
+        walltime=walltime,
+    )
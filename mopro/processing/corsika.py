@@ -1,78 +1,140 @@
 import os
+import time
 import logging
 from pkg_resources import resource_filename
 import shutil
+from functools import lru_cache
 
 from ..database import database
 from ..database import CorsikaSettings
 from ..installation import install_corsika
+from ..installation.bundle import corsika_key, install_from_bundle, export_if_configured
+from .preparation import PreparationContext, run_directories
 
 log = logging.getLogger(__name__)
 
 
+@lru_cache()
+def base_environment(corsika_dir):
+    '''
+    Environment of the submitter with the settings of the CORSIKA
+    installation `corsika_dir`, computed once per installation.
+    Must not be modified.
+    '''
+    env = os.environ.copy()
+    env['MOPRO_CORSIKA_DIR'] = corsika_dir
+    env['FLUPRO'] = os.path.join(corsika_dir, 'fluka')
+    return env
+
+
+def corsika_directory(corsika_settings, mopro_directory):
+    ''' Installation directory of the CORSIKA settings '''
+    return os.path.join(
+        mopro_directory, 'software', 'corsika',
+        str(corsika_settings.version),
+        str(corsika_settings.name),
+    )
+
+
+def install_log_path(corsika_settings, install_log_dir):
+    return os.path.join(
+        install_log_dir,
+        f'corsika_{corsika_settings.version}_{corsika_settings.name}.log'
+    )
+
+
+def install_corsika_settings(
+    corsika_settings,
+    corsika_dir,
+    install_log_dir,
+    source_dir=None,
+    fluka_source_dir=None,
+    install_timeout=120,
+):
+    '''
+    Install CORSIKA for `corsika_settings` into `corsika_dir`, either
+    from a bundle or by building it, and store the build duration.
+    The installation log doubles as marker for failed builds,
+    which are not tried again.
+    '''
+    key = corsika_key(corsika_settings)
+    if install_from_bundle(corsika_dir, 'corsika', key):
+        return
+
+    install_log_file = install_log_path(corsika_settings, install_log_dir)
+    if os.path.isfile(install_log_file):
+        raise ValueError(
+            'CORSIKA installation tried before but failed, not trying again'
+        )
+
+    start = time.monotonic()
+    try:
+        with open(install_log_file, 'w') as f:
+            install_corsika(
+                corsika_dir,
+                corsika_settings.config_h,
+                corsika_settings.version,
+                corsika_settings.additional_files,
+                source_dir=source_dir,
+                fluka_source_dir=fluka_source_dir,
+                install_timeout=install_timeout,
+                stdout=f, stderr=f,
+            )
+    except:
+        shutil.rmtree(corsika_dir, ignore_errors=True)
+        raise
+    duration = time.monotonic() - start
+
+    log.info(f'Built CORSIKA settings {corsika_settings.name} in {duration:.0f} s')
+    with database.connection_context():
+        (
+            CorsikaSettings
+            .update(build_duration=duration)
+            .where(CorsikaSettings.id == corsika_settings.id)
+            .execute()
+        )
+    export_if_configured(corsika_dir, 'corsika', key)
+
+
 def prepare_corsika_job(
     corsika_run,
     mopro_directory,
     submitter_host,
     submitter_port,
     tmp_dir=None,
+    heartbeat_interval=None,
+    context=None,
 ):
+    context = context or PreparationContext()
 
     script = resource_filename('mopro', 'resources/run_corsika.sh')
-    directory = corsika_run.directory_name
     basename = corsika_run.basename
 
-    output_dir = os.path.join(mopro_directory, directory)
-    log_dir = os.path.join(mopro_directory, 'logs', directory)
-    os.makedirs(output_dir, exist_ok=True)
-    os.makedirs(log_dir, exist_ok=True)
+    output_dir, log_dir = run_directories(corsika_run, mopro_directory)
+    context.makedirs(output_dir)
+    context.makedirs(log_dir)
 
     log_file = os.path.join(log_dir, basename + '.log')
     output_file = basename + '.eventio'
     inputcard_file = os.path.join(output_dir, basename + '.input')
 
-    corsika_dir = os.path.join(
-        mopro_directory, 'software', 'corsika',
-        str(corsika_run.corsika_settings.version),
-        str(corsika_run.corsika_settings.name),
-    )
-    if not os.path.exists(corsika_dir):
+    corsika_dir = corsika_directory(corsika_run.corsika_settings, mopro_directory)
+    if not context.exists(corsika_dir):
         install_log_dir = os.path.join(mopro_directory, 'logs', 'installation')
-        os.makedirs(install_log_dir, exist_ok=True)
+        context.makedirs(install_log_dir)
 
         with database.connection_context():
             corsika_settings = CorsikaSettings.get(id=corsika_run.corsika_settings_id)
-
-        install_log_file = os.path.join(
-            install_log_dir,
-            f'corsika_{corsika_settings.version}_{corsika_settings.name}.log'
-        )
-        if os.path.isfile(install_log_file):
-            raise ValueError(
-                'CORSIKA installation tried before but failed, not trying again'
-            )
-
-        try:
-            with open(install_log_file, 'w') as f:
-                install_corsika(
-                    corsika_dir,
-                    corsika_settings.config_h,
-                    corsika_settings.version,
-                    corsika_settings.additional_files,
-                    stdout=f, stderr=f,
-                )
-        except:
-            shutil.rmtree(corsika_dir)
-            raise
+        install_corsika_settings(corsika_settings, corsika_dir, install_log_dir)
+        context.add(corsika_dir)
 
     with open(inputcard_file, 'w') as f:
         content = corsika_run.corsika_settings.format_input_card(corsika_run, output_file)
         f.write(content)
 
-    env = os.environ.copy()
+    env = dict(base_environment(corsika_dir))
     env.update({
         'MOPRO_JOB_ID': str(corsika_run.id),
-        'MOPRO_CORSIKA_DIR': corsika_dir,
         'MOPRO_INPUTCARD': inputcard_file,
         'MOPRO_OUTPUTDIR': output_dir,
         'MOPRO_OUTPUTFILE': output_file,
@@ -80,12 +142,14 @@ def prepare_corsika_job(
         'MOPRO_SUBMITTER_HOST': submitter_host,
         'MOPRO_SUBMITTER_PORT': str(submitter_port),
         'MOPRO_LOGFILE': log_file,
-        'FLUPRO': os.path.join(corsika_dir, 'fluka'),
     })
 
     if tmp_dir is not None:
         env['MOPRO_TMP_DIR'] = tmp_dir
 
+    if heartbeat_interval:
+        env['MOPRO_HEARTBEAT_INTERVAL'] = str(heartbeat_interval)
+
     return dict(
         executable=script,
         env=env,
@@ -0,0 +1,86 @@
+'''
+Streaming parser for the output of CORSIKA.
+
+The executor pipes the output of CORSIKA through `tee`, which writes it
+unchanged to the job log and feeds each line to a `CorsikaLogParser`.
+Only the state extracted from the lines is kept, never the log itself,
+as logs of verbose runs can reach hundreds of MB.
+
+This module is used by the executors and must only depend on the standard library.
+'''
+import re
+import time
+
+
+END_OF_RUN = b'== END OF RUN =='
+
+# CORSIKA prints this line after each simulated shower
+SHOWER_PATTERN = re.compile(rb'END OF SHOWER NO\.?\s+(\d+)')
+
+# lines hinting at the reason of a failed run
+ERROR_PATTERN = re.compile(
+    rb'Fortran runtime error|Program received signal|Segmentation fault'
+    rb'|\bERROR\b|\bFATAL\b'
+)
+
+
+class CorsikaLogParser:
+    '''
+    State of a CORSIKA run extracted from its output line by line.
+
+    Attributes
+    ----------
+    finished: bool
+        True once the end of run marker was seen
+    progress: int or None
+        number of the last finished shower
+    errors: list of str
+        the first `max_errors` lines matching an error signature
+    n_errors: int
+        number of all lines matching an error signature
+    '''
+
+    def __init__(self, max_errors=10):
+        self.max_errors = max_errors
+        self.finished = False
+        self.progress = None
+        self.errors = []
+        self.n_errors = 0
+
+    def feed(self, line):
+        ''' Parse a single line of output, given as bytes '''
+        if END_OF_RUN in line:
+            self.finished = True
+            return
+
+        match = SHOWER_PATTERN.search(line)
+        if match is not None:
+            self.progress = int(match.group(1))
+            return
+
+        if ERROR_PATTERN.search(line):
+            self.n_errors += 1
+            if len(self.errors) < self.max_errors:
+                self.errors.append(line.decode(errors='replace').strip())
+
+    def __call__(self):
+        ''' Current progress, to be used as progress callback of the heartbeat '''
+        return self.progress
+
+
+def tee(stream, output, parser, flush_interval=1.0):
+    '''
+    Copy the binary `stream` line by line to `output`, feeding each line to `parser`,
+    until the end of the stream.
+    `output` is flushed at most every `flush_interval` seconds.
+    '''
+    last_flush = time.monotonic()
+    for line in iter(stream.readline, b''):
+        output.write(line)
+        parser.feed(line)
+
+        now = time.monotonic()
+        if now - last_flush > flush_interval:
+            output.flush()
+            last_flush = now
+    output.flush()
@@ -0,0 +1,170 @@
+'''
+Single asyncio event loop running the job monitor, the submitter
+and, for local processing, the local cluster.
+
+Instead of polling, each component waits for what it is interested in:
+the monitor for messages on its zmq socket, the submitter for its interval
+or a finished job freeing a slot, the local cluster for new jobs or
+terminating processes. Blocking work, database queries and calls to
+sbatch/squeue, runs in a bounded thread pool.
+'''
+import asyncio
+import logging
+import signal
+from concurrent.futures import ThreadPoolExecutor
+
+import peewee
+import zmq.asyncio
+
+
+log = logging.getLogger(__name__)
+
+
+class ProcessingDaemon:
+    '''
+    Parameters
+    ----------
+    monitor: JobMonitor
+        the monitor, its thread is not started
+    submitter: JobSubmitter
+        the submitter, its thread is not started
+    cluster: Cluster
+        if it has a `run_async` method, it is run in the event loop
+    shutdown_cluster: callable
+        called with the cluster in a worker thread after the submitter stopped,
+        e.g. to cancel queued jobs and wait for running jobs.
+        The monitor keeps serving the executors until it returns.
+    max_workers: int
+        size of the thread pool for database and cluster calls
+    '''
+
+    def __init__(self, monitor, submitter, cluster, shutdown_cluster=None, max_workers=4):
+        self.monitor = monitor
+        self.submitter = submitter
+        self.cluster = cluster
+        self.shutdown_cluster = shutdown_cluster
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix='mopro')
+        self.stop_requested = None
+        self.wakeup = None
+
+    async def run_blocking(self, function, *args):
+        ''' Run `function` in the thread pool '''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, function, *args)
+
+    def request_stop(self):
+        log.info('Stop requested')
+        self.stop_requested.set()
+
+    async def serve_monitor(self, socket):
+        while True:
+            message = await socket.recv_pyobj()
+            await socket.send_pyobj(True)
+
+            if message.get('heartbeat'):
+                self.monitor.add_heartbeat(message)
+                continue
+
+            log.debug('Received status update: {}'.format(message))
+            status = message.get('status')
+            try:
+                # awaited to keep the updates of a job in order
+                await self.run_blocking(self.monitor.update_job, message)
+            except Exception:
+                log.exception('Could not process status update')
+
+            # a finished job frees a slot, submit without waiting for the interval
+            if status != 'running':
+                self.wakeup.set()
+
+    async def flush_heartbeats(self):
+        while True:
+            await asyncio.sleep(self.monitor.flush_interval)
+            try:
+                await self.run_blocking(self.monitor.flush_heartbeats)
+            except peewee.OperationalError:
+                log.exception('Could not write heartbeats')
+
+    async def submit(self):
+        await self.run_blocking(self.submitter.startup)
+
+        while not self.submitter.event.is_set():
+            self.wakeup.clear()
+            await self.run_blocking(self.submitter.tick)
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.submitter.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def shutdown(self):
+        '''
+        Run `shutdown_cluster`, a second stop request
+        kills the running jobs instead of waiting for them
+        '''
+        if self.shutdown_cluster is None:
+            return
+
+        self.stop_requested.clear()
+        shutdown = asyncio.ensure_future(
+            self.run_blocking(self.shutdown_cluster, self.cluster)
+        )
+        stop = asyncio.ensure_future(self.stop_requested.wait())
+        done, _ = await asyncio.wait(
+            [shutdown, stop], return_when=asyncio.FIRST_COMPLETED
+        )
+
+        if shutdown not in done:
+            await self.run_blocking(self.cluster.cancel_running)
+            log.info('Cleaned up running jobs')
+            await shutdown
+        stop.cancel()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.stop_requested = asyncio.Event()
+        self.wakeup = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.request_stop)
+
+        context = zmq.asyncio.Context()
+        socket = self.monitor.bind(context)
+
+        background = [
+            loop.create_task(self.serve_monitor(socket)),
+            loop.create_task(self.flush_heartbeats()),
+        ]
+        cluster_task = None
+        if hasattr(self.cluster, 'run_async'):
+            cluster_task = loop.create_task(self.cluster.run_async())
+        submit_task = loop.create_task(self.submit())
+
+        log.info('Processing daemon running')
+        await self.stop_requested.wait()
+
+        log.info('Shutting down')
+        self.submitter.terminate()
+        self.wakeup.set()
+        await submit_task
+        log.info('Submitter shut down')
+
+        try:
+            await self.shutdown()
+        finally:
+            await self.run_blocking(self.cluster.terminate)
+            if cluster_task is not None:
+                await cluster_task
+            log.info('Cluster shut down')
+
+            for task in background:
+                task.cancel()
+            await asyncio.gather(*background, return_exceptions=True)
+            try:
+                await self.run_blocking(self.monitor.flush_heartbeats)
+            except peewee.OperationalError:
+                log.exception('Could not write heartbeats')
+            socket.close()
+            context.term()
+            self.executor.shutdown()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(sig)
+            log.info('Monitor shut down')
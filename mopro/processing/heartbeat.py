@@ -0,0 +1,98 @@
+'''
+Periodic heartbeats from the executors to the job monitor.
+
+The heartbeat runs in a background thread with its own zmq socket,
+as zmq sockets must not be shared between threads.
+If the monitor does not answer in time, the socket is recreated,
+a lost heartbeat must never block or kill the job.
+
+This module is used by the executors and must only depend on
+the standard library and zmq.
+'''
+import os
+import logging
+from threading import Thread, Event
+
+import zmq
+
+
+log = logging.getLogger(__name__)
+
+
+class Heartbeat(Thread):
+    '''
+    Send a heartbeat for `job_ids` of `program` every `interval` seconds.
+
+    Parameters
+    ----------
+    context: zmq.Context
+    address: str
+        address of the job monitor, e.g. tcp://localhost:1337
+    program: str
+        "corsika" or "ceres"
+    job_ids: list of int
+        all runs processed by this job
+    interval: float
+        seconds between heartbeats
+    progress: callable
+        returns the current progress of the job as int or None
+    '''
+
+    def __init__(self, context, address, program, job_ids, interval, progress=None):
+        super().__init__(daemon=True)
+        self.context = context
+        self.address = address
+        self.program = program
+        self.job_ids = job_ids
+        self.interval = interval
+        self.progress = progress
+        self.event = Event()
+
+    def connect(self):
+        socket = self.context.socket(zmq.REQ)
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.connect(self.address)
+        return socket
+
+    def run(self):
+        socket = self.connect()
+        while not self.event.wait(self.interval):
+            try:
+                socket.send_pyobj({
+                    'program': self.program,
+                    'job_ids': self.job_ids,
+                    'heartbeat': True,
+                    'progress': self.progress() if self.progress else None,
+                })
+                if socket.poll(timeout=10000):
+                    socket.recv()
+                else:
+                    log.warning('No answer to heartbeat from job monitor')
+                    socket.close()
+                    socket = self.connect()
+            except Exception:
+                log.exception('Error sending heartbeat')
+                socket.close()
+                socket = self.connect()
+        socket.close()
+
+    def stop(self):
+        self.event.set()
+        self.join()
+
+
+def start_heartbeat(context, program, job_ids, progress=None):
+    '''
+    Start the heartbeat thread using the `MOPRO_*` environment variables,
+    returns None if heartbeats are disabled
+    '''
+    interval = float(os.environ.get('MOPRO_HEARTBEAT_INTERVAL', 0))
+    if interval <= 0:
+        return None
+
+    address = 'tcp://{}:{}'.format(
+        os.environ['MOPRO_SUBMITTER_HOST'], os.environ['MOPRO_SUBMITTER_PORT'],
+    )
+    heartbeat = Heartbeat(context, address, program, job_ids, interval, progress)
+    heartbeat.start()
+    return heartbeat
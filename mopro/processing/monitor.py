@@ -1,18 +1,17 @@
 from threading import Thread, Event
+from datetime import datetime
+import time
 import zmq
 import logging
 from retrying import retry
 import peewee
 
-from ..database import CorsikaRun, CeresRun, Status, database
-
-log = logging.getLogger(__name__)
+from peewee import Case
 
+from ..database import Status, database
+from ..queries import programs, change_job_status, add_output_files
 
-programs = {
-    'corsika': CorsikaRun,
-    'ceres': CeresRun,
-}
+log = logging.getLogger(__name__)
 
 
 def is_operational_error(exception):
@@ -20,50 +19,130 @@ def is_operational_error(exception):
 
 
 class JobMonitor(Thread):
+    '''
+    Receives status updates and heartbeats from the executors.
+
+    Status updates are written to the database immediately,
+    heartbeats are only kept in memory and written every `flush_interval`
+    seconds with one update per program.
+    '''
 
-    def __init__(self, port=12700):
+    def __init__(self, port=12700, flush_interval=60):
 
         super().__init__()
 
         self.event = Event()
         self.port = port
-        self.context = zmq.Context()
-        self.socket = self.context.socket(zmq.REP)
-        self.socket.bind('tcp://*:{}'.format(self.port))
-        self.poller = zmq.Poller()
-        self.poller.register(self.socket, zmq.POLLIN)
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+        # (program, job_id) -> progress of jobs with heartbeats since the last flush
+        self.heartbeats = {}
+        self.context = None
+        self.socket = None
+
+    def bind(self, context):
+        '''
+        Create the REP socket for the executors from `context`,
+        a `zmq.Context` or a `zmq.asyncio.Context`
+        '''
+        socket = context.socket(zmq.REP)
+        socket.bind('tcp://*:{}'.format(self.port))
         log.info('JobMonitor running on port {}'.format(self.port))
+        return socket
 
     def run(self):
+        self.context = zmq.Context()
+        self.socket = self.bind(self.context)
+        poller = zmq.Poller()
+        poller.register(self.socket, zmq.POLLIN)
+
         while not self.event.is_set():
-            events = self.poller.poll(timeout=1)
+            events = poller.poll(timeout=1)
             for socket, n_messages in events:
                 for i in range(n_messages):
 
-                    status_update = socket.recv_pyobj()
+                    message = socket.recv_pyobj()
                     socket.send_pyobj(True)
-                    log.debug('Received status update: {}'.format(status_update))
+                    self.handle_message(message)
 
-                    self.update_job(status_update)
+            if time.monotonic() - self.last_flush > self.flush_interval:
+                try:
+                    self.flush_heartbeats()
+                except peewee.OperationalError:
+                    log.exception('Could not write heartbeats')
+
+        self.socket.close()
+        self.context.term()
+
+    def handle_message(self, message):
+        if message.get('heartbeat'):
+            self.add_heartbeat(message)
+            return
+
+        log.debug('Received status update: {}'.format(message))
+        self.update_job(message)
+
+    def add_heartbeat(self, heartbeat):
+        for job_id in heartbeat['job_ids']:
+            self.heartbeats[(heartbeat['program'], job_id)] = heartbeat['progress']
+
+    @database.connection_context()
+    def flush_heartbeats(self):
+        '''
+        Write the time of the flush as last heartbeat and the progress
+        for all jobs that sent a heartbeat since the last flush
+        '''
+        heartbeats, self.heartbeats = self.heartbeats, {}
+        self.last_flush = time.monotonic()
+        if not heartbeats:
+            return
+
+        now = datetime.utcnow()
+        for program, model in programs.items():
+            progress = {
+                job_id: p for (name, job_id), p in heartbeats.items()
+                if name == program
+            }
+            if not progress:
+                continue
+
+            update = {'last_heartbeat': now}
+            with_progress = [(k, v) for k, v in progress.items() if v is not None]
+            if with_progress:
+                update['progress'] = Case(model.id, with_progress, model.progress)
+
+            model.update(**update).where(model.id.in_(list(progress))).execute()
+        log.debug(f'Wrote heartbeats of {len(heartbeats)} jobs')
 
     @retry(retry_on_exception=is_operational_error)
     @database.connection_context()
     def update_job(self, update):
-        model = programs[update.pop('program')]
+        program = update.pop('program')
+        model = programs[program]
         job_id = update.pop('job_id')
 
-        update['status'] = Status.select().where(Status.name == update['status'])
+        status = update.pop('status')
+        # written to the catalogue, not to the run
+        output_files = update.pop('output_files', None)
+        if status == 'running':
+            update['started_at'] = datetime.utcnow()
+        else:
+            update['finished_at'] = datetime.utcnow()
+            self.heartbeats.pop((program, job_id), None)
         created = Status.select().where(Status.name == 'created')
 
         # the restriction on status != created
         # fixes a race condition where dying jobs
         # report failed status when the local cluster is shutdown
-        return (
-            model
-            .update(**update)
-            .where(model.id == job_id)
-            .where(model.status != created)
-        ).execute()
+        n_updated = change_job_status(
+            model,
+            (model.id == job_id) & (model.status != created),
+            status,
+            **update,
+        )
+        if n_updated > 0 and status == 'success' and output_files:
+            add_output_files(model, job_id, output_files)
+        return n_updated
 
     def terminate(self):
         log.info('Monitor terminating')
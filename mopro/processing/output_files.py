@@ -0,0 +1,111 @@
+'''
+Description of the result files for the output file catalogue.
+
+The executors compress their results through a pipe, computing size
+and sha256 checksum of the compressed file while writing it,
+so the files do not need to be read again.
+
+This module is used by the executors and must only depend on the standard library.
+'''
+import hashlib
+import subprocess as sp
+
+
+FITS_BLOCK_SIZE = 2880
+FITS_CARD_SIZE = 80
+
+
+def compress(command, output_path, block_size=1024**2, monitor=None):
+    '''
+    Run `command`, which writes the compressed file to stdout, e.g.
+    `['zstd', '-5', '-c', path]`, into `output_path`.
+    Its peak memory is recorded by the `ResourceMonitor` `monitor` if given.
+    Returns size and sha256 checksum of the written file.
+    Raises `CalledProcessError` like `subprocess.run`.
+    '''
+    h = hashlib.sha256()
+    size = 0
+    process = sp.Popen(command, stdout=sp.PIPE)
+    try:
+        with open(output_path, 'wb') as f:
+            for block in iter(lambda: process.stdout.read(block_size), b''):
+                h.update(block)
+                f.write(block)
+                size += len(block)
+    except:
+        process.kill()
+        raise
+    finally:
+        process.stdout.close()
+        if monitor is not None:
+            monitor.wait(process)
+        else:
+            process.wait()
+
+    if process.returncode != 0:
+        raise sp.CalledProcessError(process.returncode, command)
+
+    return size, h.hexdigest()
+
+
+def read_fits_header(f):
+    '''
+    Read the header at the current position of `f` into a dict,
+    None at the end of the file
+    '''
+    header = {}
+    while True:
+        block = f.read(FITS_BLOCK_SIZE)
+        if len(block) < FITS_BLOCK_SIZE:
+            return None
+        for start in range(0, FITS_BLOCK_SIZE, FITS_CARD_SIZE):
+            card = block[start:start + FITS_CARD_SIZE].decode('ascii', errors='replace')
+            key = card[:8].strip()
+            if key == 'END':
+                return header
+            if card[8:10] == '= ':
+                value = card[10:].split('/')[0].strip().strip("'").strip()
+                header[key] = value
+
+
+def fits_data_size(header):
+    ''' Size in bytes of the data following `header`, padded to full blocks '''
+    n_axis = int(header.get('NAXIS', 0))
+    if n_axis == 0:
+        return 0
+    n_elements = 1
+    for axis in range(1, n_axis + 1):
+        n_elements *= int(header[f'NAXIS{axis}'])
+    size = abs(int(header['BITPIX'])) // 8 * int(header.get('GCOUNT', 1)) * (
+        int(header.get('PCOUNT', 0)) + n_elements
+    )
+    return -(-size // FITS_BLOCK_SIZE) * FITS_BLOCK_SIZE
+
+
+def fits_n_rows(path):
+    '''
+    Number of rows of the first binary table in the uncompressed fits file `path`,
+    None if there is none or the file is not a valid fits file
+    '''
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                header = read_fits_header(f)
+                if header is None:
+                    return None
+                if header.get('XTENSION') == 'BINTABLE':
+                    return int(header['NAXIS2'])
+                f.seek(fits_data_size(header), 1)
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def output_file_info(kind, path, size, sha256, n_events=None):
+    ''' Entry of `output_files` in the status update of a successful run '''
+    return {
+        'kind': kind,
+        'path': path,
+        'size': size,
+        'sha256': sha256,
+        'n_events': n_events,
+    }
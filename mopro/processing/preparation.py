@@ -0,0 +1,61 @@
+'''
+Bookkeeping of the file system state during the preparation of jobs.
+
+On network file systems, every `makedirs` or `exists` is a round trip
+to the server. A `PreparationContext` lives for one submission iteration
+and remembers which directories were created and which software, resource
+and rc paths were found, so each is checked at most once per iteration.
+'''
+import os
+
+
+def run_directories(run, mopro_directory):
+    ''' Output and log directory of a CORSIKA or CERES run '''
+    directory = run.directory_name
+    return (
+        os.path.join(mopro_directory, directory),
+        os.path.join(mopro_directory, 'logs', directory),
+    )
+
+
+class PreparationContext:
+
+    def __init__(self):
+        self.directories = set()
+        self.paths = set()
+
+    def makedirs(self, path):
+        ''' `os.makedirs(path, exist_ok=True)`, if not already done '''
+        if path not in self.directories:
+            os.makedirs(path, exist_ok=True)
+            self.directories.add(path)
+            self.paths.add(path)
+
+    def exists(self, path):
+        '''
+        `os.path.exists(path)`, only positive results are remembered,
+        as missing paths are usually created right after the check
+        '''
+        if path in self.paths:
+            return True
+        if os.path.exists(path):
+            self.paths.add(path)
+            return True
+        return False
+
+    def add(self, path):
+        ''' Remember that `path` was just created '''
+        self.paths.add(path)
+
+    def prepare_directories(self, runs, mopro_directory):
+        '''
+        Create the output and log directories for all `runs` in one pass.
+        Runs share directories in buckets of 1000 ids, so this only
+        needs one `makedirs` per bucket instead of two per run.
+        '''
+        directories = set()
+        for run in runs:
+            directories.update(run_directories(run, mopro_directory))
+
+        for directory in sorted(directories):
+            self.makedirs(directory)
@@ -4,9 +4,17 @@ import os
 import logging
 import tempfile
 import sys
+import json
+import resource
 from glob import glob
+from contextlib import ExitStack
 import zmq
 
+from .staging import StagingCache
+from .accounting import ResourceMonitor
+from .heartbeat import start_heartbeat
+from .output_files import compress, fits_n_rows, output_file_info
+
 start_time = time.monotonic()
 
 context = zmq.Context()
@@ -20,6 +28,104 @@ handler.setFormatter(fmt)
 logging.getLogger().addHandler(handler)
 
 
+def read_jobs():
+    '''
+    The CERES runs to process in this job,
+    more than one for group jobs sharing the same CORSIKA input file
+    '''
+    if 'MOPRO_CERES_JOBS' in os.environ:
+        return json.loads(os.environ['MOPRO_CERES_JOBS'])
+
+    return [{
+        'job_id': int(os.environ['MOPRO_JOB_ID']),
+        'rc_file': os.environ['MOPRO_CERES_RC'],
+        'mars_dir': None,
+        'output_dir': os.environ['MOPRO_OUTPUTDIR'],
+        'output_basename': os.environ['MOPRO_OUTPUTBASENAME'],
+    }]
+
+
+def send_status_update(job, status, **kwargs):
+    socket.send_pyobj({
+        'program': 'ceres',
+        'job_id': job['job_id'],
+        'status': status,
+        **kwargs
+    })
+    socket.recv()
+
+
+def stop_heartbeat(heartbeat):
+    ''' Stop `heartbeat` if heartbeats are enabled, can be called repeatedly '''
+    if heartbeat is not None:
+        heartbeat.stop()
+
+
+def build_environment(mars_dir):
+    ''' Environment for a run of a group job using its own MARS revision '''
+    if mars_dir is None:
+        return None
+
+    env = os.environ.copy()
+    for key in ('PATH', 'LD_LIBRARY_PATH'):
+        env[key] = mars_dir + ':' + env.get(key, '')
+    env['MARSSYS'] = mars_dir
+    return env
+
+
+def run_ceres(job, corsika_run, cerfile, tmp_dir, timeout, monitor):
+    '''
+    Run CERES for one job on the already decompressed `cerfile` in `tmp_dir`
+    and gzip the results into the output directory.
+    The peak memory of the children is recorded by the `ResourceMonitor` `monitor`.
+    Returns the `output_file_info` of the events and runheader file.
+    '''
+    output_base = os.path.join(job['output_dir'], job['output_basename'])
+    os.makedirs(job['output_dir'], exist_ok=True)
+
+    out_dir = os.path.join(tmp_dir, str(job['job_id']))
+    os.makedirs(out_dir)
+
+    cmd = [
+        'ceres',
+        '-b',
+        f'--config={job["rc_file"]}',
+        f'--out={out_dir}',
+        '--fits',
+        f'--run-number={corsika_run}',
+        cerfile,
+    ]
+    log.info('Calling ceres using "{}"'.format(' '.join(cmd)))
+    monitor.run_process(
+        cmd, timeout=timeout, cwd=tmp_dir, env=build_environment(job['mars_dir']),
+    )
+
+    events_file = glob(os.path.join(out_dir, '*Events.fits'))[0]
+    run_file = glob(os.path.join(out_dir, '*RunHeaders.fits'))[0]
+    events_gz_file = f'{output_base}_Events.fits.gz'
+    run_gz_file = f'{output_base}_RunHeaders.fits.gz'
+
+    try:
+        output_files = []
+        for kind, path, gz_path in (
+            ('ceres_events', events_file, events_gz_file),
+            ('ceres_runheader', run_file, run_gz_file),
+        ):
+            log.info(f'Gzipping {path} to {gz_path}')
+            size, sha256 = compress(
+                ['gzip', '--to-stdout', path], gz_path, monitor=monitor,
+            )
+            output_files.append(output_file_info(
+                kind, gz_path, size, sha256, n_events=fits_n_rows(path),
+            ))
+        log.info('gzipping done')
+    except:
+        log.exception('Error gzipping outputfiles to target destination')
+        raise
+
+    return output_files
+
+
 def main():
     log.info('CERES executor started')
 
@@ -27,104 +133,126 @@ def main():
     port = os.environ['MOPRO_SUBMITTER_PORT']
     socket.connect('tcp://{}:{}'.format(host, port))
 
-    job_id = int(os.environ['MOPRO_JOB_ID'])
+    jobs = read_jobs()
+    if len(jobs) > 1:
+        log.info('Group job for CERES runs {}'.format(
+            ', '.join(str(job['job_id']) for job in jobs)
+        ))
 
-    def send_status_update(status, **kwargs):
-        socket.send_pyobj({
-            'program': 'ceres',
-            'job_id': job_id,
-            'status': status,
-            **kwargs
-        })
-
-    send_status_update('running')
-    socket.recv()
+    for job in jobs:
+        send_status_update(job, 'running')
+    # one heartbeat for all runs, stopped before the last final status update
+    heartbeat = start_heartbeat(context, 'ceres', [job['job_id'] for job in jobs])
 
-    output_dir = os.environ['MOPRO_OUTPUTDIR']
-    output_base = os.path.join(output_dir, os.environ['MOPRO_OUTPUTBASENAME'])
     input_file = os.environ['MOPRO_INPUTFILE']
-    rc_file = os.environ['MOPRO_CERES_RC']
     corsika_run = int(os.environ['MOPRO_CORSIKA_RUN'])
     tmp_dir = os.environ.get('MOPRO_TMP_DIR')
-
-    os.makedirs(output_dir, exist_ok=True)
+    staging_dir = os.environ.get('MOPRO_STAGING_DIR')
 
     walltime = float(os.environ['MOPRO_WALLTIME'])
     log.info('Walltime = %.0f', walltime)
 
-    job_name = 'fact_mopro_job_id_' + str(job_id) + '_'
+    # only reported if the staging cache is used
+    staging_info = {}
+
+    job_name = 'fact_mopro_job_id_' + str(jobs[0]['job_id']) + '_'
     with tempfile.TemporaryDirectory(prefix=job_name, dir=tmp_dir) as tmp_dir:
         log.info('Using tmp directory: {}'.format(tmp_dir))
 
         cerfile = f'cer{corsika_run:08d}'
         tmp_input_file = os.path.join(tmp_dir, cerfile)
 
+        # the decompression is accounted to the first run
+        resource_monitor = ResourceMonitor(tmp_dir).start()
         try:
-            sp.run(['zstd', '-d', '-q', input_file, '-o', tmp_input_file], check=True)
-        except sp.CalledProcessError:
-            send_status_update('failed')
-            socket.recv()
+            usage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+            with ExitStack() as stack:
+                if staging_dir is not None:
+                    cache = StagingCache(
+                        staging_dir, int(os.environ['MOPRO_STAGING_MAX_SIZE'])
+                    )
+                    input_file, staging_hit = stack.enter_context(
+                        cache.stage(input_file)
+                    )
+                    staging_info['staging_hit'] = staging_hit
+
+                input_size = os.path.getsize(input_file)
+                resource_monitor.run_process(
+                    ['zstd', '-d', '-q', input_file, '-o', tmp_input_file]
+                )
+            usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        except (sp.CalledProcessError, OSError):
             log.exception('Failed to decompress input file')
+            stop_heartbeat(heartbeat)
+            usage = resource_monitor.stop()
+            for job in jobs:
+                send_status_update(job, 'failed', **usage)
             sys.exit(1)
 
-        timeout = walltime - (start_time - time.monotonic()) - 300
-        try:
-            cmd = [
-                'ceres',
-                '-b',
-                f'--config={rc_file}',
-                f'--out={tmp_dir}',
-                '--fits',
-                f'--run-number={corsika_run}',
-                cerfile,
-            ]
-            log.info('Calling ceres using "{}"'.format(' '.join(cmd)))
-            sp.run(cmd, check=True, timeout=timeout, cwd=tmp_dir)
-        except sp.CalledProcessError:
-            send_status_update('failed')
-            socket.recv()
-            log.exception('Running CERES failed')
-            sys.exit(1)
+        if len(jobs) > 1:
+            cpu_time = (
+                usage.ru_utime - usage_before.ru_utime
+                + usage.ru_stime - usage_before.ru_stime
+            )
+            n_saved = len(jobs) - 1
+            log.info(
+                f'Decompressing once for {len(jobs)} runs saved'
+                f' {n_saved * cpu_time:.1f} CPU seconds'
+                f' and {n_saved * input_size} bytes read'
+            )
 
-        except sp.TimeoutExpired:
-            send_status_update('walltime_exceeded')
-            log.error('CERES about to run into wall-time, terminating')
-            socket.recv()
-            sys.exit(1)
-        except (KeyboardInterrupt, SystemExit):
-            send_status_update('failed')
-            log.error('Interrupted')
-            socket.recv()
-            sys.exit(1)
+        failed = False
+        for i, job in enumerate(jobs):
+            job_start_time = time.monotonic()
+            if i > 0:
+                resource_monitor = ResourceMonitor(tmp_dir).start()
 
-        try:
-            events_file = glob(os.path.join(tmp_dir, '*Events.fits'))[0]
-            run_file = glob(os.path.join(tmp_dir, '*RunHeaders.fits'))[0]
-            events_gz_file = f'{output_base}_Events.fits.gz'
-            run_gz_file = f'{output_base}_RunHeaders.fits.gz'
-
-            log.info(f'Gzipping {events_file} to {events_gz_file}')
-            with open(events_gz_file, 'wb') as f:
-                sp.run(['gzip', '--to-stdout', events_file], stdout=f, check=True)
-
-            log.info(f'Gzipping {run_file} to {run_gz_file}')
-            with open(run_gz_file, 'wb') as f:
-                sp.run(['gzip', '--to-stdout', run_file], stdout=f, check=True)
-
-            log.info('gzipping done')
-        except:
-            log.exception('Error gzipping outputfiles to target destination')
-            send_status_update('failed')
-            socket.recv()
-            sys.exit(1)
+            timeout = walltime - (time.monotonic() - start_time) - 300
+            last = i == len(jobs) - 1
+            try:
+                events_file, runheader_file = run_ceres(
+                    job, corsika_run, cerfile, tmp_dir, timeout, resource_monitor
+                )
+            except sp.TimeoutExpired:
+                log.error('CERES about to run into wall-time, terminating')
+                stop_heartbeat(heartbeat)
+                send_status_update(job, 'walltime_exceeded', **resource_monitor.stop())
+                for remaining_job in jobs[i + 1:]:
+                    send_status_update(remaining_job, 'walltime_exceeded')
+                sys.exit(1)
+            except (KeyboardInterrupt, SystemExit):
+                log.error('Interrupted')
+                stop_heartbeat(heartbeat)
+                send_status_update(job, 'failed', **resource_monitor.stop())
+                for remaining_job in jobs[i + 1:]:
+                    send_status_update(remaining_job, 'failed')
+                sys.exit(1)
+            except:
+                log.exception('Running CERES failed')
+                if last:
+                    stop_heartbeat(heartbeat)
+                send_status_update(job, 'failed', **resource_monitor.stop())
+                failed = True
+                continue
 
-    send_status_update(
-        'success',
-        result_events_file=output_base + '_Events.fits.gz',
-        result_runheader_file=output_base + '_RunHeaders.fits.gz',
-        duration=int(time.monotonic() - start_time),
-    )
-    socket.recv()
+            if last:
+                stop_heartbeat(heartbeat)
+            send_status_update(
+                job,
+                'success',
+                **resource_monitor.stop(),
+                result_events_file=events_file['path'],
+                result_runheader_file=runheader_file['path'],
+                output_files=[events_file, runheader_file],
+                # the shared decompression is accounted to the first run
+                duration=int(
+                    time.monotonic() - (start_time if i == 0 else job_start_time)
+                ),
+                **staging_info,
+            )
+
+    if failed:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -6,8 +6,14 @@ import tempfile
 import sys
 import shutil
 from glob import glob
+from threading import Thread
 import zmq
 
+from .accounting import ResourceMonitor
+from .heartbeat import start_heartbeat
+from .corsika_log import CorsikaLogParser, tee
+from .output_files import compress, output_file_info
+
 start_time = time.monotonic()
 
 context = zmq.Context()
@@ -21,6 +27,51 @@ handler.setFormatter(fmt)
 logging.getLogger().addHandler(handler)
 
 
+def run_corsika(corsika_exe, inputcard, run_dir, timeout, parser, monitor):
+    '''
+    Run CORSIKA, passing its output through `parser` to stdout, the job log,
+    its peak memory is recorded by the `ResourceMonitor` `monitor`.
+    Raises `CalledProcessError` and `TimeoutExpired` like `subprocess.run`.
+    '''
+    # flush our own log messages before writing to the binary stdout
+    sys.stdout.flush()
+
+    process = sp.Popen(
+        ['./' + corsika_exe],
+        cwd=run_dir,
+        stdin=sp.PIPE,
+        stdout=sp.PIPE,
+        stderr=sp.STDOUT,
+    )
+    reader = Thread(target=tee, args=(process.stdout, sys.stdout.buffer, parser))
+    reader.start()
+
+    try:
+        try:
+            process.stdin.write(inputcard)
+            process.stdin.close()
+        except BrokenPipeError:
+            # CORSIKA exited early, the return code tells why
+            pass
+        monitor.wait(process, timeout=timeout)
+    except:
+        process.kill()
+        monitor.wait(process)
+        raise
+    finally:
+        reader.join()
+
+    if process.returncode != 0:
+        raise sp.CalledProcessError(process.returncode, process.args)
+
+
+def log_errors(parser):
+    if parser.n_errors > 0:
+        log.error(f'{parser.n_errors} error lines in CORSIKA output, first ones:')
+        for line in parser.errors:
+            log.error(line)
+
+
 def main():
     log.info('CORSIKA executor started')
 
@@ -29,8 +80,17 @@ def main():
     socket.connect('tcp://{}:{}'.format(host, port))
 
     job_id = int(os.environ['MOPRO_JOB_ID'])
+    resource_monitor = None
+    heartbeat = None
 
     def send_status_update(status, **kwargs):
+        if status != 'running':
+            if heartbeat is not None:
+                heartbeat.stop()
+            # final status updates include the used resources
+            if resource_monitor is not None:
+                kwargs.update(resource_monitor.stop())
+
         socket.send_pyobj({
             'program': 'corsika',
             'job_id': job_id,
@@ -44,7 +104,10 @@ def main():
     output_dir = os.environ['MOPRO_OUTPUTDIR']
     output_file = os.environ['MOPRO_OUTPUTFILE']
     tmp_dir = os.environ.get('MOPRO_TMP_DIR')
-    log_file = os.environ['MOPRO_LOGFILE']
+
+    # the output of CORSIKA is parsed while it is written to the job log
+    parser = CorsikaLogParser()
+    heartbeat = start_heartbeat(context, 'corsika', [job_id], parser)
 
     os.makedirs(output_dir, exist_ok=True)
 
@@ -60,23 +123,21 @@ def main():
     job_name = 'fact_mopro_job_id_' + str(job_id) + '_'
     with tempfile.TemporaryDirectory(prefix=job_name, dir=tmp_dir) as tmp_dir:
         log.debug('Using tmp directory: {}'.format(tmp_dir))
+        resource_monitor = ResourceMonitor(tmp_dir).start()
 
         run_dir = os.path.join(tmp_dir, 'run')
         shutil.copytree(os.path.join(corsika_dir, 'run'), run_dir)
-        timeout = walltime - (start_time - time.monotonic()) - 300
+        timeout = walltime - (time.monotonic() - start_time) - 300
         try:
-            sp.run(
-                ['./' + corsika_exe],
-                check=True,
-                timeout=timeout,
-                cwd=run_dir,
-                input=inputcard,
+            run_corsika(
+                corsika_exe, inputcard, run_dir, timeout, parser, resource_monitor
             )
 
         except sp.CalledProcessError:
             send_status_update('failed')
             socket.recv()
             log.exception('Running CORSIKA failed')
+            log_errors(parser)
             sys.exit(1)
 
         except sp.TimeoutExpired:
@@ -90,23 +151,21 @@ def main():
             socket.recv()
             sys.exit(1)
 
-        with open(log_file, 'r') as f:
-            corsika_log = f.read()
-
-        if '== END OF RUN ==' not in corsika_log:
+        if not parser.finished:
             log.error('== END OF RUN== not in CORSIKA log output')
             log.error('CORSIKA did not finish successfully')
+            log_errors(parser)
             send_status_update('failed')
             sys.exit(1)
 
         try:
             log.info('Compressing file using zstd')
             result_file = os.path.join(output_dir, output_file + '.zst')
-            sp.run([
-                'zstd', '-5', '-f',
-                os.path.join(run_dir, output_file),
-                '-o', result_file,
-            ], check=True)
+            size, sha256 = compress(
+                ['zstd', '-5', '-q', '-c', os.path.join(run_dir, output_file)],
+                result_file,
+                monitor=resource_monitor,
+            )
             log.info('Compressing done')
         except:
             log.exception('Compressing to output destination failed')
@@ -118,6 +177,10 @@ def main():
         'success',
         result_file=result_file,
         duration=int(time.monotonic() - start_time),
+        # the number of events of CORSIKA files is the number of simulated showers
+        output_files=[
+            output_file_info('corsika', result_file, size, sha256, parser.progress),
+        ],
     )
     socket.recv()
 
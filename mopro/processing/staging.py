@@ -0,0 +1,190 @@
+'''
+Node-local staging cache for job input files.
+
+Input files on shared storage are copied into a local cache directory once
+and reused by following jobs on the same node, e.g. when several
+CERES settings are run on the same CORSIKA output.
+
+The cache is bounded in size, least recently used entries are evicted first.
+Concurrent jobs on one node are synchronized using `flock`:
+each entry has its own lock file, held exclusively while the entry is copied
+and shared while a job reads from it, so entries in use are never evicted.
+`flock` cannot downgrade a lock atomically, so after taking the shared lock
+the entry is checked again and staged again if it was evicted in between.
+Evicting an entry also removes its lock file, jobs waiting on a removed
+lock file open the new one.
+
+This module is used by the executors and must only depend on the standard library.
+'''
+import os
+import fcntl
+import shutil
+import hashlib
+import logging
+from contextlib import contextmanager
+
+
+log = logging.getLogger(__name__)
+
+LOCK_SUFFIX = '.lock'
+TMP_SUFFIX = '.tmp'
+
+
+class StagingCache:
+    '''
+    Parameters
+    ----------
+    directory: str
+        local directory for the cached files, created if it does not exist
+    max_size: int
+        maximum total size of the cached files in bytes
+    '''
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def hit_rate(self):
+        n_requests = self.hits + self.misses
+        if n_requests == 0:
+            return None
+        return self.hits / n_requests
+
+    def entry_path(self, path):
+        '''
+        Path of the cache entry for `path`, including size and mtime
+        in the key, so changed files are not served from the cache
+        '''
+        stat = os.stat(path)
+        key = hashlib.sha1(
+            f'{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}'.encode()
+        ).hexdigest()
+        return os.path.join(self.directory, key + '_' + os.path.basename(path))
+
+    @contextmanager
+    def stage(self, path):
+        '''
+        Context manager yielding the local path for `path` and whether
+        it was already in the cache.
+        The entry cannot be evicted until the context is left.
+        Files larger than the cache are not staged, the original path is yielded.
+        '''
+        size = os.path.getsize(path)
+        if size > self.max_size:
+            log.warning(f'{path} is larger than the staging cache, not staging')
+            self.misses += 1
+            yield path, False
+            return
+
+        entry = self.entry_path(path)
+        while True:
+            hit = self.fill(path, entry, size)
+            lock = self.lock(entry, fcntl.LOCK_SH)
+            if os.path.isfile(entry):
+                break
+            # evicted between releasing the exclusive and taking the shared lock
+            lock.close()
+
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+        with lock:
+            yield entry, hit
+
+    def fill(self, path, entry, size):
+        '''
+        Copy `path` to the cache `entry` unless it is already cached,
+        returns whether it was cached
+        '''
+        with self.lock(entry, fcntl.LOCK_EX):
+            if os.path.isfile(entry):
+                # mark as recently used
+                os.utime(entry)
+                log.info(f'Using staged copy {entry} of {path}')
+                return True
+
+            self.make_room(size, keep=entry)
+            log.info(f'Staging {path} to {entry}')
+            try:
+                shutil.copyfile(path, entry + TMP_SUFFIX)
+                os.rename(entry + TMP_SUFFIX, entry)
+            except:
+                self._remove(entry + TMP_SUFFIX)
+                raise
+            return False
+
+    @staticmethod
+    def lock(entry, operation):
+        '''
+        Open the lock file of `entry` and `flock` it using `operation`.
+        Retries if the lock file was removed by an eviction while waiting,
+        so all jobs lock the same file.
+        '''
+        lock_path = entry + LOCK_SUFFIX
+        while True:
+            lock = open(lock_path, 'a')
+            try:
+                fcntl.flock(lock, operation)
+                current = os.stat(lock_path).st_ino == os.fstat(lock.fileno()).st_ino
+            except FileNotFoundError:
+                current = False
+            except:
+                lock.close()
+                raise
+
+            if current:
+                return lock
+            lock.close()
+
+    def entries(self):
+        ''' List of (mtime, size, path) of all cache entries '''
+        entries = []
+        with os.scandir(self.directory) as it:
+            for f in it:
+                if f.name.endswith((LOCK_SUFFIX, TMP_SUFFIX)) or not f.is_file():
+                    continue
+                stat = f.stat()
+                entries.append((stat.st_mtime, stat.st_size, f.path))
+        return entries
+
+    def make_room(self, size, keep=None):
+        '''
+        Evict least recently used entries not in use by other jobs,
+        until `size` more bytes fit into the cache.
+        '''
+        with open(os.path.join(self.directory, LOCK_SUFFIX), 'a') as cache_lock:
+            fcntl.flock(cache_lock, fcntl.LOCK_EX)
+
+            entries = sorted(self.entries())
+            total = sum(entry_size for _, entry_size, _ in entries)
+
+            for _, entry_size, path in entries:
+                if total + size <= self.max_size:
+                    break
+                if path == keep:
+                    continue
+
+                try:
+                    lock = self.lock(path, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # in use by another job
+                    continue
+
+                with lock:
+                    log.info(f'Evicting {path} from staging cache')
+                    self._remove(path)
+                    self._remove(path + LOCK_SUFFIX)
+                    total -= entry_size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -1,12 +1,27 @@
 from threading import Thread, Event
 import logging
+import time
+from datetime import datetime
 import peewee
 import socket
 
 from ..database import CorsikaRun, CeresRun
-from ..queries import get_pending_jobs, count_jobs, update_job_status
+from ..queries import (
+    get_pending_jobs,
+    get_job_counts,
+    get_staging_hit_rate,
+    reconcile_job_counts,
+    retry_failed_jobs,
+    get_stale_jobs,
+    fail_lost_jobs,
+    reconcile_with_cluster,
+    programs,
+    update_job_status,
+)
+from ..cluster import parse_job_name
 from .corsika import prepare_corsika_job
-from .ceres import prepare_ceres_job
+from .ceres import prepare_ceres_job, prepare_ceres_group_job
+from .preparation import PreparationContext
 
 
 log = logging.getLogger(__name__)
@@ -27,6 +42,17 @@ class JobSubmitter(Thread):
         corsika_memory='4G',
         ceres_memory='12G',
         tmp_dir=None,
+        reconcile_interval=3600,
+        staging=None,
+        group_ceres=False,
+        policy=None,
+        retry=None,
+        walltime_estimator=None,
+        heartbeat_interval=None,
+        heartbeat_timeout=None,
+        builder=None,
+        storage_throttle=None,
+        retention=None,
     ):
         '''
         Parametrs
@@ -44,6 +70,35 @@ class JobSubmitter(Thread):
             hostname of the submitter node
         port: int
             port for the zmq communication
+        reconcile_interval: int
+            number of seconds between recounting the job counts table,
+            correcting drift from runs inserted or changed outside of mopro
+        staging: StagingConfig
+            configuration of the node-local staging cache for CERES input files
+        group_ceres: bool
+            If True, submit all pending CERES runs of the same CORSIKA run
+            as one job, decompressing the input file only once
+        policy: SchedulingPolicy
+            policy deciding the order of pending jobs, default is by priority
+        retry: RetryConfig
+            automatic retries of failed runs, disabled if None
+        walltime_estimator: WalltimeEstimator
+            if given, CORSIKA runs are submitted with the walltime estimated
+            from past runs of the same settings instead of their default
+        heartbeat_interval: int
+            seconds between heartbeats of the executors, no heartbeats if None
+        heartbeat_timeout: int
+            seconds without heartbeat after which running jobs, that are
+            not running on the cluster anymore, are set to failed
+        builder: CorsikaBuilder
+            if given, missing CORSIKA settings of the pending runs are built
+            in parallel before submitting, instead of one by one
+        storage_throttle: StorageThrottle
+            if given, only as many pending runs are submitted as fit into
+            the free space of the output file system and tmp directory
+        retention: RetentionPolicy
+            if given, CORSIKA files no longer needed are removed
+            and removed files needed again are regenerated
         '''
         super().__init__()
         self.event = Event()
@@ -57,27 +112,192 @@ class JobSubmitter(Thread):
         self.ceres_memory = ceres_memory
         self.corsika_memory = corsika_memory
         self.tmp_dir = tmp_dir
+        self.reconcile_interval = reconcile_interval
+        self.staging = staging
+        self.group_ceres = group_ceres
+        self.policy = policy
+        self.retry = retry
+        self.walltime_estimator = walltime_estimator
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.builder = builder
+        self.storage_throttle = storage_throttle
+        self.retention = retention
+        self.last_reconcile = None
 
     def run(self):
+        self.startup()
         while not self.event.is_set():
-            try:
-                self.process_pending_jobs()
-            except peewee.OperationalError:
-                log.exception('Lost database connection')
-            except Exception as e:
-                log.exception('Error during submission: {}'.format(e))
+            self.tick()
             self.event.wait(self.interval)
 
+    def startup(self):
+        try:
+            self.reconcile_with_cluster()
+        except Exception as e:
+            log.exception('Error during reconciliation with the cluster: {}'.format(e))
+
+    def tick(self):
+        ''' One submission iteration, logging instead of raising errors '''
+        try:
+            self.process_pending_jobs()
+        except peewee.OperationalError:
+            log.exception('Lost database connection')
+        except Exception as e:
+            log.exception('Error during submission: {}'.format(e))
+
     def terminate(self):
         self.event.set()
 
+    def reconcile_job_counts(self):
+        '''
+        Recount the job counts table if the last reconciliation
+        is older than `reconcile_interval`
+        '''
+        now = time.monotonic()
+        if self.last_reconcile is not None:
+            if now - self.last_reconcile < self.reconcile_interval:
+                return
+
+        drift = reconcile_job_counts()
+        self.last_reconcile = now
+        if drift > 0:
+            log.warning(f'Job counts were off by {drift} runs, corrected')
+
+        if self.staging is not None and self.staging.directory is not None:
+            hit_rate = get_staging_hit_rate(self.location)
+            if hit_rate is not None:
+                log.info(f'Staging cache hit rate: {hit_rate:.1%}')
+
+    def reconcile_with_cluster(self):
+        '''
+        Compare the queued and running runs of this location with the
+        jobs in the cluster after a (re)start of the submitter.
+        Orphaned queued runs are reset to created, orphaned running runs
+        are set to failed and jobs submitted right before a crash are adopted.
+        '''
+        cluster_jobs = {}
+        for job_name, state in self.cluster.get_jobs().items():
+            parsed = parse_job_name(job_name)
+            if parsed is not None:
+                program, job_ids = parsed
+                cluster_jobs.update(((program, job_id), state) for job_id in job_ids)
+
+        changed = reconcile_with_cluster(self.location, cluster_jobs)
+        for (program, status), n_jobs in sorted(changed.items()):
+            if n_jobs > 0:
+                log.warning(f'Reconciliation set {n_jobs} {program} runs to {status}')
+
+        # the counts are recomputed in the next iteration
+        self.last_reconcile = None
+
+    def group_jobs(self, pending_jobs):
+        '''
+        Split pending jobs into the lists of runs submitted as one job.
+        If `group_ceres` is set, all CERES runs of the same CORSIKA run
+        are bundled, otherwise each run is submitted on its own.
+        Groups are split so their summed walltime fits the
+        longest walltime of the cluster.
+        '''
+        if not self.group_ceres:
+            return [[job] for job in pending_jobs]
+
+        max_walltime = self.cluster.max_walltime if self.cluster is not None else None
+
+        groups = []
+        # the open group and its summed walltime for each CORSIKA run
+        ceres_groups = {}
+        for job in pending_jobs:
+            if job.model is not CeresRun:
+                groups.append([job])
+                continue
+
+            group, walltime = ceres_groups.get(job.corsika_run_id, (None, 0))
+            walltime += job.walltime or 0
+            if group is None or (max_walltime is not None and walltime > max_walltime):
+                group = []
+                walltime = job.walltime or 0
+                groups.append(group)
+
+            group.append(job)
+            ceres_groups[job.corsika_run_id] = group, walltime
+
+        return groups
+
+    def retry_failed_jobs(self):
+        if self.retry is None or self.retry.max_retries <= 0:
+            return
+
+        n_retried = retry_failed_jobs(
+            max_retries=self.retry.max_retries,
+            backoff=self.retry.backoff,
+            walltime_factor=self.retry.walltime_factor,
+            max_walltime=self.cluster.max_walltime,
+        )
+        if n_retried > 0:
+            log.info(f'Reset {n_retried} failed runs for another attempt')
+
+    def reap_lost_jobs(self):
+        '''
+        Set runs to failed that did not send a heartbeat for
+        `heartbeat_timeout` seconds and are not running on the cluster,
+        e.g. because the node died or the job was killed.
+        '''
+        if not self.heartbeat_interval or not self.heartbeat_timeout:
+            return
+
+        stale = get_stale_jobs(self.location, self.heartbeat_timeout)
+        if not any(stale.values()):
+            return
+
+        alive = set()
+        for job_name in self.cluster.get_running_jobs():
+            parsed = parse_job_name(job_name)
+            if parsed is not None:
+                program, job_ids = parsed
+                alive.update((program, job_id) for job_id in job_ids)
+
+        for program, job_ids in stale.items():
+            lost = [job_id for job_id in job_ids if (program, job_id) not in alive]
+            if lost:
+                log.warning(f'Lost {program} jobs {lost}, setting to failed')
+                fail_lost_jobs(programs[program], lost)
+
+    def apply_retention(self):
+        '''
+        Run the retention policy, errors are logged
+        so they do not stop the submission of pending runs
+        '''
+        if self.retention is None:
+            return
+
+        try:
+            n_restored, n_rerun = self.retention.regenerate(self.location)
+            if n_restored > 0:
+                log.info(f'Restored {n_restored} archived CORSIKA files for pending runs')
+            if n_rerun > 0:
+                log.info(f'Running {n_rerun} CORSIKA runs again for pending CERES runs')
+
+            n_cleaned = self.retention.clean(self.location)
+            if n_cleaned > 0:
+                log.info(f'Retention policy removed {n_cleaned} CORSIKA files')
+        except peewee.OperationalError:
+            raise
+        except Exception:
+            log.exception('Error while applying the retention policy')
+
     def process_pending_jobs(self):
         '''
         Fetches pending runs from the processing database
         and submits them using qsub if not to many jobs are running already.
         '''
-        pending_corsika = count_jobs(CorsikaRun, status='created')
-        pending_ceres = count_jobs(CeresRun, status='created')
+        self.reconcile_job_counts()
+        self.reap_lost_jobs()
+        self.retry_failed_jobs()
+        self.apply_retention()
+        job_counts = get_job_counts()
+        pending_corsika = job_counts[('corsika', 'created')]
+        pending_ceres = job_counts[('ceres', 'created')]
 
         n_queued = self.cluster.n_queued
         log.debug(f'{self.cluster.n_running} jobs running')
@@ -87,9 +307,23 @@ class JobSubmitter(Thread):
 
         new_jobs = self.max_queued_jobs - n_queued
         if new_jobs > 0:
-            pending_jobs = get_pending_jobs(max_jobs=new_jobs, location=self.location)
+            pending_jobs = get_pending_jobs(
+                max_jobs=new_jobs, location=self.location, policy=self.policy,
+            )
+            if self.storage_throttle is not None:
+                pending_jobs = self.storage_throttle.limit(pending_jobs, self.location)
+
+            if self.builder is not None:
+                self.builder.build_missing(pending_jobs)
+
+            # remembers created directories and found software for this iteration
+            context = PreparationContext()
+            try:
+                context.prepare_directories(pending_jobs, self.mopro_directory)
+            except OSError:
+                log.exception('Could not create output directories')
 
-            for job in pending_jobs:
+            for jobs in self.group_jobs(pending_jobs):
                 if self.event.is_set():
                     break
 
@@ -97,26 +331,57 @@ class JobSubmitter(Thread):
                     'mopro_directory': self.mopro_directory,
                     'submitter_host': self.host,
                     'submitter_port': self.port,
-                    'tmp_dir': self.tmp_dir
+                    'tmp_dir': self.tmp_dir,
+                    'heartbeat_interval': self.heartbeat_interval,
+                    'context': context,
                 }
 
+                job = jobs[0]
+                # stored with the run for the walltime report
+                estimated = {}
                 try:
-                    if isinstance(job, CorsikaRun):
+                    if job.model is CorsikaRun:
+                        if self.walltime_estimator is not None:
+                            walltime = self.walltime_estimator.estimate(
+                                job, max_walltime=self.cluster.max_walltime,
+                            )
+                            if walltime is not None:
+                                job.walltime = walltime
+                                estimated['walltime_estimated'] = True
                         self.cluster.submit_job(
                             **prepare_corsika_job(job, **kwargs),
                             memory=self.corsika_memory
                         )
                         log.info(f'Submitted new CORSIKA job with id {job.id}')
-                    elif isinstance(job, CeresRun):
+                    elif job.model is CeresRun and len(jobs) > 1:
                         self.cluster.submit_job(
-                            **prepare_ceres_job(job, **kwargs),
+                            **prepare_ceres_group_job(
+                                jobs, staging=self.staging, **kwargs
+                            ),
+                            memory=self.ceres_memory
+                        )
+                        log.info('Submitted new CERES group job with ids {}'.format(
+                            ', '.join(str(j.id) for j in jobs)
+                        ))
+                    elif job.model is CeresRun:
+                        self.cluster.submit_job(
+                            **prepare_ceres_job(job, staging=self.staging, **kwargs),
                             memory=self.ceres_memory
                         )
                         log.info(f'Submitted new CERES job with id {job.id}')
                     else:
                         raise ValueError(f'Unknown job type: {job}')
 
-                    update_job_status(type(job), job.id, 'queued', location=self.location)
+                    queued_at = datetime.utcnow()
+                    for job in jobs:
+                        update_job_status(
+                            job.model, job.id, 'queued',
+                            location=self.location,
+                            queued_at=queued_at,
+                            walltime=job.walltime,
+                            **estimated,
+                        )
                 except:
                     log.exception('Could not submit job')
-                    update_job_status(type(job), job.id, 'failed')
+                    for job in jobs:
+                        update_job_status(job.model, job.id, 'failed')
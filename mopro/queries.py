@@ -1,26 +1,118 @@
+from collections import Counter
+from operator import attrgetter
+from itertools import islice
+import heapq
+import math
+from datetime import datetime, timedelta
+from peewee import fn, Case
+
 from .database import (
     database,
     Status,
+    JobCount,
     CorsikaRun,
     CeresRun,
     CeresSettings,
     CorsikaSettings,
+    OutputFile,
+    zenith_bin,
 )
 
 
+programs = {
+    'corsika': CorsikaRun,
+    'ceres': CeresRun,
+}
+program_names = {model: name for name, model in programs.items()}
+
+
+def change_job_status(model, condition, new_status, **kwargs):
+    '''
+    Set the status of all runs of `model` matching `condition`
+    and update the `JobCount` table in the same transaction.
+
+    Must be called with an open connection.
+    Returns the number of updated rows.
+    '''
+    new_status_id = Status.get(Status.name == new_status).id
+
+    with database.atomic():
+        old_counts = (
+            model
+            .select(model.status, fn.COUNT(model.id))
+            .where(condition)
+            .group_by(model.status)
+            .for_update(database.for_update)
+            .tuples()
+        )
+        deltas = Counter()
+        for status_id, n_jobs in old_counts:
+            deltas[status_id] -= n_jobs
+            deltas[new_status_id] += n_jobs
+
+        n_updated = (
+            model.update(status=new_status_id, **kwargs).where(condition).execute()
+        )
+        adjust_job_counts(model, deltas)
+
+    return n_updated
+
+
+def adjust_job_counts(model, deltas):
+    '''
+    Add `deltas`, a mapping of status id to change in number of runs,
+    to the job counts of `model`
+    '''
+    program = program_names[model]
+    for status_id, delta in deltas.items():
+        if delta == 0:
+            continue
+
+        n_updated = (
+            JobCount
+            .update(count=JobCount.count + delta)
+            .where(JobCount.program == program)
+            .where(JobCount.status == status_id)
+            .execute()
+        )
+        if n_updated == 0:
+            # the next reconciliation will fix negative deltas on missing rows
+            JobCount.insert(
+                program=program, status=status_id, count=max(delta, 0)
+            ).execute()
+
+
+def insert_runs(model, runs):
+    '''
+    Insert `runs`, dicts of field values of `model` with the status
+    as `Status` or its id, and add them to the `JobCount` table
+    in the same transaction.
+
+    Must be called with an open connection.
+    Returns the number of inserted runs.
+    '''
+    runs = list(runs)
+    deltas = Counter(getattr(run['status'], 'id', run['status']) for run in runs)
+
+    with database.atomic():
+        if runs:
+            model.insert_many(runs).execute()
+        adjust_job_counts(model, deltas)
+
+    return len(runs)
+
+
 @database.connection_context()
 def update_job_status(model, job_id, new_status='created', **kwargs):
-    # subquery for new status
-    status = Status.select().where(Status.name == new_status)
-    return (
-        model.update(status=status, **kwargs)
-        .where(model.id == job_id)
-        .execute()
-    )
+    return change_job_status(model, model.id == job_id, new_status, **kwargs)
 
 
 @database.connection_context()
 def count_jobs(model, status='created'):
+    '''
+    Count the runs of `model` in `status` directly in the run table.
+    Use `get_job_counts` for the cheap, incrementally updated numbers.
+    '''
     return (
         model.select()
         .where(model.status == Status.select().where(Status.name == status))
@@ -29,51 +121,496 @@ def count_jobs(model, status='created'):
 
 
 @database.connection_context()
-def get_pending_jobs(max_jobs, location):
+def get_job_counts():
+    '''
+    Return the number of runs per program and status from the
+    job counts table as dict mapping (program, status) to count.
+    '''
+    counts = {
+        (program, name): 0
+        for program in programs
+        for name, in Status.select(Status.name).tuples()
+    }
+    query = (
+        JobCount
+        .select(JobCount.program, Status.name, JobCount.count)
+        .join(Status)
+        .tuples()
+    )
+    for program, name, count in query:
+        counts[(program, name)] = count
+    return counts
+
+
+@database.connection_context()
+def reconcile_job_counts():
+    '''
+    Recount all runs per program and status and overwrite
+    the job counts table with the result.
+    Returns the number of runs the stored counts were off.
+    '''
+    drift = 0
+    with database.atomic():
+        stored = {
+            (program, status_id): count
+            for program, status_id, count in
+            JobCount.select(JobCount.program, JobCount.status, JobCount.count).tuples()
+        }
+        status_ids = [status_id for status_id, in Status.select(Status.id).tuples()]
+
+        for program, model in programs.items():
+            counts = dict(
+                model
+                .select(model.status, fn.COUNT(model.id))
+                .group_by(model.status)
+                .tuples()
+            )
+            for status_id in status_ids:
+                count = counts.get(status_id, 0)
+                drift += abs(count - stored.get((program, status_id), 0))
+                JobCount.replace(program=program, status=status_id, count=count).execute()
+
+    return drift
+
+
+@database.connection_context()
+def retry_failed_jobs(max_retries, backoff=600, walltime_factor=2, max_walltime=None):
+    '''
+    Reset failed and walltime exceeded runs retried less than `max_retries`
+    times to created, so they are submitted again.
+    A run is thus started at most `max_retries + 1` times.
+
+    The n-th retry is not submitted before `backoff * 2**(n - 1)` seconds
+    have passed, the walltime of runs that exceeded it is multiplied by
+    `walltime_factor` and rounded up to whole minutes, up to `max_walltime` minutes.
+
+    Returns the number of runs reset.
+    '''
+    now = datetime.utcnow()
+    failed = Status.select(Status.id).where(Status.name == 'failed')
+    walltime_exceeded = Status.select(Status.id).where(Status.name == 'walltime_exceeded')
+
+    n_retried = 0
+    for model in programs.values():
+        # rounding up is not portable in SQL, so the new walltime is computed
+        # here for each distinct walltime of the runs to be retried
+        walltimes = (
+            model.select(model.walltime).distinct()
+            .where(model.status == walltime_exceeded)
+            .where(model.attempts < max_retries)
+            .tuples()
+        )
+        new_walltimes = []
+        for old_walltime, in walltimes:
+            new_walltime = math.ceil(old_walltime * walltime_factor)
+            if max_walltime is not None:
+                new_walltime = min(new_walltime, max_walltime)
+            new_walltimes.append((old_walltime, new_walltime))
+        walltime = model.walltime
+        if new_walltimes:
+            walltime = Case(model.walltime, new_walltimes, model.walltime)
+
+        # one update per attempt number, all runs in it get the same backoff
+        for attempt in range(max_retries):
+            kwargs = dict(
+                attempts=attempt + 1,
+                not_before=now + timedelta(seconds=backoff * 2**attempt),
+                location=None,
+            )
+            n_retried += change_job_status(
+                model,
+                (model.status == failed) & (model.attempts == attempt),
+                'created',
+                **kwargs,
+            )
+            n_retried += change_job_status(
+                model,
+                (model.status == walltime_exceeded) & (model.attempts == attempt),
+                'created',
+                walltime=walltime,
+                **kwargs,
+            )
+
+    return n_retried
+
+
+@database.connection_context()
+def get_stale_jobs(location, timeout):
+    '''
+    Get the ids of running runs of `location` without a heartbeat,
+    or start if no heartbeat arrived yet, for more than `timeout` seconds.
+    Returns a dict mapping program to list of run ids.
+    '''
+    limit = datetime.utcnow() - timedelta(seconds=timeout)
+    running = Status.select(Status.id).where(Status.name == 'running')
+
+    stale = {}
+    for program, model in programs.items():
+        last_seen = fn.COALESCE(model.last_heartbeat, model.started_at)
+        stale[program] = [
+            job_id for job_id, in
+            model.select(model.id)
+            .where(model.status == running)
+            .where(model.location == location)
+            .where(last_seen < limit)
+            .tuples()
+        ]
+    return stale
+
+
+@database.connection_context()
+def fail_lost_jobs(model, job_ids):
+    ''' Set the runs with `job_ids` still running to failed '''
+    running = Status.select(Status.id).where(Status.name == 'running')
+    return change_job_status(
+        model, model.id.in_(job_ids) & (model.status == running), 'failed',
+        finished_at=datetime.utcnow(),
+    )
+
+
+@database.connection_context()
+def reconcile_with_cluster(location, cluster_jobs):
+    '''
+    Bring the queued and running runs of `location` in line with the
+    jobs actually known to the cluster, e.g. after a crash of the submitter.
+
+    Parameters
+    ----------
+    location: str
+        only runs submitted from this location are considered
+    cluster_jobs: dict
+        mapping (program, run id) to "queued" or "running"
+        for all mopro jobs currently in the cluster
+
+    Runs queued in the database but unknown to the cluster never started and
+    are reset to created. Runs running in the database but unknown to the
+    cluster are lost and set to failed, so the automatic retries pick them up.
+    Runs still created in the database but present in the cluster were submitted
+    right before a crash and are adopted instead of being submitted twice.
+
+    Returns a dict mapping (program, new status) to the number of changed runs.
+    '''
+    status_ids = dict(Status.select(Status.name, Status.id).tuples())
+    active = [status_ids['queued'], status_ids['running']]
+    status_names = {status_ids[name]: name for name in ('queued', 'running')}
+
+    changed = Counter()
+    for program, model in programs.items():
+        in_cluster = {
+            job_id: state for (p, job_id), state in cluster_jobs.items()
+            if p == program
+        }
+        in_database = {
+            job_id: status_names[status_id] for job_id, status_id in
+            model.select(model.id, model.status)
+            .where(model.location == location)
+            .where(model.status.in_(active))
+            .tuples()
+        }
+
+        orphans = {'queued': [], 'running': []}
+        for job_id, status in in_database.items():
+            if job_id not in in_cluster:
+                orphans[status].append(job_id)
+
+        if orphans['queued']:
+            changed[(program, 'created')] += change_job_status(
+                model,
+                model.id.in_(orphans['queued']) & (model.status == status_ids['queued']),
+                'created',
+                location=None,
+                queued_at=None,
+            )
+
+        if orphans['running']:
+            changed[(program, 'failed')] += change_job_status(
+                model,
+                model.id.in_(orphans['running'])
+                & (model.status == status_ids['running']),
+                'failed',
+                finished_at=datetime.utcnow(),
+            )
+
+        unknown = [job_id for job_id in in_cluster if job_id not in in_database]
+        for state in ('queued', 'running'):
+            job_ids = [job_id for job_id in unknown if in_cluster[job_id] == state]
+            if not job_ids:
+                continue
+            kwargs = {'location': location}
+            if state == 'running':
+                kwargs['started_at'] = datetime.utcnow()
+            changed[(program, state)] += change_job_status(
+                model,
+                model.id.in_(job_ids) & (model.status == status_ids['created']),
+                state,
+                **kwargs,
+            )
+
+    return dict(changed)
+
+
+def add_output_files(model, job_id, output_files):
+    '''
+    Add the `output_files` reported by the executor for the successful
+    run `job_id` of `model` to the `OutputFile` catalogue,
+    replacing the entries of earlier attempts.
+
+    Must be called with an open connection.
+    '''
+    if model is CorsikaRun:
+        corsika_run = CorsikaRun.get_by_id(job_id)
+        run_info = dict(ceres_run=None, ceres_settings=None, mode=None)
+    else:
+        ceres_run = (
+            CeresRun
+            .select(CeresRun, CorsikaRun)
+            .join(CorsikaRun)
+            .where(CeresRun.id == job_id)
+            .get()
+        )
+        corsika_run = ceres_run.corsika_run
+        run_info = dict(
+            ceres_run=job_id,
+            ceres_settings=ceres_run.ceres_settings_id,
+            mode=ceres_run.build_mode_string(),
+        )
+    run_info.update(
+        corsika_run=corsika_run.id,
+        corsika_settings=corsika_run.corsika_settings_id,
+        primary_particle=corsika_run.primary_particle,
+        zenith_bin=zenith_bin(corsika_run.zenith_min, corsika_run.zenith_max),
+    )
+
+    with database.atomic():
+        paths = [output_file['path'] for output_file in output_files]
+        OutputFile.delete().where(OutputFile.path.in_(paths)).execute()
+        OutputFile.insert_many([
+            dict(
+                run_info,
+                kind=output_file['kind'],
+                path=output_file['path'],
+                size=output_file['size'],
+                sha256=output_file['sha256'],
+                n_events=output_file.get('n_events'),
+            )
+            for output_file in output_files
+        ]).execute()
+
+
+@database.connection_context()
+def get_ceres_settings_ids(names):
+    ''' Ids of all revisions of the CERES settings `names`, as (name, id) tuples '''
+    return list(
+        CeresSettings.select(CeresSettings.name, CeresSettings.id)
+        .where(CeresSettings.name.in_(list(names)))
+        .tuples()
+    )
+
+
+@database.connection_context()
+def get_finished_inputs(location, required, limit):
+    '''
+    Successful CORSIKA runs of `location` with their result file still in place,
+    which have a CERES run for each of the `required` CERES settings names,
+    in any of their revisions, and of which all CERES runs succeeded.
+    Returns at most `limit` tuples (id, result_file).
+    '''
+    success = Status.get(Status.name == 'success').id
+    required = sorted(set(required))
+    if not required:
+        raise ValueError('At least one CERES settings name is required')
+
+    n_unfinished = fn.SUM(Case(None, [(CeresRun.status != success, 1)], 0))
+    n_required = fn.COUNT(fn.DISTINCT(
+        Case(None, [(CeresSettings.name.in_(required), CeresSettings.name)])
+    ))
+    return list(
+        CorsikaRun
+        .select(CorsikaRun.id, CorsikaRun.result_file)
+        .join(CeresRun)
+        .join(CeresSettings)
+        .where(CorsikaRun.status == success)
+        .where(CorsikaRun.location == location)
+        .where(CorsikaRun.cleaned_at.is_null())
+        .where(CorsikaRun.result_file.is_null(False))
+        .group_by(CorsikaRun.id, CorsikaRun.result_file)
+        .having((n_unfinished == 0) & (n_required == len(required)))
+        .order_by(CorsikaRun.id)
+        .limit(limit)
+        .tuples()
+    )
+
+
+@database.connection_context()
+def mark_inputs_cleaned(archive_files):
+    '''
+    Record that the result files of the CORSIKA runs were removed.
+    `archive_files` maps run id to the archived file or None if it was deleted.
+    The catalogue entries are moved to the archive or deleted.
+    '''
+    now = datetime.utcnow()
+    with database.atomic():
+        deleted = [job_id for job_id, path in archive_files.items() if path is None]
+        if deleted:
+            CorsikaRun.update(cleaned_at=now).where(CorsikaRun.id.in_(deleted)).execute()
+            (
+                OutputFile.delete()
+                .where(OutputFile.corsika_run.in_(deleted))
+                .where(OutputFile.kind == 'corsika')
+                .execute()
+            )
+
+        for job_id, path in archive_files.items():
+            if path is None:
+                continue
+            CorsikaRun.update(cleaned_at=now, archive_file=path).where(
+                CorsikaRun.id == job_id
+            ).execute()
+            (
+                OutputFile.update(path=path)
+                .where(OutputFile.corsika_run == job_id)
+                .where(OutputFile.kind == 'corsika')
+                .execute()
+            )
+
+
+@database.connection_context()
+def get_cleaned_inputs(location):
+    '''
+    CORSIKA runs of `location` whose result file was removed,
+    but that are the input of pending CERES runs.
+    Returns a list of tuples (id, result_file, archive_file).
+    '''
+    created = Status.select(Status.id).where(Status.name == 'created')
+    return list(
+        CorsikaRun
+        .select(CorsikaRun.id, CorsikaRun.result_file, CorsikaRun.archive_file)
+        .where(CorsikaRun.cleaned_at.is_null(False))
+        .where(CorsikaRun.location == location)
+        .where(fn.EXISTS(
+            CeresRun.select(CeresRun.id)
+            .where(CeresRun.corsika_run == CorsikaRun.id)
+            .where(CeresRun.status.in_(created))
+        ))
+        .tuples()
+    )
+
+
+@database.connection_context()
+def restore_inputs(job_ids):
+    '''
+    Record that the archived result files of the CORSIKA runs
+    are back in place and update their catalogue entries
+    '''
+    with database.atomic():
+        for job_id, result_file in (
+            CorsikaRun.select(CorsikaRun.id, CorsikaRun.result_file)
+            .where(CorsikaRun.id.in_(job_ids))
+            .tuples()
+        ):
+            (
+                OutputFile.update(path=result_file)
+                .where(OutputFile.corsika_run == job_id)
+                .where(OutputFile.kind == 'corsika')
+                .execute()
+            )
+        (
+            CorsikaRun.update(cleaned_at=None, archive_file=None)
+            .where(CorsikaRun.id.in_(job_ids))
+            .execute()
+        )
+
+
+@database.connection_context()
+def rerun_inputs(job_ids):
+    '''
+    Reset the successful CORSIKA runs with deleted result files to created,
+    so they are simulated again before their pending CERES runs.
+    Returns the number of reset runs.
+    '''
+    success = Status.select(Status.id).where(Status.name == 'success')
+    return change_job_status(
+        CorsikaRun,
+        CorsikaRun.id.in_(job_ids) & (CorsikaRun.status == success),
+        'created',
+        cleaned_at=None,
+        result_file=None,
+        location=None,
+        queued_at=None,
+        started_at=None,
+    )
+
+
+@database.connection_context()
+def get_staging_hit_rate(location=None):
+    '''
+    Fraction of successful CERES runs that found their input file
+    in the node-local staging cache, None if no run used the cache.
+    '''
+    query = (
+        CeresRun
+        .select(fn.COUNT(CeresRun.id), fn.SUM(CeresRun.staging_hit))
+        .where(CeresRun.staging_hit.is_null(False))
+    )
+    if location is not None:
+        query = query.where(CeresRun.location == location)
+
+    n_runs, n_hits = query.tuples().get()
+    if n_runs == 0:
+        return None
+    return n_hits / n_runs
+
+
+@database.connection_context()
+def get_pending_jobs(max_jobs, location, policy=None):
+    '''
+    Get at most `max_jobs` runs ready for submission,
+    ordered by the `score` assigned by the scheduling `policy`,
+    default is to order by priority.
+    Returns `CorsikaJobSpec`s and `CeresJobSpec`s, not model instances.
+    '''
+    # local imports, scheduling and jobs depend on this module
+    from .scheduling import PriorityPolicy
+    from .jobs import (
+        CorsikaJobSpec, CeresJobSpec, CeresInputSpec, corsika_specs, ceres_specs,
+    )
+    policy = policy or PriorityPolicy()
+
     # subqueries for process state
     created = Status.select().where(Status.name == 'created')
     success = Status.select().where(Status.name == 'success')
+    now = datetime.utcnow()
 
     # first get all pending corsika jobs
-    jobs = list(
+    corsika_query = (
         CorsikaRun
-        .select(
-            CorsikaRun,
-            CorsikaSettings.name,
-            CorsikaSettings.version,
-            CorsikaSettings.id,
-            CorsikaSettings.inputcard_template,
-        )
+        .select(*CorsikaJobSpec.columns())
         .join(CorsikaSettings)
         .where(CorsikaRun.status == created)
-        .order_by(CorsikaRun.priority)
-        .limit(max_jobs)
+        .where(CorsikaRun.not_before.is_null() | (CorsikaRun.not_before <= now))
     )
+    corsika_query = policy.order_corsika(corsika_query).limit(max_jobs)
+    corsika_jobs = corsika_specs(corsika_query.tuples())
 
     # then get all ceres jobs, where the corsika run was already successfull
-    jobs.extend(list(
+    ceres_query = (
         CeresRun
-        .select(
-            CeresRun,
-            CeresSettings.id, CeresSettings.name, CeresSettings.revision,
-            CorsikaRun.id, CorsikaRun.result_file,
-            CorsikaRun.zenith_min, CorsikaRun.zenith_max,
-            CorsikaRun.azimuth_min, CorsikaRun.azimuth_max,
-            CorsikaRun.primary_particle, CorsikaRun.viewcone,
-            CorsikaSettings.name, CorsikaSettings.version,
-        )
+        .select(*CeresJobSpec.columns(), *CeresInputSpec.columns())
         .join(CeresSettings)
         .switch(CeresRun)
         .join(CorsikaRun)
         .join(CorsikaSettings)
         .where(CorsikaRun.status == success)
         .where(CorsikaRun.location == location)
+        # inputs removed by the retention policy are regenerated first
+        .where(CorsikaRun.cleaned_at.is_null())
         .where(CeresRun.status == created)
-        .order_by(CeresRun.priority)
-        .limit(max_jobs)
-    ))
+        .where(CeresRun.not_before.is_null() | (CeresRun.not_before <= now))
+    )
+    ceres_query = policy.order_ceres(ceres_query).limit(max_jobs)
+    ceres_jobs = ceres_specs(ceres_query.tuples())
 
-    # sort jobs by priority
-    jobs.sort(key=lambda j: j.priority)
+    # both lists are already ordered by score, merge them
+    jobs = heapq.merge(corsika_jobs, ceres_jobs, key=attrgetter('score'))
     # return at most max_jobs jobs
-    return jobs[:max_jobs]
+    return list(islice(jobs, max_jobs))
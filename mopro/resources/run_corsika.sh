@@ -1,5 +1,10 @@
 #!/bin/bash
 
+# job environment written by the submitter in the "job" export mode of slurm
+if [ -n "$MOPRO_ENV_FILE" ]; then
+    source "$MOPRO_ENV_FILE"
+fi
+
 echo "python executable"
 which python
 
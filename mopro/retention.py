@@ -0,0 +1,156 @@
+'''
+Retention policy for the CORSIKA result files.
+
+The compressed CORSIKA files are only intermediates for the CERES runs,
+but make up most of the storage. Once all CERES runs of a CORSIKA run
+succeeded, including one for each of the configured CERES settings,
+its result file is deleted or moved to an archive directory in batches.
+
+Removed files are recorded in `CorsikaRun.cleaned_at`, `get_pending_jobs`
+does not submit CERES runs for these inputs. If new CERES runs are added
+for them, archived files are moved back and deleted files are regenerated
+by running CORSIKA again.
+'''
+import os
+import shutil
+import logging
+
+from .queries import (
+    get_ceres_settings_ids,
+    get_finished_inputs,
+    mark_inputs_cleaned,
+    get_cleaned_inputs,
+    restore_inputs,
+    rerun_inputs,
+)
+
+
+log = logging.getLogger(__name__)
+
+RETENTION_ACTIONS = ('delete', 'archive')
+
+
+class RetentionPolicy:
+    '''
+    Parameters
+    ----------
+    ceres_settings: list of str
+        names of the CERES settings, that must have a successful run
+        for a CORSIKA file to be removed
+    action: str
+        "delete" or "archive"
+    archive_directory: str
+        files are moved here for the "archive" action, keeping their path
+        relative to `mopro_directory`
+    mopro_directory: str
+    batch_size: int
+        maximum number of files removed per call of `clean`
+    '''
+
+    def __init__(
+        self,
+        ceres_settings,
+        action='delete',
+        archive_directory=None,
+        mopro_directory=None,
+        batch_size=1000,
+    ):
+        if action not in RETENTION_ACTIONS:
+            raise ValueError(f'Unknown retention action "{action}"')
+        if action == 'archive' and archive_directory is None:
+            raise ValueError('The archive action needs an archive_directory')
+
+        self.ceres_settings = list(ceres_settings)
+        self.action = action
+        self.archive_directory = archive_directory
+        self.mopro_directory = mopro_directory
+        self.batch_size = batch_size
+        # names of `ceres_settings`, set once all of them exist
+        self.required = None
+
+    def resolve_settings(self):
+        '''
+        Check that all `ceres_settings` exist. Returns False and logs
+        the missing names if not all of them exist in the database yet,
+        e.g. because they are configured before being inserted.
+        '''
+        if self.required is not None:
+            return True
+
+        found = get_ceres_settings_ids(self.ceres_settings)
+        missing = set(self.ceres_settings) - {name for name, _ in found}
+        if missing:
+            log.warning(
+                'Retention policy paused, unknown CERES settings: '
+                + ', '.join(sorted(missing))
+            )
+            return False
+
+        # any revision of a settings name counts as a run of it
+        self.required = sorted(self.ceres_settings)
+        return True
+
+    def archive_path(self, result_file):
+        mopro_directory = self.mopro_directory
+        if mopro_directory is not None and result_file.startswith(mopro_directory):
+            relative = os.path.relpath(result_file, self.mopro_directory)
+        else:
+            relative = result_file.lstrip('/')
+        return os.path.join(self.archive_directory, relative)
+
+    def clean(self, location):
+        '''
+        Delete or archive the next batch of CORSIKA files of `location`
+        that are not needed anymore. Returns the number of removed files,
+        nothing is removed while one of `ceres_settings` does not exist.
+        '''
+        if not self.resolve_settings():
+            return 0
+
+        archive_files = {}
+        for job_id, result_file in get_finished_inputs(
+            location, self.required, self.batch_size
+        ):
+            try:
+                if self.action == 'archive':
+                    archive_file = self.archive_path(result_file)
+                    os.makedirs(os.path.dirname(archive_file), exist_ok=True)
+                    shutil.move(result_file, archive_file)
+                else:
+                    archive_file = None
+                    try:
+                        os.remove(result_file)
+                    except FileNotFoundError:
+                        pass
+            except OSError:
+                log.exception(f'Could not {self.action} {result_file}')
+                continue
+            archive_files[job_id] = archive_file
+
+        if archive_files:
+            mark_inputs_cleaned(archive_files)
+        return len(archive_files)
+
+    def regenerate(self, location):
+        '''
+        Make the removed CORSIKA files of `location` available again,
+        that are needed by pending CERES runs.
+        Returns the number of restored files and of CORSIKA runs to run again.
+        '''
+        restored = []
+        rerun = []
+        for job_id, result_file, archive_file in get_cleaned_inputs(location):
+            if archive_file is not None and os.path.isfile(archive_file):
+                try:
+                    os.makedirs(os.path.dirname(result_file), exist_ok=True)
+                    shutil.move(archive_file, result_file)
+                    restored.append(job_id)
+                    continue
+                except OSError:
+                    log.exception(f'Could not restore {archive_file}')
+            rerun.append(job_id)
+
+        if restored:
+            restore_inputs(restored)
+        n_rerun = rerun_inputs(rerun) if rerun else 0
+        return len(restored), n_rerun
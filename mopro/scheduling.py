@@ -0,0 +1,273 @@
+'''
+Scheduling policies deciding the order in which pending runs are submitted.
+
+A policy adds a `score` column to the queries for pending
+CORSIKA and CERES runs and orders by it, lower scores are submitted first.
+Everything is computed by the database, `get_pending_jobs` only merges
+the two already ordered results.
+
+The `FairSharePolicy` ranks the runs of each group with the window function
+`ROW_NUMBER`, which needs MySQL >= 8.0, MariaDB >= 10.2 or SQLite >= 3.25.
+'''
+from abc import ABCMeta, abstractmethod
+from datetime import datetime
+
+from peewee import fn, Case, JOIN, SQL, SqliteDatabase, MySQLDatabase
+
+from .database import (
+    database,
+    Status,
+    CorsikaRun,
+    CorsikaSettings,
+    CeresRun,
+    CeresSettings,
+)
+from .corsika_utils import PARTICLE_IDS
+
+
+# runs taking up a share of the cluster
+active_status_names = ('queued', 'running')
+
+
+def seconds_since(field, now):
+    ''' Expression for the seconds between the datetime `field` and `now` '''
+    if isinstance(database.obj, SqliteDatabase):
+        return (fn.julianday(now) - fn.julianday(field)) * 86400
+    return fn.TIMESTAMPDIFF(SQL('SECOND'), field, now)
+
+
+def supports_window_functions():
+    ''' Whether the database supports the window functions of the `FairSharePolicy` '''
+    db = database.obj
+    if isinstance(db, SqliteDatabase):
+        return db.server_version >= (3, 25, 0)
+
+    if isinstance(db, MySQLDatabase):
+        # the version is known after connecting
+        with database.connection_context():
+            version = db.server_version
+        # MariaDB versions start at 10
+        if version >= (10, ):
+            return version >= (10, 2)
+        return version >= (8, 0)
+
+    return True
+
+
+class SchedulingPolicy(metaclass=ABCMeta):
+
+    @abstractmethod
+    def order_corsika(self, query):
+        '''
+        Add a `score` column to the query for pending `CorsikaRun`s
+        (already joined with `CorsikaSettings`) and order by it
+        '''
+
+    @abstractmethod
+    def order_ceres(self, query):
+        '''
+        Add a `score` column to the query for pending `CeresRun`s
+        (already joined with `CeresSettings`, `CorsikaRun` and `CorsikaSettings`)
+        and order by it
+        '''
+
+
+class PriorityPolicy(SchedulingPolicy):
+    ''' Order only by the `priority` of each run, lowest first '''
+
+    def order_corsika(self, query):
+        score = CorsikaRun.priority
+        return query.select_extend(score.alias('score')).order_by(score, CorsikaRun.id)
+
+    def order_ceres(self, query):
+        score = CeresRun.priority
+        return query.select_extend(score.alias('score')).order_by(score, CeresRun.id)
+
+
+class FairSharePolicy(SchedulingPolicy):
+    '''
+    Weighted fair share across groups of runs,
+    needs a database supporting window functions, see `build_policy`.
+
+    CORSIKA runs are grouped by (CORSIKA settings, primary particle),
+    CERES runs by (CERES settings, primary particle).
+    The score of a pending run is
+
+        priority
+        + (number of active runs in its group + rank in its group) / weight
+        - aging * hours since creation
+        [- ceres_bonus for CERES runs]
+
+    so groups with the same priority are interleaved according to their
+    weights, independent of how many runs they have pending,
+    and runs that wait long move up.
+
+    Parameters
+    ----------
+    weights: dict
+        weight per primary particle name (e.g. {'gamma': 2}), default 1
+    settings_weights: dict
+        weight per CORSIKA or CERES settings name, multiplied with the primary weight
+    aging: float
+        score decrease per hour a run waits since its creation
+    ceres_bonus: float
+        score decrease for all CERES runs, preferring them to reduce the
+        backlog of CORSIKA files on storage
+    clock: callable
+        returns the current time as naive utc datetime, used for the aging.
+        Replaced by the simulation to replay queue states.
+    '''
+
+    def __init__(
+        self,
+        weights=None,
+        settings_weights=None,
+        aging=0.0,
+        ceres_bonus=0.0,
+        clock=datetime.utcnow,
+    ):
+        self.clock = clock
+        self.weights = weights or {}
+        self.settings_weights = settings_weights or {}
+        self.aging = aging
+        self.ceres_bonus = ceres_bonus
+
+        particle_ids = {name: primary_id for primary_id, name in PARTICLE_IDS.items()}
+        for name in self.weights:
+            if name not in particle_ids:
+                raise ValueError(f'Unknown primary particle "{name}"')
+        self.primary_weights = {particle_ids[k]: v for k, v in self.weights.items()}
+
+    def weight(self, primary_particle, settings_name):
+        ''' Expression for the weight of a run '''
+        weight = 1.0
+        if self.primary_weights:
+            weight = Case(
+                primary_particle,
+                [(k, float(v)) for k, v in self.primary_weights.items()],
+                1.0,
+            )
+        if self.settings_weights:
+            weight = weight * Case(
+                settings_name,
+                [(k, float(v)) for k, v in self.settings_weights.items()],
+                1.0,
+            )
+        return weight
+
+    def score(self, query, priority, created_at, rank, n_active, weight, bonus=0.0):
+        score = priority + (fn.COALESCE(n_active, 0) + rank) / weight - bonus
+        if self.aging:
+            age = fn.COALESCE(seconds_since(created_at, self.clock()), 0)
+            score = score - self.aging * age / 3600
+        return query.select_extend(score.alias('score')).order_by(SQL('score'))
+
+    def order_corsika(self, query):
+        group = [CorsikaRun.corsika_settings, CorsikaRun.primary_particle]
+        rank = fn.ROW_NUMBER().over(
+            partition_by=group, order_by=[CorsikaRun.priority, CorsikaRun.id]
+        ) - 1
+
+        Active = CorsikaRun.alias('active_run')
+        active = (
+            Active
+            .select(
+                Active.corsika_settings,
+                Active.primary_particle,
+                fn.COUNT(Active.id).alias('n_active'),
+            )
+            .where(Active.status.in_(
+                Status.select(Status.id).where(Status.name.in_(active_status_names))
+            ))
+            .group_by(Active.corsika_settings, Active.primary_particle)
+            .alias('active_counts')
+        )
+        query = query.switch(CorsikaRun).join(
+            active,
+            JOIN.LEFT_OUTER,
+            on=(
+                (active.c.corsika_settings_id == CorsikaRun.corsika_settings)
+                & (active.c.primary_particle == CorsikaRun.primary_particle)
+            ),
+            attr='active_counts',
+        )
+
+        return self.score(
+            query,
+            priority=CorsikaRun.priority,
+            created_at=CorsikaRun.created_at,
+            rank=rank,
+            n_active=active.c.n_active,
+            weight=self.weight(CorsikaRun.primary_particle, CorsikaSettings.name),
+        )
+
+    def order_ceres(self, query):
+        group = [CeresRun.ceres_settings, CorsikaRun.primary_particle]
+        rank = fn.ROW_NUMBER().over(
+            partition_by=group, order_by=[CeresRun.priority, CeresRun.id]
+        ) - 1
+
+        Active = CeresRun.alias('active_run')
+        ActiveCorsika = CorsikaRun.alias('active_corsika_run')
+        active = (
+            Active
+            .select(
+                Active.ceres_settings,
+                ActiveCorsika.primary_particle,
+                fn.COUNT(Active.id).alias('n_active'),
+            )
+            .join(ActiveCorsika, on=(Active.corsika_run == ActiveCorsika.id))
+            .where(Active.status.in_(
+                Status.select(Status.id).where(Status.name.in_(active_status_names))
+            ))
+            .group_by(Active.ceres_settings, ActiveCorsika.primary_particle)
+            .alias('active_counts')
+        )
+        query = query.switch(CeresRun).join(
+            active,
+            JOIN.LEFT_OUTER,
+            on=(
+                (active.c.ceres_settings_id == CeresRun.ceres_settings)
+                & (active.c.primary_particle == CorsikaRun.primary_particle)
+            ),
+            attr='active_counts',
+        )
+
+        return self.score(
+            query,
+            priority=CeresRun.priority,
+            created_at=CeresRun.created_at,
+            rank=rank,
+            n_active=active.c.n_active,
+            weight=self.weight(CorsikaRun.primary_particle, CeresSettings.name),
+            bonus=self.ceres_bonus,
+        )
+
+
+policies = {
+    'priority': PriorityPolicy,
+    'fair_share': FairSharePolicy,
+}
+
+
+def build_policy(scheduling_config):
+    ''' Create the policy from a `SchedulingConfig` '''
+    name = scheduling_config.policy
+    if name not in policies:
+        raise ValueError(f'Unknown scheduling policy "{name}"')
+
+    if name == 'priority':
+        return PriorityPolicy()
+
+    if not supports_window_functions():
+        raise ValueError(
+            'The fair_share scheduling policy needs window functions,'
+            ' supported by MySQL >= 8.0, MariaDB >= 10.2 and SQLite >= 3.25'
+        )
+
+    return FairSharePolicy(
+        weights=scheduling_config.weights,
+        settings_weights=scheduling_config.settings_weights,
+        aging=scheduling_config.aging,
+        ceres_bonus=scheduling_config.ceres_bonus,
+    )
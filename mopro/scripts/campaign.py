@@ -0,0 +1,142 @@
+'''
+Create campaigns, assign runs to them and report their progress, e.g.
+
+    python -m mopro.scripts.campaign create gamma_diffuse --target-events 1e9
+    python -m mopro.scripts.campaign assign gamma_diffuse --program corsika \
+        --corsika-settings epos_urqmd_iact --primary gamma
+    python -m mopro.scripts.campaign report gamma_diffuse --window 24
+'''
+from datetime import timedelta
+
+import click
+
+from ..config import config
+from ..corsika_utils import PARTICLE_IDS
+from ..database import (
+    initialize_database,
+    CorsikaRun,
+    CorsikaSettings,
+    CeresRun,
+    CeresSettings,
+)
+from ..campaigns import create_campaign, assign_runs, get_campaign_progress
+from ..queries import programs
+
+
+def format_eta(eta):
+    if eta is None:
+        return 'unknown'
+    return '{:.1f} days'.format(eta.total_seconds() / 86400)
+
+
+@click.group()
+@click.option(
+    '--config-file', '-c',
+    type=click.Path(dir_okay=False, exists=True),
+    help='Config file, if not given, $HOME/mopro.yaml and ./mopro.yaml will be tried'
+)
+def main(config_file):
+    if config_file is not None:
+        config.load_yaml(config_file)
+    initialize_database()
+
+
+@main.command()
+@click.argument('name')
+@click.option('--target-events', type=float, help='Number of simulated showers to reach')
+@click.option('--description')
+def create(name, target_events, description):
+    if target_events is not None:
+        target_events = int(target_events)
+    create_campaign(name, target_events=target_events, description=description)
+
+
+@main.command()
+@click.argument('name')
+@click.option('--program', type=click.Choice(list(programs)), required=True)
+@click.option('--corsika-settings', help='Name of the CORSIKA settings')
+@click.option('--ceres-settings', help='Name of the CERES settings, only for CERES runs')
+@click.option('--primary', help='Name of the primary particle, e.g. gamma')
+@click.option('--min-id', type=int, help='Smallest run id')
+@click.option('--max-id', type=int, help='Largest run id')
+@click.option(
+    '--reassign', is_flag=True, help='Also move runs already in another campaign',
+)
+def assign(
+    name, program, corsika_settings, ceres_settings, primary, min_id, max_id, reassign,
+):
+    ''' Add all runs matching the options to the campaign NAME '''
+    model = programs[program]
+    conditions = []
+    if not reassign:
+        conditions.append(model.campaign.is_null())
+    if min_id is not None:
+        conditions.append(model.id >= min_id)
+    if max_id is not None:
+        conditions.append(model.id <= max_id)
+
+    # CERES runs are filtered by the properties of their CORSIKA run
+    runs = CorsikaRun.select(CorsikaRun.id)
+    if corsika_settings is not None:
+        runs = runs.where(CorsikaRun.corsika_settings.in_(
+            CorsikaSettings.select(CorsikaSettings.id)
+            .where(CorsikaSettings.name == corsika_settings)
+        ))
+    if primary is not None:
+        particle_ids = {name: primary_id for primary_id, name in PARTICLE_IDS.items()}
+        if primary not in particle_ids:
+            raise click.BadParameter(f'Unknown primary particle "{primary}"')
+        runs = runs.where(CorsikaRun.primary_particle == particle_ids[primary])
+
+    if model is CorsikaRun:
+        if ceres_settings is not None:
+            raise click.UsageError('--ceres-settings is only valid for CERES runs')
+        if corsika_settings is not None or primary is not None:
+            conditions.append(CorsikaRun.id.in_(runs))
+    else:
+        if corsika_settings is not None or primary is not None:
+            conditions.append(CeresRun.corsika_run.in_(runs))
+        if ceres_settings is not None:
+            conditions.append(CeresRun.ceres_settings.in_(
+                CeresSettings.select(CeresSettings.id)
+                .where(CeresSettings.name == ceres_settings)
+            ))
+
+    n_runs = assign_runs(name, model, *conditions)
+    click.echo(f'Added {n_runs} {program} runs to {name}')
+
+
+@main.command()
+@click.argument('name')
+@click.option(
+    '--window', default=24.0, show_default=True,
+    help='Hours over which the throughput is measured',
+)
+def report(name, window):
+    progress = get_campaign_progress(name, window=timedelta(hours=window))
+
+    click.echo(f'Campaign {progress.name}')
+    for program, p in progress.programs.items():
+        if p.n_runs == 0:
+            continue
+        n_success = p.status_counts.get('success', 0)
+        click.echo(
+            f'{program:<8} {n_success} of {p.n_runs} runs done'
+            f' ({n_success / p.n_runs:.1%}),'
+            f' {p.runs_per_hour:.1f} runs / h, ETA {format_eta(p.eta)}'
+        )
+        click.echo('         ' + ', '.join(
+            f'{status}: {n_runs}' for status, n_runs in sorted(p.status_counts.items())
+        ))
+
+    corsika = progress.programs['corsika']
+    if progress.target_events is not None:
+        click.echo(
+            f'events   {corsika.n_events:.3g} of {progress.target_events:.3g}'
+            f' ({corsika.n_events / progress.target_events:.1%}),'
+            f' {corsika.events_per_hour:.3g} / h, ETA {format_eta(progress.events_eta)}'
+        )
+
+
+if __name__ == '__main__':
+    main()
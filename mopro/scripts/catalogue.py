@@ -0,0 +1,145 @@
+'''
+Export lists of result files from the output file catalogue, e.g.
+all diffuse gamma events files of the CERES settings settings_12:
+
+    python -m mopro.scripts.catalogue --ceres-settings settings_12 \
+        --primary gamma --mode diffuse_6d > gammas.txt
+
+`--format sha256sum` writes the checksums in the format of
+`sha256sum --check`, `--format csv` also includes size and number of events.
+'''
+import csv
+import sys
+
+import click
+
+from ..config import config
+from ..corsika_utils import PARTICLE_IDS
+from ..database import (
+    initialize_database,
+    database,
+    OutputFile,
+    CorsikaSettings,
+    CeresSettings,
+    ZENITH_BIN_WIDTH,
+)
+
+
+KINDS = ('corsika', 'ceres_events', 'ceres_runheader')
+FORMATS = ('paths', 'sha256sum', 'csv')
+
+
+@database.connection_context()
+def get_output_files(
+    kind,
+    corsika_settings=None,
+    ceres_settings=None,
+    primary=None,
+    mode=None,
+    zenith_min=None,
+    zenith_max=None,
+):
+    '''
+    Path, size, checksum and number of events of the catalogued files
+    of `kind` matching all given filters, ordered by path.
+    Settings are given by name, the primary by particle name, the zenith range
+    in degree selects all files with their zenith bin overlapping the range.
+    '''
+    query = (
+        OutputFile
+        .select(OutputFile.path, OutputFile.size, OutputFile.sha256, OutputFile.n_events)
+        .where(OutputFile.kind == kind)
+    )
+
+    if ceres_settings is not None:
+        query = query.where(OutputFile.ceres_settings.in_(
+            CeresSettings.select(CeresSettings.id)
+            .where(CeresSettings.name == ceres_settings)
+        ))
+    if corsika_settings is not None:
+        query = query.where(OutputFile.corsika_settings.in_(
+            CorsikaSettings.select(CorsikaSettings.id)
+            .where(CorsikaSettings.name == corsika_settings)
+        ))
+    if primary is not None:
+        particle_ids = {name: primary_id for primary_id, name in PARTICLE_IDS.items()}
+        if primary not in particle_ids:
+            raise ValueError(f'Unknown primary particle "{primary}"')
+        query = query.where(OutputFile.primary_particle == particle_ids[primary])
+    if mode is not None:
+        query = query.where(OutputFile.mode == mode)
+    if zenith_min is not None:
+        query = query.where(OutputFile.zenith_bin >= int(zenith_min // ZENITH_BIN_WIDTH))
+    if zenith_max is not None:
+        query = query.where(OutputFile.zenith_bin <= int(zenith_max // ZENITH_BIN_WIDTH))
+
+    return list(query.order_by(OutputFile.path).tuples())
+
+
+def write_output_files(rows, output, output_format):
+    if output_format == 'csv':
+        writer = csv.writer(output)
+        writer.writerow(['path', 'size', 'sha256', 'n_events'])
+        writer.writerows(rows)
+    elif output_format == 'sha256sum':
+        output.writelines(f'{sha256}  {path}\n' for path, _, sha256, _ in rows)
+    else:
+        output.writelines(f'{path}\n' for path, *_ in rows)
+
+
+@click.command()
+@click.option(
+    '--config-file', '-c',
+    type=click.Path(dir_okay=False, exists=True),
+    help='Config file, if not given, $HOME/mopro.yaml and ./mopro.yaml will be tried'
+)
+@click.option(
+    '--kind', type=click.Choice(KINDS), default='ceres_events', show_default=True,
+)
+@click.option('--corsika-settings', help='Name of the CORSIKA settings')
+@click.option('--ceres-settings', help='Name of the CERES settings')
+@click.option('--primary', help='Name of the primary particle, e.g. gamma')
+@click.option('--mode', help='CERES mode, e.g. diffuse_6d, wobble_0.6d or on')
+@click.option('--zenith-min', type=float, help='Minimum zenith in degree')
+@click.option('--zenith-max', type=float, help='Maximum zenith in degree')
+@click.option(
+    '--format', 'output_format', type=click.Choice(FORMATS), default='paths',
+)
+@click.option(
+    '--output', '-o', type=click.File('w'), default='-', help='Default is stdout',
+)
+def main(
+    config_file,
+    kind,
+    corsika_settings,
+    ceres_settings,
+    primary,
+    mode,
+    zenith_min,
+    zenith_max,
+    output_format,
+    output,
+):
+    if config_file is not None:
+        config.load_yaml(config_file)
+
+    initialize_database()
+    try:
+        rows = get_output_files(
+            kind,
+            corsika_settings=corsika_settings,
+            ceres_settings=ceres_settings,
+            primary=primary,
+            mode=mode,
+            zenith_min=zenith_min,
+            zenith_max=zenith_max,
+        )
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+    write_output_files(rows, output, output_format)
+    print(f'Exported {len(rows)} files', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+'''
+Run the fake Slurm daemon of `mopro.fake_slurm`, e.g.
+
+    python -m mopro.scripts.fake_slurm start /tmp/slurm \
+        --partition short=60:100 --partition long=2880:500 --latency 0.05
+    export PATH=/tmp/slurm/bin:$PATH
+
+and simulate a slow slurmctld while it is running:
+
+    python -m mopro.scripts.fake_slurm control /tmp/slurm latency 2
+    python -m mopro.scripts.fake_slurm control /tmp/slurm stats
+'''
+import os
+import signal
+import sys
+import threading
+
+import click
+
+from ..fake_slurm import FakeSlurm, FakeSlurmDaemon, request
+
+
+def parse_partition(ctx, param, values):
+    partitions = {}
+    for value in values:
+        try:
+            name, limits = value.split('=')
+            max_walltime, slots = limits.split(':')
+            partitions[name] = (int(max_walltime), int(slots))
+        except ValueError:
+            raise click.BadParameter(f'Expected NAME=MAX_WALLTIME:SLOTS, got "{value}"')
+    return partitions
+
+
+@click.group()
+def main():
+    pass
+
+
+@main.command()
+@click.argument('directory', type=click.Path(file_okay=False))
+@click.option(
+    '--partition', '-p', 'partitions', multiple=True, callback=parse_partition,
+    default=['short=60:100', 'long=2880:100'], show_default=True,
+    help='Partition as NAME=MAX_WALLTIME:SLOTS, walltime in minutes, can be repeated',
+)
+@click.option('--latency', default=0.0, show_default=True, help='Seconds per command')
+@click.option(
+    '--duration', default=60.0, show_default=True, help='Seconds each job runs',
+)
+def start(directory, partitions, latency, duration):
+    ''' Serve a fake Slurm in DIRECTORY until interrupted '''
+    os.makedirs(directory, exist_ok=True)
+    daemon = FakeSlurmDaemon(
+        os.path.abspath(directory),
+        FakeSlurm(partitions, latency=latency, job_duration=duration),
+    )
+    daemon.start()
+    click.echo(f'export PATH={daemon.bin_directory}:$PATH')
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    try:
+        stop.wait()
+    except KeyboardInterrupt:
+        pass
+    daemon.stop()
+
+
+@main.command()
+@click.argument('directory', type=click.Path(file_okay=False, exists=True))
+@click.argument('args', nargs=-1, required=True)
+def control(directory, args):
+    '''
+    Change the daemon in DIRECTORY, ARGS are "latency SECONDS",
+    "duration SECONDS" or "stats"
+    '''
+    returncode, stdout, stderr = request(
+        os.path.join(directory, 'slurm.sock'), 'control', args,
+    )
+    click.echo(stdout, nl=False)
+    click.echo(stderr, nl=False, err=True)
+    sys.exit(returncode)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+'''
+Report the resources used by successful runs per settings,
+to choose `corsika.memory`, `ceres.memory` and the tmp size from data.
+'''
+import click
+from peewee import fn
+
+from ..config import config
+from ..database import (
+    initialize_database,
+    database,
+    Status,
+    CorsikaRun,
+    CorsikaSettings,
+    CeresRun,
+    CeresSettings,
+)
+
+
+GB = 1024**3
+
+
+@database.connection_context()
+def get_resource_usage(model, settings_model):
+    ''' Aggregated resource usage of the successful runs of `model` per settings '''
+    success = Status.select(Status.id).where(Status.name == 'success')
+    return list(
+        model
+        .select(
+            settings_model.name,
+            fn.COUNT(model.id),
+            fn.AVG(model.peak_rss),
+            fn.MAX(model.peak_rss),
+            fn.AVG(model.cpu_user + model.cpu_system),
+            fn.SUM(model.bytes_read),
+            fn.SUM(model.bytes_written),
+            fn.MAX(model.tmp_high_water),
+        )
+        .join(settings_model)
+        .where(model.status == success)
+        .where(model.peak_rss.is_null(False))
+        .group_by(settings_model.name)
+        .tuples()
+    )
+
+
+@click.command()
+@click.option(
+    '--config-file', '-c',
+    type=click.Path(dir_okay=False, exists=True),
+    help='Config file, if not given, $HOME/mopro.yaml and ./mopro.yaml will be tried'
+)
+def main(config_file):
+    if config_file is not None:
+        config.load_yaml(config_file)
+
+    initialize_database()
+
+    print('{:<8} {:<30} {:>8} {:>14} {:>13} {:>12} {:>12} {:>12} {:>12}'.format(
+        'program', 'settings', 'runs', 'mean rss / GB', 'max rss / GB',
+        'cpu / h', 'read / GB', 'written / GB', 'max tmp / GB',
+    ))
+    for program, model, settings_model in (
+        ('corsika', CorsikaRun, CorsikaSettings),
+        ('ceres', CeresRun, CeresSettings),
+    ):
+        for row in get_resource_usage(model, settings_model):
+            name, n_runs, mean_rss, max_rss, cpu, read, written, max_tmp = row
+            print(
+                '{:<8} {:<30} {:>8d} {:>14.2f} {:>13.2f}'
+                ' {:>12.2f} {:>12.2f} {:>12.2f} {:>12.2f}'.format(
+                    program, name, n_runs, mean_rss / GB, max_rss / GB,
+                    (cpu or 0) / 3600, (read or 0) / n_runs / GB,
+                    (written or 0) / n_runs / GB, (max_tmp or 0) / GB,
+                )
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+'''
+Replay a queue state against a scheduling policy, without a cluster.
+
+The queue state is a yaml file with a list of groups of pending runs, e.g.
+
+    - program: corsika
+      settings: epos_urqmd_iact
+      primary: proton
+      n_runs: 5000
+      priority: 5
+      age: 24  # hours since creation, optional
+    - program: ceres
+      settings: settings_12
+      primary: gamma
+      n_runs: 100
+
+The simulation uses a temporary sqlite database, each tick the free slots
+are filled using `get_pending_jobs` and runs finish after `duration` ticks.
+It prints for each group the number of started runs and the mean wait in ticks.
+'''
+import os
+import tempfile
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import click
+from ruamel.yaml import YAML
+
+from ..config import config, DatabaseConfig
+from ..corsika_utils import PARTICLE_IDS, primary_id_to_name
+from ..database import (
+    database,
+    initialize_database,
+    setup_database,
+    Status,
+    CorsikaSettings,
+    CorsikaRun,
+    CeresSettings,
+    CeresRun,
+)
+from ..queries import get_pending_jobs, change_job_status, insert_runs, adjust_job_counts
+from ..scheduling import build_policy
+
+
+LOCATION = 'simulation'
+
+
+def fill_database(queue_state, start):
+    ''' Insert the runs described by `queue_state` into the database '''
+    particle_ids = {name: primary_id for primary_id, name in PARTICLE_IDS.items()}
+    created = Status.get(name='created')
+    success = Status.get(name='success')
+
+    for group in queue_state:
+        primary = particle_ids[group['primary']]
+        created_at = start - timedelta(hours=group.get('age', 0))
+        run_kwargs = dict(priority=group.get('priority', 5), created_at=created_at)
+
+        corsika_settings, _ = CorsikaSettings.get_or_create(
+            name=group['settings'] if group['program'] == 'corsika' else 'simulation',
+            defaults=dict(config_h='', inputcard_template=''),
+        )
+        corsika_run = dict(
+            corsika_settings=corsika_settings,
+            primary_particle=primary,
+            zenith_min=0, zenith_max=0,
+            azimuth_min=0, azimuth_max=0,
+            energy_min=1, energy_max=1,
+            spectral_index=-2.7,
+            max_radius=0,
+        )
+
+        if group['program'] == 'corsika':
+            insert_runs(CorsikaRun, [
+                dict(status=created, **corsika_run, **run_kwargs)
+                for _ in range(group['n_runs'])
+            ])
+            continue
+
+        ceres_settings, _ = CeresSettings.get_or_create(
+            name=group['settings'],
+            defaults=dict(
+                revision=0, rc_template='', resource_files=b'',
+                psf_sigma=0, apd_dead_time=0, apd_recovery_time=0,
+                apd_cross_talk=0, apd_afterpulse_probability_1=0,
+                apd_afterpulse_probability_2=0, excess_noise=0,
+                additional_photon_acceptance=0, dark_count_rate=0,
+                pulse_shape_function='', residual_time_spread=0,
+                gapd_time_jitter=0,
+            ),
+        )
+        # the ids of the input runs are needed, so they are created one by one
+        input_runs = [
+            CorsikaRun.create(status=success, location=LOCATION, **corsika_run)
+            for _ in range(group['n_runs'])
+        ]
+        adjust_job_counts(CorsikaRun, {success.id: len(input_runs)})
+        insert_runs(CeresRun, [
+            dict(
+                ceres_settings=ceres_settings,
+                corsika_run=input_run,
+                status=created,
+                **run_kwargs,
+            )
+            for input_run in input_runs
+        ])
+
+
+def group_name(job):
+    if job.model is CorsikaRun:
+        settings = job.corsika_settings.name
+        primary = job.primary_particle
+    else:
+        settings = job.ceres_settings.name
+        primary = job.corsika_run.primary_particle
+    return f'{job.model.__name__} {settings} {primary_id_to_name(primary)}'
+
+
+def simulate(policy, queue_state, n_ticks=100, slots=100, duration=10, tick_minutes=10):
+    '''
+    Replay `queue_state` for `n_ticks` with `slots` concurrent jobs,
+    each job running for `duration` ticks.
+
+    Must be called with an initialized, empty database.
+    Returns a dict mapping group name to the list of ticks the jobs of
+    that group were started in.
+    '''
+    start = datetime.utcnow()
+    now = start
+    if hasattr(policy, 'clock'):
+        policy.clock = lambda: now
+
+    with database.connection_context():
+        fill_database(queue_state, start)
+
+    running = []
+    started = defaultdict(list)
+    for tick in range(n_ticks):
+        now = start + timedelta(minutes=tick * tick_minutes)
+
+        finished = [job for job, end in running if end <= tick]
+        running = [(job, end) for job, end in running if end > tick]
+
+        with database.connection_context():
+            for job in finished:
+                change_job_status(job.model, job.model.id == job.id, 'success')
+
+        free = slots - len(running)
+        if free <= 0:
+            continue
+
+        jobs = get_pending_jobs(free, LOCATION, policy=policy)
+        with database.connection_context():
+            for job in jobs:
+                change_job_status(job.model, job.model.id == job.id, 'running')
+                running.append((job, tick + duration))
+                started[group_name(job)].append(tick)
+
+    return started
+
+
+@click.command()
+@click.argument('queue_state', type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    '--config-file', '-c',
+    type=click.Path(dir_okay=False, exists=True),
+    help='Config file with the scheduling section to use',
+)
+@click.option('--policy', help='Override the policy of the config file')
+@click.option('--ticks', default=100, show_default=True, help='Number of ticks')
+@click.option('--slots', default=100, show_default=True, help='Concurrent jobs')
+@click.option('--duration', default=10, show_default=True, help='Ticks per job')
+@click.option(
+    '--tick-minutes', default=10.0, show_default=True,
+    help='Time between ticks in minutes, used for aging',
+)
+def main(queue_state, config_file, policy, ticks, slots, duration, tick_minutes):
+    if config_file is not None:
+        config.load_yaml(config_file)
+
+    scheduling = config.scheduling
+    if policy is not None:
+        scheduling = scheduling._replace(policy=policy)
+
+    with open(queue_state) as f:
+        queue_state = YAML(typ='safe').load(f)
+
+    with tempfile.TemporaryDirectory(prefix='mopro_simulation_') as tmp_dir:
+        config.database = DatabaseConfig(
+            kind='sqlite', database=os.path.join(tmp_dir, 'simulation.sqlite')
+        )
+        initialize_database()
+        setup_database()
+
+        started = simulate(
+            build_policy(scheduling), queue_state,
+            n_ticks=ticks, slots=slots, duration=duration, tick_minutes=tick_minutes,
+        )
+
+    print(f'Policy: {scheduling.policy}')
+    print(f'{"group":<50} {"started":>8} {"first":>6} {"mean tick":>10}')
+    for name, ticks_started in sorted(started.items()):
+        print('{:<50} {:>8d} {:>6d} {:>10.1f}'.format(
+            name,
+            len(ticks_started),
+            min(ticks_started),
+            sum(ticks_started) / len(ticks_started),
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+'''
+Report queue wait times of CORSIKA runs by requested walltime.
+
+Runs are split by how their walltime was set: the default walltime,
+estimated from past runs or, for retried runs, kept from the first attempt
+or multiplied after exceeding it. They are grouped by the
+slurm partition the walltime maps to.
+The mean queue wait is the time between submission and the start
+of the executor, so the difference between both groups is the
+queue-wait reduction of the walltime estimation.
+'''
+from collections import defaultdict
+
+import click
+from peewee import fn
+
+from ..config import config
+from ..database import initialize_database, database, CorsikaRun
+from ..scheduling import seconds_since
+
+
+def requested_walltime(attempts, walltime_estimated):
+    ''' How the walltime of a run was set '''
+    if attempts > 0:
+        return 'retried'
+    if walltime_estimated:
+        return 'estimated'
+    return 'default'
+
+
+def walltime_to_partition(walltime, partitions):
+    for max_walltime, partition in partitions:
+        if walltime <= max_walltime:
+            return partition
+    return 'none'
+
+
+@database.connection_context()
+def get_queue_waits():
+    '''
+    Number of runs, summed queue wait and duration in seconds
+    per walltime, number of attempts and whether the walltime was estimated
+    '''
+    return list(
+        CorsikaRun
+        .select(
+            CorsikaRun.walltime,
+            CorsikaRun.attempts,
+            CorsikaRun.walltime_estimated,
+            fn.COUNT(CorsikaRun.id),
+            fn.SUM(seconds_since(CorsikaRun.queued_at, CorsikaRun.started_at)),
+            fn.SUM(CorsikaRun.duration),
+        )
+        .where(CorsikaRun.queued_at.is_null(False))
+        .where(CorsikaRun.started_at.is_null(False))
+        .group_by(
+            CorsikaRun.walltime, CorsikaRun.attempts, CorsikaRun.walltime_estimated,
+        )
+        .tuples()
+    )
+
+
+@click.command()
+@click.option(
+    '--config-file', '-c',
+    type=click.Path(dir_okay=False, exists=True),
+    help='Config file, if not given, $HOME/mopro.yaml and ./mopro.yaml will be tried'
+)
+def main(config_file):
+    if config_file is not None:
+        config.load_yaml(config_file)
+
+    initialize_database()
+
+    partitions = sorted((v, k) for k, v in config.slurm.partitions.items())
+
+    # (requested, partition) -> [n_runs, wait, duration, walltime]
+    stats = defaultdict(lambda: [0, 0.0, 0.0, 0.0])
+    for walltime, attempts, estimated, n_runs, wait, duration in get_queue_waits():
+        requested = requested_walltime(attempts, estimated)
+        s = stats[(requested, walltime_to_partition(walltime, partitions))]
+        s[0] += n_runs
+        s[1] += wait or 0
+        s[2] += duration or 0
+        s[3] += walltime * 60 * n_runs
+
+    print('{:<10} {:<10} {:>8} {:>12} {:>14} {:>12}'.format(
+        'requested', 'partition', 'runs', 'wait / min', 'duration / min', 'utilization',
+    ))
+    totals = defaultdict(lambda: [0, 0.0])
+    for key, (n_runs, wait, duration, walltime) in sorted(stats.items()):
+        requested, partition = key
+        totals[requested][0] += n_runs
+        totals[requested][1] += wait
+        print('{:<10} {:<10} {:>8d} {:>12.1f} {:>14.1f} {:>12.1%}'.format(
+            requested, partition, n_runs,
+            wait / n_runs / 60, duration / n_runs / 60, duration / walltime,
+        ))
+
+    if totals['default'][0] > 0 and totals['estimated'][0] > 0:
+        default_wait = totals['default'][1] / totals['default'][0]
+        estimated_wait = totals['estimated'][1] / totals['estimated'][0]
+        print()
+        print('Mean queue wait reduction: {:.1f} min ({:.1%})'.format(
+            (default_wait - estimated_wait) / 60,
+            1 - estimated_wait / default_wait if default_wait > 0 else 0,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,7 @@
 import subprocess as sp
 import os
+import re
+import shlex
 import logging
 import pandas as pd
 from io import StringIO
@@ -7,15 +9,69 @@ from io import StringIO
 from .cluster import Cluster
 
 
+# set by slurm and bash for the job itself
+JOB_VARIABLES = re.compile(r'SLURM_|PWD$|OLDPWD$|SHLVL$|_$|SHELLOPTS$|BASHOPTS$')
+SHELL_NAME = re.compile(r'[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def write_env_file(env, path):
+    '''
+    Write `env` as shell exports to `path`, the job scripts source
+    the file given in $MOPRO_ENV_FILE.
+    Variables set by slurm and bash for the job and names that are
+    no shell variables, e.g. exported bash functions, are skipped.
+    '''
+    with open(path, 'w') as f:
+        for name, value in sorted(env.items()):
+            if SHELL_NAME.match(name) and not JOB_VARIABLES.match(name):
+                f.write(f'export {name}={shlex.quote(value)}\n')
+
+
+def env_file_path(stdout, job_name):
+    ''' The environment file is stored next to the log file of the job '''
+    if stdout is None:
+        raise ValueError(f'Job {job_name} needs a log file for the "job" export mode')
+    path = os.path.splitext(stdout)[0] + '.env'
+    # --export takes a comma separated list
+    if ',' in path:
+        raise ValueError(f'The env file path {path} must not contain commas')
+    return path
+
+
 class SlurmCluster(Cluster):
     log = logging.getLogger(__name__)
 
-    def __init__(self, partitions, mail_address=None, mail_settings=None, memory=None):
+    def __init__(
+        self,
+        partitions,
+        mail_address=None,
+        mail_settings=None,
+        memory=None,
+        export='all',
+    ):
+        '''
+        Parameters
+        ----------
+        export: str
+            "all" to run sbatch with the complete environment passed to `submit_job`,
+            which is exported to the job.
+            "job" to write the environment into a file next to the log file,
+            that the job scripts source, and only export its path to the job.
+            The sbatch calls only carry this one variable, at the cost of
+            one more file written per job.
+        '''
+        if export not in ('all', 'job'):
+            raise ValueError(f'Unknown export mode "{export}"')
+        self.export = export
         self.mail_address = mail_address
         self.mail_settings = mail_settings
         self.partitions = [(v, k) for k, v in partitions.items()]
         self.partitions.sort()
 
+    @property
+    def max_walltime(self):
+        return self.partitions[-1][0] if self.partitions else None
+
     def walltime_to_partition(self, walltime):
         for max_walltime, partition in self.partitions:
             if walltime <= max_walltime:
@@ -60,6 +116,13 @@ class SlurmCluster(Cluster):
         if walltime is not None:
             command.append(f'--time={walltime}')
 
+        if self.export == 'job' and env is not None:
+            env_file = env_file_path(stdout, job_name)
+            write_env_file(env, env_file)
+            # sbatch runs with the submitter environment, none of it is exported
+            env = None
+            command.append(f'--export=MOPRO_ENV_FILE={env_file}')
+
         command.append(executable)
         command.extend(args)
 
@@ -92,6 +155,16 @@ class SlurmCluster(Cluster):
         jobs = self.get_current_jobs(only_mopro=only_mopro)
         return list(jobs.loc[jobs['state'] == 'pending', 'name'])
 
+    def get_jobs(self):
+        '''
+        Get all mopro jobs with a single call to squeue,
+        jobs in states other than pending (e.g. completing) count as running
+        '''
+        jobs = self.get_current_jobs()
+        states = jobs['state'].where(jobs['state'] == 'pending', 'running')
+        states = states.replace('pending', 'queued')
+        return dict(zip(jobs['name'], states))
+
     def get_current_jobs(self, user=None, only_mopro=True):
         ''' Return a dataframe with current jobs of user '''
         user = user or os.environ['USER']
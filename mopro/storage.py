@@ -0,0 +1,205 @@
+'''
+Throttle submissions by the free space on the output and tmp file systems.
+
+When the output file system or the tmp directory fill up, all jobs fail
+while compressing their results. The `StorageThrottle` estimates the output
+and peak tmp size of a run from past successful runs of the same settings,
+using the sizes of the output file catalogue and the tmp high-water mark
+reported by the executors, and only lets through as many pending runs
+as fit into the free space, after reserving space for the already
+queued and running runs and keeping `min_free` bytes free.
+'''
+import os
+import shutil
+import time
+import logging
+
+from peewee import fn
+
+from .config import parse_size
+from .database import (
+    database, Status, CorsikaRun, CeresRun, OutputFile,
+)
+
+
+log = logging.getLogger(__name__)
+
+settings_fields = {
+    CorsikaRun: CorsikaRun.corsika_settings,
+    CeresRun: CeresRun.ceres_settings,
+}
+
+
+def free_space(path):
+    ''' Free bytes for unprivileged users on the file system of `path` '''
+    return shutil.disk_usage(path).free
+
+
+class StorageThrottle:
+    '''
+    Parameters
+    ----------
+    output_directory: str
+        directory the results are written to, usually `mopro_directory`
+    tmp_dir: str
+        tmp directory of the jobs. The space used by all queued and running runs
+        is reserved in it, so only pass it if the jobs share the tmp directory
+        of the submitter host, e.g. for local processing or a shared scratch
+        file system, not for node-local tmp directories on a cluster.
+    min_free: int or str
+        bytes to keep free on the output file system, e.g. "100G"
+    tmp_min_free: int or str
+        bytes to keep free in `tmp_dir`, tmp is not checked if None
+    safety_factor: float
+        factor applied to the estimated size of each run
+    refresh_interval: int
+        seconds after which the size estimates are queried again
+    '''
+
+    def __init__(
+        self,
+        output_directory,
+        tmp_dir=None,
+        min_free=0,
+        tmp_min_free=None,
+        safety_factor=1.2,
+        refresh_interval=600,
+    ):
+        self.output_directory = output_directory
+        self.tmp_dir = tmp_dir
+        self.min_free = parse_size(min_free or 0)
+        self.tmp_min_free = None
+        if tmp_min_free is not None:
+            self.tmp_min_free = parse_size(tmp_min_free)
+        self.safety_factor = safety_factor
+        self.refresh_interval = refresh_interval
+        # (model, settings_id or None) -> (output bytes, tmp bytes)
+        self.sizes = {}
+        self.last_refresh = None
+
+    @database.connection_context()
+    def query_sizes(self):
+        '''
+        Mean output and tmp size of successful runs per settings,
+        the entry with settings None is the mean of all settings
+        '''
+        sizes = {}
+        success = Status.select(Status.id).where(Status.name == 'success')
+
+        for model, settings in settings_fields.items():
+            if model is CeresRun:
+                kinds, run = ('ceres_events', 'ceres_runheader'), OutputFile.ceres_run
+            else:
+                kinds, run = ('corsika', ), OutputFile.corsika_run
+            catalogue_settings = getattr(OutputFile, settings.name)
+
+            # output size per run from the catalogue, CERES runs have two files
+            output = {
+                settings_id: (total, n_runs)
+                for settings_id, total, n_runs in
+                OutputFile
+                .select(
+                    catalogue_settings,
+                    fn.SUM(OutputFile.size),
+                    fn.COUNT(fn.DISTINCT(run)),
+                )
+                .where(OutputFile.kind.in_(kinds))
+                .group_by(catalogue_settings)
+                .tuples()
+            }
+            tmp = {
+                settings_id: (total, n_runs)
+                for settings_id, total, n_runs in
+                model
+                .select(settings, fn.SUM(model.tmp_high_water), fn.COUNT(model.id))
+                .where(model.status == success)
+                .where(model.tmp_high_water.is_null(False))
+                .group_by(settings)
+                .tuples()
+            }
+
+            for means in (output, tmp):
+                total = sum(t for t, _ in means.values())
+                n_runs = sum(n for _, n in means.values())
+                means[None] = (total, n_runs)
+
+            for settings_id in output.keys() | tmp.keys():
+                sizes[(model, settings_id)] = tuple(
+                    total / n_runs if n_runs else 0
+                    for total, n_runs in (
+                        output.get(settings_id, output[None]),
+                        tmp.get(settings_id, tmp[None]),
+                    )
+                )
+        return sizes
+
+    def refresh(self):
+        now = time.monotonic()
+        if self.last_refresh is None or now - self.last_refresh > self.refresh_interval:
+            self.sizes = self.query_sizes()
+            self.last_refresh = now
+
+    def estimate(self, model, settings_id):
+        '''
+        Estimated output and tmp bytes of a run of `model` with `settings_id`,
+        the mean of all settings if there is no successful run of these settings yet
+        '''
+        output_size, tmp_size = self.sizes.get(
+            (model, settings_id), self.sizes.get((model, None), (0, 0))
+        )
+        return output_size * self.safety_factor, tmp_size * self.safety_factor
+
+    @database.connection_context()
+    def in_flight(self, location):
+        ''' Projected output and tmp bytes of the queued and running runs '''
+        active = Status.select(Status.id).where(Status.name.in_(['queued', 'running']))
+        output_size, tmp_size = 0, 0
+        for model, settings in settings_fields.items():
+            counts = (
+                model
+                .select(settings, fn.COUNT(model.id))
+                .where(model.status.in_(active))
+                .where(model.location == location)
+                .group_by(settings)
+                .tuples()
+            )
+            for settings_id, n_runs in counts:
+                run_output, run_tmp = self.estimate(model, settings_id)
+                output_size += n_runs * run_output
+                tmp_size += n_runs * run_tmp
+        return output_size, tmp_size
+
+    def budget(self, location):
+        '''
+        Bytes still available for new runs on the output file system and in tmp,
+        None if tmp is not checked
+        '''
+        output_in_flight, tmp_in_flight = self.in_flight(location)
+        output_free = free_space(self.output_directory)
+        output_budget = output_free - self.min_free - output_in_flight
+
+        tmp_budget = None
+        check_tmp = self.tmp_dir is not None and self.tmp_min_free is not None
+        if check_tmp and os.path.isdir(self.tmp_dir):
+            tmp_budget = free_space(self.tmp_dir) - self.tmp_min_free - tmp_in_flight
+        return output_budget, tmp_budget
+
+    def limit(self, jobs, location):
+        ''' The longest prefix of `jobs` fitting into the free space '''
+        self.refresh()
+        output_budget, tmp_budget = self.budget(location)
+
+        for i, job in enumerate(jobs):
+            settings_id = getattr(job, settings_fields[job.model].name + '_id')
+            output_size, tmp_size = self.estimate(job.model, settings_id)
+            output_budget -= output_size
+            if tmp_budget is not None:
+                tmp_budget -= tmp_size
+
+            if output_budget < 0 or (tmp_budget is not None and tmp_budget < 0):
+                log.warning(
+                    f'Not enough free space for {len(jobs) - i} of {len(jobs)}'
+                    ' pending runs, pausing their submission'
+                )
+                return jobs[:i]
+        return jobs
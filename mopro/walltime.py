@@ -0,0 +1,150 @@
+'''
+Estimate the walltime of CORSIKA runs from the durations of past runs.
+
+For each `CorsikaSettings`, a linear model of the logarithm of the duration
+is fitted to the successful runs, using the parameters that determine
+the amount of simulated showers and particles.
+The requested walltime is an upper quantile of the prediction,
+multiplied by a safety factor plus a fixed margin.
+'''
+import math
+import time
+import logging
+
+import numpy as np
+
+from .database import database, CorsikaRun, Status
+
+
+log = logging.getLogger(__name__)
+
+# number of standard deviations of the log residuals added to the prediction
+N_SIGMA = 2
+
+
+def corsika_features(run):
+    ''' Feature vector of a CORSIKA run for the walltime model '''
+    zenith = math.radians(0.5 * (run.zenith_min + run.zenith_max))
+    return [
+        1.0,
+        math.log(run.n_showers),
+        math.log(run.reuse),
+        math.log(max(run.energy_min, 1e-3)),
+        math.log(max(run.energy_max, 1e-3)),
+        run.spectral_index,
+        1 / max(math.cos(zenith), 0.1),
+        run.viewcone,
+    ]
+
+
+class WalltimeModel:
+    def __init__(self, coefficients, sigma, n_runs):
+        self.coefficients = coefficients
+        self.sigma = sigma
+        self.n_runs = n_runs
+
+    def predict(self, run):
+        ''' Upper estimate of the duration of `run` in seconds '''
+        log_duration = np.dot(self.coefficients, corsika_features(run))
+        return math.exp(log_duration + N_SIGMA * self.sigma)
+
+
+class WalltimeEstimator:
+    '''
+    Parameters
+    ----------
+    safety_factor: float
+        factor applied to the predicted duration
+    margin: int
+        minutes added to the predicted duration
+    min_runs: int
+        minimum number of successful runs of a settings needed for a fit
+    max_runs: int
+        maximum number of most recent successful runs used for a fit
+    refit_interval: int
+        seconds after which the models are fitted again
+    min_walltime: int
+        lower limit for the estimated walltime in minutes
+    '''
+
+    def __init__(
+        self,
+        safety_factor=1.5,
+        margin=30,
+        min_runs=20,
+        max_runs=5000,
+        refit_interval=3600,
+        min_walltime=30,
+    ):
+        self.safety_factor = safety_factor
+        self.margin = margin
+        self.min_runs = min_runs
+        self.max_runs = max_runs
+        self.refit_interval = refit_interval
+        self.min_walltime = min_walltime
+        self.models = {}
+
+    @database.connection_context()
+    def fit(self, corsika_settings_id):
+        '''
+        Fit the model for `corsika_settings_id` to its successful runs,
+        returns None if there are not enough runs
+        '''
+        success = Status.select(Status.id).where(Status.name == 'success')
+        runs = list(
+            CorsikaRun
+            .select(
+                CorsikaRun.n_showers, CorsikaRun.reuse,
+                CorsikaRun.energy_min, CorsikaRun.energy_max,
+                CorsikaRun.spectral_index,
+                CorsikaRun.zenith_min, CorsikaRun.zenith_max,
+                CorsikaRun.viewcone,
+                CorsikaRun.duration,
+            )
+            .where(CorsikaRun.corsika_settings == corsika_settings_id)
+            .where(CorsikaRun.status == success)
+            .where(CorsikaRun.duration > 0)
+            .order_by(CorsikaRun.id.desc())
+            .limit(self.max_runs)
+        )
+        if len(runs) < self.min_runs:
+            return None
+
+        X = np.array([corsika_features(run) for run in runs])
+        y = np.log([run.duration for run in runs])
+        coefficients, *_ = np.linalg.lstsq(X, y, rcond=None)
+        sigma = float(np.std(y - X @ coefficients))
+
+        log.info(
+            f'Fitted walltime model for CORSIKA settings {corsika_settings_id}'
+            f' on {len(runs)} runs, log residual std {sigma:.2f}'
+        )
+        return WalltimeModel(coefficients, sigma, len(runs))
+
+    def get_model(self, corsika_settings_id):
+        model, fit_time = self.models.get(corsika_settings_id, (None, None))
+        now = time.monotonic()
+        if fit_time is None or now - fit_time > self.refit_interval:
+            model = self.fit(corsika_settings_id)
+            self.models[corsika_settings_id] = (model, now)
+        return model
+
+    def estimate(self, run, max_walltime=None):
+        '''
+        Estimated walltime of the CORSIKA `run` in minutes.
+        Returns None for retried runs and if no model is available,
+        these keep their walltime.
+        '''
+        # runs that were retried, e.g. after exceeding the walltime, keep theirs
+        if run.attempts > 0:
+            return None
+
+        model = self.get_model(run.corsika_settings_id)
+        if model is None:
+            return None
+
+        walltime = model.predict(run) * self.safety_factor / 60 + self.margin
+        walltime = max(int(math.ceil(walltime)), self.min_walltime)
+        if max_walltime is not None:
+            walltime = min(walltime, max_walltime)
+        return walltime
@@ -14,6 +14,7 @@ from ..database import (
     Status,
     database
 )
+from ..queries import get_job_counts
 
 sortkey = defaultdict(
     int,
@@ -59,19 +60,8 @@ def states():
 
 @app.route('/jobstats')
 def jobstats():
-    jobstats = list(
-        ProcessingState.select(
-            ProcessingState.description,
-            Jar.version,
-            XML.name.alias('xml'),
-            peewee.fn.COUNT(Job.id).alias('n_jobs')
-        )
-        .join(Job)
-        .join(XML)
-        .switch(Job)
-        .join(Jar)
-        .group_by(Jar.version, XML.name, ProcessingState.description)
-        .dicts()
-    )
+    jobstats = [
+        {'program': program, 'status': status, 'n_jobs': n_jobs}
+        for (program, status), n_jobs in get_job_counts().items()
+    ]
     return jsonify({'status': 'success', 'jobstats': jobstats})
-<Paste>
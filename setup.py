@@ -20,6 +20,7 @@ setup(
         'click',
         'peewee~=3.8',
         'pandas',
+        'numpy',
         'retrying',
         'jinja2',
         'pyzmq',
@@ -31,6 +32,7 @@ setup(
             'mopro_install_root = mopro.installation.root:main',
             'mopro_install_mars = mopro.installation.mars:main',
             'mopro_install_corsika = mopro.installation.corsika:main',
+            'mopro_bundle = mopro.installation.bundle:main',
         ],
     },
     package_data={'mopro': ['resources/*']},
@@ -0,0 +1,15 @@
+-- schema of a database created by mopro before the migrations were added
+CREATE TABLE "ceressettings" ("id" INTEGER NOT NULL PRIMARY KEY, "name" VARCHAR(255) NOT NULL, "revision" INTEGER NOT NULL, "rc_template" TEXT NOT NULL, "resource_files" BLOB NOT NULL, "psf_sigma" REAL NOT NULL, "apd_dead_time" REAL NOT NULL, "apd_recovery_time" REAL NOT NULL, "apd_cross_talk" REAL NOT NULL, "apd_afterpulse_probability_1" REAL NOT NULL, "apd_afterpulse_probability_2" REAL NOT NULL, "excess_noise" REAL NOT NULL, "nsb_rate" REAL, "additional_photon_acceptance" REAL NOT NULL, "dark_count_rate" REAL NOT NULL, "pulse_shape_function" TEXT NOT NULL, "residual_time_spread" REAL NOT NULL, "gapd_time_jitter" REAL NOT NULL, "discriminator_threshold" REAL);
+CREATE UNIQUE INDEX "ceressettings_name_revision" ON "ceressettings" ("name", "revision");
+CREATE TABLE "corsikasettings" ("id" INTEGER NOT NULL PRIMARY KEY, "name" VARCHAR(255) NOT NULL, "version" INTEGER NOT NULL, "config_h" TEXT NOT NULL, "inputcard_template" TEXT NOT NULL, "additional_files" BLOB);
+CREATE UNIQUE INDEX "corsikasettings_name_version" ON "corsikasettings" ("name", "version");
+CREATE TABLE "status" ("id" INTEGER NOT NULL PRIMARY KEY, "name" VARCHAR(255) NOT NULL);
+CREATE UNIQUE INDEX "status_name" ON "status" ("name");
+CREATE TABLE "corsikarun" ("id" INTEGER NOT NULL PRIMARY KEY, "corsika_settings_id" INTEGER NOT NULL, "primary_particle" INTEGER NOT NULL, "n_showers" INTEGER NOT NULL, "zenith_min" REAL NOT NULL, "zenith_max" REAL NOT NULL, "azimuth_min" REAL NOT NULL, "azimuth_max" REAL NOT NULL, "energy_min" REAL NOT NULL, "energy_max" REAL NOT NULL, "spectral_index" REAL NOT NULL, "viewcone" REAL NOT NULL, "reuse" INTEGER NOT NULL, "max_radius" REAL NOT NULL, "bunch_size" INTEGER NOT NULL, "priority" INTEGER NOT NULL, "location" TEXT, "duration" INTEGER, "status_id" INTEGER NOT NULL, "walltime" INTEGER NOT NULL, "result_file" TEXT, FOREIGN KEY ("corsika_settings_id") REFERENCES "corsikasettings" ("id"), FOREIGN KEY ("status_id") REFERENCES "status" ("id"), CHECK (n_showers >= 1), CHECK (zenith_min >= 0), CHECK (zenith_max >= zenith_min), CHECK (azimuth_min >= 0), CHECK (azimuth_max >= azimuth_min), CHECK (energy_min >= 0), CHECK (energy_max >= energy_min), CHECK (spectral_index <= 0), CHECK (viewcone >= 0), CHECK (reuse >= 1), CHECK (reuse <= 20), CHECK (max_radius >= 0), CHECK (bunch_size >= 1));
+CREATE INDEX "corsikarun_corsika_settings_id" ON "corsikarun" ("corsika_settings_id");
+CREATE INDEX "corsikarun_status_id" ON "corsikarun" ("status_id");
+CREATE TABLE "ceresrun" ("id" INTEGER NOT NULL PRIMARY KEY, "ceres_settings_id" INTEGER NOT NULL, "corsika_run_id" INTEGER NOT NULL, "off_target_distance" REAL NOT NULL, "diffuse" INTEGER NOT NULL, "location" TEXT, "duration" INTEGER, "status_id" INTEGER NOT NULL, "walltime" INTEGER NOT NULL, "priority" INTEGER NOT NULL, "result_events_file" TEXT, "result_runheader_file" TEXT, FOREIGN KEY ("ceres_settings_id") REFERENCES "ceressettings" ("id"), FOREIGN KEY ("corsika_run_id") REFERENCES "corsikarun" ("id"), FOREIGN KEY ("status_id") REFERENCES "status" ("id"));
+CREATE INDEX "ceresrun_ceres_settings_id" ON "ceresrun" ("ceres_settings_id");
+CREATE INDEX "ceresrun_corsika_run_id" ON "ceresrun" ("corsika_run_id");
+CREATE INDEX "ceresrun_status_id" ON "ceresrun" ("status_id");
+CREATE UNIQUE INDEX "ceresrun_corsika_run_id_ceres_settings_id_off_target_dis_33d8d39" ON "ceresrun" ("corsika_run_id", "ceres_settings_id", "off_target_distance", "diffuse");
@@ -0,0 +1,85 @@
+import pytest
+from mopro.config import config, DatabaseConfig
+
+
+@pytest.fixture
+def sqlite_database(tmp_path):
+    '''
+    A fresh sqlite database in a temporary file with all tables created.
+    A file is needed as the queries open and close their own connections,
+    which would drop an in-memory database.
+    '''
+    from mopro.database import database, initialize_database, setup_database
+
+    old_config = config.database
+    config.database = DatabaseConfig(
+        kind='sqlite', database=str(tmp_path / 'database.sqlite')
+    )
+    initialize_database()
+    setup_database()
+    database.close()
+
+    yield database
+
+    if not database.is_closed():
+        database.close()
+    config.database = old_config
+
+
+def insert_corsika_runs(n_runs, status='created'):
+    ''' Insert `n_runs` CORSIKA runs with the same settings into the database '''
+    from mopro.database import database, CorsikaSettings, CorsikaRun, Status
+    from mopro.queries import insert_runs
+
+    with database.connection_context():
+        settings = CorsikaSettings.create(
+            name='epos_fluka_iact',
+            config_h='',
+            inputcard_template=open('examples/inputcard_template.txt').read(),
+        )
+        status = Status.get(name=status)
+        insert_runs(CorsikaRun, [
+            dict(
+                corsika_settings=settings,
+                primary_particle=1,
+                zenith_min=0, zenith_max=5,
+                azimuth_min=0, azimuth_max=10,
+                energy_min=100, energy_max=200e3,
+                spectral_index=-2.7,
+                max_radius=300,
+                status=status,
+            )
+            for _ in range(n_runs)
+        ])
+
+
+@pytest.fixture
+def add_corsika_runs(sqlite_database):
+    ''' Function inserting CORSIKA runs into the `sqlite_database` '''
+    return insert_corsika_runs
+
+
+class FakeCluster:
+    '''
+    Cluster with fixed jobs, `jobs` maps the job names to their state,
+    e.g. {'mopro_corsika_1': 'running'}
+    '''
+
+    def __init__(self, jobs=None, max_walltime=None):
+        self.jobs = jobs or {}
+        self.max_walltime = max_walltime
+
+    def get_jobs(self):
+        return self.jobs
+
+    def get_running_jobs(self):
+        return [name for name, state in self.jobs.items() if state == 'running']
+
+    def terminate(self):
+        pass
+
+
+@pytest.fixture
+def fake_cluster():
+    ''' A `FakeCluster` without jobs, set `jobs` and `max_walltime` as needed '''
+    return FakeCluster()
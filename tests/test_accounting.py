@@ -0,0 +1,52 @@
+import subprocess as sp
+import sys
+
+import pytest
+
+
+def test_resource_monitor(tmp_path):
+    from mopro.processing.accounting import ResourceMonitor
+
+    monitor = ResourceMonitor(str(tmp_path), interval=0.01).start()
+    monitor.run_process([
+        sys.executable, '-c',
+        'x = bytearray(100 * 1024**2);'
+        f'open("{tmp_path}/out", "wb").write(b"1" * 1024**2)',
+    ])
+    usage = monitor.stop()
+
+    assert usage['peak_rss'] >= 100 * 1024**2
+    assert usage['cpu_user'] + usage['cpu_system'] > 0
+    assert usage['tmp_high_water'] >= 1024**2
+    assert usage['bytes_read'] >= 0
+
+
+def test_peak_rss_per_child(tmp_path):
+    from mopro.processing.accounting import ResourceMonitor
+
+    monitor = ResourceMonitor(str(tmp_path)).start()
+    monitor.run_process([sys.executable, '-c', 'x = bytearray(200 * 1024**2)'])
+    assert monitor.stop()['peak_rss'] >= 200 * 1024**2
+
+    # the peak of the previous child is not included
+    monitor = ResourceMonitor(str(tmp_path)).start()
+    monitor.run_process([sys.executable, '-c', 'pass'])
+    assert monitor.stop()['peak_rss'] < 100 * 1024**2
+
+    # children not waited for by the monitor are not included
+    monitor = ResourceMonitor(str(tmp_path)).start()
+    sp.run([sys.executable, '-c', 'pass'], check=True)
+    assert monitor.stop()['peak_rss'] is None
+
+
+def test_monitor_run_errors(tmp_path):
+    from mopro.processing.accounting import ResourceMonitor
+
+    monitor = ResourceMonitor(str(tmp_path))
+    with pytest.raises(sp.CalledProcessError):
+        monitor.run_process([sys.executable, '-c', 'import sys; sys.exit(3)'])
+
+    with pytest.raises(sp.TimeoutExpired):
+        monitor.run_process(
+            [sys.executable, '-c', 'import time; time.sleep(10)'], timeout=0.2,
+        )
@@ -0,0 +1,75 @@
+import os
+import time
+import threading
+from mopro.config import config
+
+
+config.load_yaml('tests/test_config.yaml')
+
+
+def test_parallel_builds(sqlite_database, tmp_path, monkeypatch):
+    import mopro.processing.corsika
+    import mopro.processing.builds
+    from mopro.database import database, CorsikaSettings
+    from mopro.jobs import CorsikaJobSpec
+    from mopro.processing.builds import CorsikaBuilder
+
+    unpacked = []
+
+    def fake_fetch_all(downloads):
+        return [d['url'] for d in downloads]
+
+    def fake_unpack(archive, path, strip=0):
+        unpacked.append(archive)
+        os.makedirs(path)
+
+    lock = threading.Lock()
+    running = []
+    max_running = []
+
+    def fake_install(path, config_h, version, additional_files, source_dir, **kwargs):
+        assert os.path.isdir(source_dir)
+        with lock:
+            running.append(path)
+            max_running.append(len(running))
+        time.sleep(0.2)
+        with lock:
+            running.remove(path)
+        if 'broken' in config_h:
+            raise OSError('Failed to build CORSIKA')
+        os.makedirs(path)
+
+    monkeypatch.setattr(mopro.processing.builds, 'fetch_all', fake_fetch_all)
+    monkeypatch.setattr(mopro.processing.builds, 'unpack', fake_unpack)
+    monkeypatch.setattr(mopro.processing.corsika, 'install_corsika', fake_install)
+
+    with database.connection_context():
+        settings = [
+            CorsikaSettings.create(
+                name=name, version=77100, config_h=name, inputcard_template=''
+            )
+            for name in ('epos', 'urqmd', 'fluka_variant', 'broken')
+        ]
+    # two runs per settings, each settings is built only once
+    jobs = [
+        CorsikaJobSpec(corsika_settings=s, corsika_settings_id=s.id)
+        for s in settings for _ in range(2)
+    ]
+
+    builder = CorsikaBuilder(str(tmp_path), max_parallel=2)
+    results = builder.build_missing(jobs)
+
+    assert results == {
+        'epos': True, 'urqmd': True, 'fluka_variant': True, 'broken': False,
+    }
+    assert max(max_running) == 2
+    # one source tree for the single CORSIKA version
+    assert len(unpacked) == 1
+
+    with database.connection_context():
+        durations = {s.name: s.build_duration for s in CorsikaSettings.select()}
+    assert durations['epos'] >= 0.2
+    assert durations['broken'] is None
+
+    # installed and failed settings are not built again
+    assert builder.missing_settings(jobs) == []
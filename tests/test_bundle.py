@@ -0,0 +1,53 @@
+import os
+import pytest
+
+
+def make_installation(path):
+    (path / 'bin').mkdir(parents=True)
+    (path / 'bin' / 'root-config').write_text(f'#!/bin/sh\necho {path}/lib\n')
+    (path / 'lib').mkdir()
+    (path / 'lib' / 'libCore.so').write_bytes(b'\x7fELF\0' + str(path).encode())
+    os.chmod(path / 'bin' / 'root-config', 0o755)
+
+
+def test_export_import(tmp_path):
+    from mopro.installation.bundle import export_bundle, import_bundle, bundle_name
+
+    source = tmp_path / 'site_a' / 'root'
+    make_installation(source)
+    bundle = str(tmp_path / bundle_name('root', 'abc' * 10))
+    export_bundle(str(source), bundle, 'root', 'abc' * 10)
+
+    target = tmp_path / 'site_b' / 'root'
+    import_bundle(bundle, str(target), 'root', 'abc' * 10)
+
+    # text files are relocated, binaries untouched
+    root_config = target / 'bin' / 'root-config'
+    assert root_config.read_text() == f'#!/bin/sh\necho {target}/lib\n'
+    assert os.access(root_config, os.X_OK)
+    library = 'lib/libCore.so'
+    assert (target / library).read_bytes() == (source / library).read_bytes()
+    assert not (target / 'mopro_manifest.json').exists()
+
+
+def test_import_wrong_key(tmp_path):
+    from mopro.installation.bundle import export_bundle, import_bundle
+
+    source = tmp_path / 'corsika'
+    make_installation(source)
+    bundle = str(tmp_path / 'corsika.tar.zst')
+    export_bundle(str(source), bundle, 'corsika', 'a' * 64)
+
+    with pytest.raises(ValueError):
+        import_bundle(bundle, str(tmp_path / 'target'), 'corsika', 'b' * 64)
+    assert not (tmp_path / 'target').exists()
+    assert sorted(os.listdir(tmp_path)) == ['corsika', 'corsika.tar.zst']
+
+
+def test_corsika_key():
+    from mopro.database import CorsikaSettings
+    from mopro.installation.bundle import corsika_key
+
+    settings = CorsikaSettings(version=77100, config_h='#define HAVE_FLUKA 1')
+    other = CorsikaSettings(version=77100, config_h='#define HAVE_FLUKA 0')
+    assert corsika_key(settings) != corsika_key(other)
@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta
+from mopro.config import config
+
+
+config.load_yaml('tests/test_config.yaml')
+
+
+def test_campaign_progress(add_corsika_runs):
+    from mopro.database import CorsikaRun
+    from mopro.campaigns import create_campaign, assign_runs, get_campaign_progress
+    from mopro.queries import update_job_status
+
+    add_corsika_runs(10)
+    create_campaign('test', target_events=100000)
+    assert assign_runs('test', CorsikaRun, CorsikaRun.id <= 8) == 8
+    # already assigned runs are kept
+    assert assign_runs('test', CorsikaRun, CorsikaRun.campaign.is_null()) == 2
+
+    now = datetime.utcnow()
+    for job_id in (1, 2):
+        update_job_status(
+            CorsikaRun, job_id, 'success', finished_at=now - timedelta(hours=1),
+        )
+    update_job_status(CorsikaRun, 3, 'success', finished_at=now - timedelta(days=3))
+    update_job_status(CorsikaRun, 4, 'failed', finished_at=now - timedelta(hours=1))
+    update_job_status(CorsikaRun, 5, 'running')
+
+    progress = get_campaign_progress('test', window=timedelta(hours=4), now=now)
+    corsika = progress.programs['corsika']
+    assert corsika.n_runs == 10
+    assert corsika.status_counts == {
+        'success': 3, 'failed': 1, 'running': 1, 'created': 5,
+    }
+    assert corsika.runs_per_hour == 0.5
+    assert corsika.eta == timedelta(hours=14)
+    assert corsika.n_events == 15000
+    assert corsika.events_per_hour == 2500
+    assert progress.events_eta == timedelta(hours=34)
+
+    ceres = progress.programs['ceres']
+    assert ceres.n_runs == 0
+    assert ceres.eta == timedelta(0)
@@ -0,0 +1,79 @@
+import gzip
+import hashlib
+from datetime import datetime
+from mopro.config import config
+
+
+config.load_yaml('tests/test_config.yaml')
+
+
+def fits_header(cards):
+    header = b''.join(f'{card:<80}'.encode() for card in cards + ['END'])
+    return header + b' ' * (-len(header) % 2880)
+
+
+def test_compress_and_count(tmp_path):
+    from mopro.processing.output_files import compress, fits_n_rows
+
+    path = tmp_path / 'events.fits'
+    with open(path, 'wb') as f:
+        f.write(fits_header([
+            'SIMPLE  =                    T', 'BITPIX  =                    8',
+            'NAXIS   =                    2', 'NAXIS1  =                   10',
+            'NAXIS2  =                    3',
+        ]))
+        f.write(b'\0' * 2880)
+        f.write(fits_header([
+            "XTENSION= 'BINTABLE'", 'BITPIX  =                    8',
+            'NAXIS   =                    2', 'NAXIS1  =                    4',
+            'NAXIS2  =                   42 / number of events',
+        ]))
+        f.write(b'\0' * 2880)
+    assert fits_n_rows(path) == 42
+    assert fits_n_rows(tmp_path / 'missing.fits') is None
+
+    output = tmp_path / 'events.fits.gz'
+    size, sha256 = compress(['gzip', '--to-stdout', str(path)], output)
+    content = output.read_bytes()
+    assert size == len(content)
+    assert sha256 == hashlib.sha256(content).hexdigest()
+    assert gzip.decompress(content) == path.read_bytes()
+
+
+def test_catalogue(sqlite_database):
+    from mopro.database import database, CeresRun
+    from mopro.processing.monitor import JobMonitor
+    from mopro.queries import update_job_status
+    from mopro.scripts.catalogue import get_output_files
+    from mopro.scripts.simulate_scheduling import fill_database
+
+    with database.connection_context():
+        fill_database(
+            [dict(program='ceres', settings='settings_12', primary='gamma', n_runs=2)],
+            datetime.utcnow(),
+        )
+
+    monitor = JobMonitor()
+    for job_id in (1, 2):
+        update_job_status(CeresRun, job_id, 'running')
+        output_files = [
+            dict(
+                kind=kind, path=f'/data/ceres_{job_id}_{kind}.fits.gz',
+                size=100 * job_id, sha256=f'{job_id:064d}', n_events=10,
+            )
+            for kind in ('ceres_events', 'ceres_runheader')
+        ]
+        monitor.update_job(dict(
+            program='ceres', job_id=job_id, status='success', output_files=output_files,
+        ))
+
+    rows = get_output_files('ceres_events', ceres_settings='settings_12', primary='gamma')
+    assert rows == [
+        ('/data/ceres_1_ceres_events.fits.gz', 100, f'{1:064d}', 10),
+        ('/data/ceres_2_ceres_events.fits.gz', 200, f'{2:064d}', 10),
+    ]
+    # default runs are diffuse with 6° offset at zenith 0
+    assert len(get_output_files('ceres_events', mode='diffuse_6d', zenith_max=4)) == 2
+    assert get_output_files('ceres_events', primary='proton') == []
+    assert get_output_files('ceres_events', zenith_min=10) == []
+    assert len(get_output_files('ceres_runheader')) == 2
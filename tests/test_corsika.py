@@ -10,6 +10,7 @@ def test_create_run():
         setup_database,
         CorsikaRun,
         CorsikaSettings,
+        Status,
     )
 
     initialize_database()
@@ -37,6 +38,7 @@ def test_create_run():
         r.spectral_index = -2.7
         r.viewcone = 0
         r.reuse = 1
+        r.status = Status.get(name='created')
         r.save()
 
     c.format_input_card(r, 'test.eventio')
@@ -0,0 +1,66 @@
+import io
+import os
+import stat
+import subprocess as sp
+import pytest
+
+LOG = b'''
+ START OF RUN
+ END OF SHOWER NO.      1
+ END OF SHOWER NO.      2
+ Fortran runtime error: End of file
+ ========== END OF RUN ================================================
+'''
+
+
+def test_parser():
+    from mopro.processing.corsika_log import CorsikaLogParser
+
+    parser = CorsikaLogParser()
+    assert parser() is None
+
+    for line in LOG.splitlines(keepends=True):
+        parser.feed(line)
+
+    assert parser.finished
+    assert parser() == 2
+    assert parser.n_errors == 1
+    assert parser.errors == ['Fortran runtime error: End of file']
+
+
+def test_tee():
+    from mopro.processing.corsika_log import CorsikaLogParser, tee
+
+    parser = CorsikaLogParser()
+    output = io.BytesIO()
+    tee(io.BytesIO(LOG), output, parser)
+
+    assert output.getvalue() == LOG
+    assert parser.progress == 2
+
+
+def fake_corsika(path, exit_code=0):
+    with open(path, 'w') as f:
+        f.write(f'#!/bin/sh\ncat\necho " END OF SHOWER NO.      1"\nexit {exit_code}\n')
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+
+
+def test_run_corsika(tmp_path, capsysbinary):
+    from mopro.processing.accounting import ResourceMonitor
+    from mopro.processing.corsika_log import CorsikaLogParser
+    from mopro.processing.run_corsika import run_corsika
+
+    fake_corsika(tmp_path / 'corsika')
+    parser = CorsikaLogParser()
+    monitor = ResourceMonitor(str(tmp_path))
+    run_corsika('corsika', b'RUNNR 1\n', str(tmp_path), 10, parser, monitor)
+
+    assert monitor.peak_rss > 0
+
+    assert parser.progress == 1
+    assert not parser.finished
+    assert capsysbinary.readouterr().out.endswith(b'RUNNR 1\n END OF SHOWER NO.      1\n')
+
+    fake_corsika(tmp_path / 'corsika', exit_code=1)
+    with pytest.raises(sp.CalledProcessError):
+        run_corsika('corsika', b'', str(tmp_path), 10, CorsikaLogParser(), monitor)
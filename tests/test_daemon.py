@@ -0,0 +1,66 @@
+import asyncio
+import time
+from threading import Event
+
+from mopro.config import config
+
+
+config.load_yaml('tests/test_config.yaml')
+
+
+class FakeSubmitter:
+    interval = 60
+
+    def __init__(self):
+        self.event = Event()
+        self.ticks = []
+
+    def startup(self):
+        pass
+
+    def tick(self):
+        self.ticks.append(time.monotonic())
+
+    def terminate(self):
+        self.event.set()
+
+
+def test_daemon(add_corsika_runs, fake_cluster):
+    import zmq
+    import zmq.asyncio
+    from mopro.database import database, CorsikaRun
+    from mopro.queries import update_job_status
+    from mopro.processing.monitor import JobMonitor
+    from mopro.processing.daemon import ProcessingDaemon
+
+    add_corsika_runs(1)
+    update_job_status(CorsikaRun, 1, 'running')
+
+    submitter = FakeSubmitter()
+    daemon = ProcessingDaemon(JobMonitor(port=12798), submitter, fake_cluster)
+
+    async def client():
+        context = zmq.asyncio.Context()
+        socket = context.socket(zmq.REQ)
+        socket.connect('tcp://localhost:12798')
+        while not submitter.ticks:
+            await asyncio.sleep(0.01)
+
+        await socket.send_pyobj({'program': 'corsika', 'job_id': 1, 'status': 'success'})
+        assert await socket.recv_pyobj() is True
+        # the finished job triggers a submission long before the interval
+        while len(submitter.ticks) < 2:
+            await asyncio.sleep(0.01)
+
+        socket.close()
+        context.term()
+        daemon.request_stop()
+
+    async def main():
+        await asyncio.wait_for(asyncio.gather(daemon.run(), client()), 10)
+
+    asyncio.run(main())
+
+    assert submitter.ticks[1] - submitter.ticks[0] < 5
+    with database.connection_context():
+        assert CorsikaRun.get_by_id(1).status.name == 'success'
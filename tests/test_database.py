@@ -23,3 +23,43 @@ def test_setup_twice_database():
     initialize_database()
     setup_database()
     setup_database()
+
+
+def test_migrate_database(sqlite_database):
+    from mopro.database import (
+        database, setup_database, index_columns, MODELS, CorsikaRun, CeresRun,
+    )
+    from playhouse.migrate import make_index_name
+
+    database.drop_tables(MODELS)
+    with open('tests/baseline_schema.sql') as f:
+        for statement in f.read().split(';'):
+            if statement.strip():
+                database.execute_sql(statement)
+    database.execute_sql("INSERT INTO status (id, name) VALUES (1, 'created')")
+    database.execute_sql(
+        "INSERT INTO corsikasettings VALUES (1, 'epos', 76900, '', '', NULL)"
+    )
+    database.execute_sql(
+        'INSERT INTO corsikarun (corsika_settings_id, primary_particle, n_showers,'
+        ' zenith_min, zenith_max, azimuth_min, azimuth_max, energy_min, energy_max,'
+        ' spectral_index, viewcone, reuse, max_radius, bunch_size, priority,'
+        ' status_id, walltime) VALUES (1, 1, 5000, 0, 5, 0, 10, 100, 200e3,'
+        ' -2.7, 0, 1, 300, 1, 5, 1, 2880)'
+    )
+
+    setup_database()
+    setup_database()
+
+    for model in MODELS:
+        table = model._meta.table_name
+        columns = {column.name for column in database.get_columns(table)}
+        assert columns == {field.column_name for field in model._meta.sorted_fields}
+        indexes = {index.name for index in database.get_indexes(table)}
+        for columns, unique in index_columns(model):
+            assert make_index_name(table, columns) in indexes
+
+    run = CorsikaRun.get_by_id(1)
+    assert run.attempts == 0
+    assert run.campaign is None
+    assert CeresRun.select().count() == 0
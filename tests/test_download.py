@@ -0,0 +1,63 @@
+import os
+import hashlib
+import tarfile
+import pytest
+
+
+def make_archive(directory):
+    source = directory / 'source' / 'corsika-77100'
+    source.mkdir(parents=True)
+    (source / 'coconut').write_text('#!/bin/sh\n')
+
+    archive = directory / 'corsika-77100.tar.gz'
+    with tarfile.open(archive, 'w:gz') as tar:
+        tar.add(source, arcname='corsika-77100')
+    return archive
+
+
+def test_fetch_and_unpack(tmp_path):
+    from mopro.installation.download import fetch, unpack
+
+    archive = make_archive(tmp_path)
+    url = archive.as_uri()
+    cache_dir = str(tmp_path / 'cache')
+
+    path = fetch(url, cache_dir=cache_dir)
+    assert open(path, 'rb').read() == archive.read_bytes()
+
+    # second fetch is served from the cache
+    archive.rename(tmp_path / 'moved.tar.gz')
+    assert fetch(url, cache_dir=cache_dir) == path
+
+    unpack(path, str(tmp_path / 'corsika'), strip=1)
+    assert (tmp_path / 'corsika' / 'coconut').is_file()
+
+
+def test_mirror_and_checksum(tmp_path):
+    from mopro.installation.download import fetch
+
+    mirror = tmp_path / 'mirror'
+    mirror.mkdir()
+    archive = make_archive(mirror)
+    sha256 = hashlib.sha256(archive.read_bytes()).hexdigest()
+
+    # the original url is not reachable, the mirror is used
+    url = 'file:///does/not/exist/corsika-77100.tar.gz'
+    path = fetch(
+        url, sha256=sha256, cache_dir=str(tmp_path / 'cache'), mirror=str(mirror),
+    )
+    assert sha256[:16] in os.path.basename(path)
+
+    with pytest.raises(IOError):
+        fetch(url, sha256='0' * 64, cache_dir=str(tmp_path / 'cache'), mirror=str(mirror))
+
+
+def test_failed_unpack_leaves_nothing(tmp_path):
+    from mopro.installation.download import unpack
+
+    broken = tmp_path / 'broken.tar.gz'
+    broken.write_bytes(b'not an archive')
+
+    with pytest.raises(IOError):
+        unpack(str(broken), str(tmp_path / 'target'))
+    assert os.listdir(tmp_path) == ['broken.tar.gz']
@@ -0,0 +1,57 @@
+import os
+import subprocess as sp
+
+
+def start_fake_slurm(tmp_path, monkeypatch, **kwargs):
+    from mopro.fake_slurm import FakeSlurm, FakeSlurmDaemon
+
+    daemon = FakeSlurmDaemon(str(tmp_path), FakeSlurm(**kwargs))
+    daemon.start()
+    monkeypatch.setenv('PATH', daemon.bin_directory + os.pathsep + os.environ['PATH'])
+    return daemon
+
+
+def test_slurm_cluster(tmp_path, monkeypatch):
+    from mopro.slurm import SlurmCluster
+
+    daemon = start_fake_slurm(
+        tmp_path, monkeypatch, partitions={'short': (60, 1), 'long': (2880, 10)},
+    )
+    try:
+        cluster = SlurmCluster(partitions={'short': 60, 'long': 2880})
+        cluster.submit_job('/bin/true', job_name='mopro_corsika_1', walltime=30)
+        cluster.submit_job('/bin/true', job_name='mopro_corsika_2', walltime=30)
+        cluster.submit_job('/bin/true', job_name='mopro_ceres_3_4', walltime=120)
+        cluster.submit_job('/bin/true', job_name='other', walltime=30)
+
+        assert cluster.get_jobs() == {
+            'mopro_corsika_1': 'running',
+            'mopro_corsika_2': 'queued',
+            'mopro_ceres_3_4': 'running',
+        }
+        assert cluster.n_running == 2
+        assert cluster.n_queued == 1
+
+        cluster.cancel_job('mopro_corsika_2')
+        assert cluster.get_queued_jobs() == []
+        assert daemon.slurm.calls['sbatch'] == 4
+    finally:
+        daemon.stop()
+
+
+def test_array_jobs(tmp_path, monkeypatch):
+    daemon = start_fake_slurm(tmp_path, monkeypatch, partitions={'short': (60, 2)})
+    try:
+        output = sp.check_output(['sbatch', '--parsable', '--array=0-9%3', '/bin/true'])
+        assert output == b'1\n'
+
+        output = sp.check_output(['squeue', '-h', '-o', '%i %T'])
+        assert output.decode().splitlines() == [
+            '1_0 RUNNING', '1_1 RUNNING', '1_[2-9] PENDING',
+        ]
+
+        result = sp.run(['sbatch', '-p', 'long', '/bin/true'], stderr=sp.PIPE)
+        assert result.returncode == 1
+        assert b'Invalid partition name' in result.stderr
+    finally:
+        daemon.stop()
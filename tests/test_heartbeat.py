@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta
+from mopro.config import config
+
+
+config.load_yaml('tests/test_config.yaml')
+
+
+def test_lost_jobs(add_corsika_runs, fake_cluster):
+    from mopro.database import database, CorsikaRun
+    from mopro.queries import update_job_status
+    from mopro.processing.monitor import JobMonitor
+    from mopro.processing.submitter import JobSubmitter
+
+    add_corsika_runs(3)
+    long_ago = datetime.utcnow() - timedelta(hours=1)
+    for job_id in (1, 2, 3):
+        update_job_status(
+            CorsikaRun, job_id, 'running', location='test', started_at=long_ago,
+        )
+
+    monitor = JobMonitor(port=12799)
+    monitor.add_heartbeat({'program': 'corsika', 'job_ids': [1], 'progress': 42})
+    monitor.flush_heartbeats()
+
+    with database.connection_context():
+        run = CorsikaRun.get_by_id(1)
+    assert run.progress == 42
+    assert run.last_heartbeat > long_ago
+
+    # job 3 has no heartbeat but is still running on the cluster
+    fake_cluster.jobs = {'mopro_corsika_3': 'running'}
+    submitter = JobSubmitter(
+        interval=1, max_queued_jobs=10, mopro_directory='.',
+        host='localhost', port=1337, cluster=fake_cluster,
+        location='test', heartbeat_interval=60, heartbeat_timeout=600,
+    )
+    submitter.reap_lost_jobs()
+
+    with database.connection_context():
+        status = {r.id: r.status.name for r in CorsikaRun.select()}
+    assert status == {1: 'running', 2: 'failed', 3: 'running'}
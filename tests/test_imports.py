@@ -0,0 +1,53 @@
+import subprocess as sp
+import sys
+import pytest
+
+# modules the executors may import from mopro
+ALLOWED = {
+    'mopro',
+    'mopro.processing',
+    'mopro.processing.accounting',
+    'mopro.processing.corsika_log',
+    'mopro.processing.heartbeat',
+    'mopro.processing.output_files',
+    'mopro.processing.staging',
+}
+
+FORBIDDEN = {
+    'pandas', 'numpy', 'peewee', 'jinja2', 'pymysql', 'ruamel', 'click', 'psutil',
+}
+
+# generous upper limit for the total import time, only catching gross regressions
+MAX_IMPORT_TIME = 1.0
+
+
+def import_times(module):
+    '''
+    Import `module` in a fresh interpreter with `-X importtime`,
+    returns a dict mapping module name to cumulative import time in seconds
+    '''
+    result = sp.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        stderr=sp.PIPE, check=True,
+    )
+    times = {}
+    for line in result.stderr.decode().splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+@pytest.mark.parametrize('executor', ['run_corsika', 'run_ceres'])
+def test_executor_imports(executor):
+    module = f'mopro.processing.{executor}'
+    times = import_times(module)
+
+    top_level = {name.partition('.')[0] for name in times}
+    assert not (top_level & FORBIDDEN)
+
+    mopro_modules = {name for name in times if name.partition('.')[0] == 'mopro'}
+    assert mopro_modules - {module} <= ALLOWED
+
+    assert times[module] < MAX_IMPORT_TIME
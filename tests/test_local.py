@@ -0,0 +1,86 @@
+import time
+import pytest
+
+
+def test_journal(tmp_path):
+    from mopro.local import LocalCluster
+
+    journal = str(tmp_path / 'journal.sqlite')
+    cluster = LocalCluster(1, journal=journal)
+    cluster.submit_job('sleep', '30', job_name='mopro_corsika_1', env={'FOO': 'bar'})
+    cluster.submit_job('sleep', '30', job_name='mopro_corsika_2')
+    cluster.submit_job('sleep', '30', job_name='mopro_corsika_3')
+    cluster.cancel_job('mopro_corsika_3')
+    cluster.start_job(cluster.queue.popleft())
+    pid = cluster.running_jobs['mopro_corsika_1'].pid
+    cluster.terminate()
+
+    try:
+        restarted = LocalCluster(1, journal=journal)
+        assert restarted.get_running_jobs() == ['mopro_corsika_1']
+        assert restarted.get_queued_jobs() == ['mopro_corsika_2']
+        assert restarted.queue[0].args == ['30']
+
+        process = restarted.running_jobs['mopro_corsika_1']
+        assert process.pid == pid
+        assert process.poll() is None
+    finally:
+        restarted.kill_job('mopro_corsika_1')
+
+    for _ in range(50):
+        if process.poll() is not None:
+            break
+        time.sleep(0.1)
+    else:
+        pytest.fail('Adopted process did not terminate')
+    restarted.terminate()
+
+
+def test_journal_finished_job(tmp_path, monkeypatch):
+    from mopro.local import LocalCluster
+    from psutil import NoSuchProcess
+    import mopro.local
+
+    def reaped(pid):
+        raise NoSuchProcess(pid)
+
+    journal = str(tmp_path / 'journal.sqlite')
+    cluster = LocalCluster(1, journal=journal)
+    cluster.submit_job('true', job_name='mopro_corsika_1')
+
+    # the job exited and was reaped before its create time was read
+    monkeypatch.setattr(mopro.local, 'Process', reaped)
+    cluster.start_job(cluster.queue.popleft())
+    cluster.terminate()
+
+    restarted = LocalCluster(1, journal=journal)
+    assert restarted.get_running_jobs() == []
+    assert restarted.get_queued_jobs() == []
+    restarted.terminate()
+
+
+def test_journal_environment(tmp_path, monkeypatch):
+    from mopro.local import LocalCluster
+    import os
+    import stat
+    import sqlite3
+
+    monkeypatch.setenv('MOPRO_DB_PASSWORD', 'secret')
+    monkeypatch.setenv('MOPRO_UNSET', 'unset')
+    env = dict(os.environ, MOPRO_JOB_ID='1')
+    del env['MOPRO_UNSET']
+
+    journal = str(tmp_path / 'journal.sqlite')
+    cluster = LocalCluster(1, journal=journal)
+    cluster.submit_job('true', job_name='mopro_corsika_1', env=env)
+    cluster.terminate()
+
+    assert stat.S_IMODE(os.stat(journal).st_mode) == 0o600
+    connection = sqlite3.connect(journal)
+    job, = connection.execute('SELECT job FROM queue').fetchone()
+    connection.close()
+    assert 'secret' not in job
+
+    restarted = LocalCluster(1, journal=journal)
+    assert restarted.queue[0].env == env
+    restarted.terminate()
@@ -0,0 +1,49 @@
+import os
+from collections import namedtuple
+
+
+Run = namedtuple('Run', ['directory_name'])
+
+
+def test_prepare_directories(tmp_path, monkeypatch):
+    from mopro.processing.preparation import PreparationContext
+
+    # only count the calls for the buckets, not the recursive ones for parents
+    (tmp_path / 'corsika/77100/epos/proton').mkdir(parents=True)
+    (tmp_path / 'logs/corsika/77100/epos/proton').mkdir(parents=True)
+
+    calls = []
+    makedirs = os.makedirs
+
+    def counting_makedirs(path, exist_ok=False):
+        calls.append(path)
+        makedirs(path, exist_ok=exist_ok)
+
+    monkeypatch.setattr(os, 'makedirs', counting_makedirs)
+
+    runs = [Run(f'corsika/77100/epos/proton/{i // 1000:05d}000') for i in range(2500)]
+    context = PreparationContext()
+    context.prepare_directories(runs, str(tmp_path))
+
+    # output and log directory for each of the three buckets
+    assert len(calls) == 6
+    assert os.path.isdir(tmp_path / 'corsika/77100/epos/proton/00002000')
+    assert os.path.isdir(tmp_path / 'logs/corsika/77100/epos/proton/00000000')
+
+    context.makedirs(str(tmp_path / 'corsika/77100/epos/proton/00001000'))
+    assert len(calls) == 6
+
+
+def test_exists(tmp_path):
+    from mopro.processing.preparation import PreparationContext
+
+    context = PreparationContext()
+    path = tmp_path / 'software'
+    assert not context.exists(str(path))
+
+    path.mkdir()
+    assert context.exists(str(path))
+
+    # positive results are remembered
+    path.rmdir()
+    assert context.exists(str(path))
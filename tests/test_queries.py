@@ -0,0 +1,141 @@
+from mopro.config import config
+
+
+config.load_yaml('tests/test_config.yaml')
+
+
+def test_job_counts(add_corsika_runs):
+    from mopro.database import CorsikaRun
+    from mopro.queries import (
+        get_job_counts, reconcile_job_counts, update_job_status
+    )
+
+    add_corsika_runs(5)
+
+    # inserted runs are counted right away
+    assert get_job_counts()[('corsika', 'created')] == 5
+    assert reconcile_job_counts() == 0
+
+    update_job_status(CorsikaRun, 1, 'queued')
+    update_job_status(CorsikaRun, 2, 'queued')
+    update_job_status(CorsikaRun, 2, 'running')
+
+    counts = get_job_counts()
+    assert counts[('corsika', 'created')] == 3
+    assert counts[('corsika', 'queued')] == 1
+    assert counts[('corsika', 'running')] == 1
+    assert counts[('ceres', 'created')] == 0
+    assert reconcile_job_counts() == 0
+
+
+def test_inserted_ceres_job_counts(add_corsika_runs):
+    from datetime import datetime
+    from mopro.database import database
+    from mopro.queries import get_job_counts, reconcile_job_counts
+    from mopro.scripts.simulate_scheduling import fill_database
+
+    add_corsika_runs(2)
+    with database.connection_context():
+        fill_database(
+            [dict(program='ceres', settings='settings_12', primary='gamma', n_runs=3)],
+            datetime.utcnow(),
+        )
+
+    counts = get_job_counts()
+    assert counts[('corsika', 'created')] == 2
+    assert counts[('corsika', 'success')] == 3
+    assert counts[('ceres', 'created')] == 3
+    assert reconcile_job_counts() == 0
+
+
+def test_retry_failed_jobs(add_corsika_runs):
+    from mopro.database import database, CorsikaRun
+    from mopro.queries import (
+        get_pending_jobs, retry_failed_jobs, update_job_status
+    )
+
+    add_corsika_runs(3)
+    update_job_status(CorsikaRun, 1, 'failed')
+    update_job_status(CorsikaRun, 2, 'walltime_exceeded')
+
+    assert retry_failed_jobs(max_retries=1, backoff=600, max_walltime=4000) == 2
+
+    with database.connection_context():
+        runs = {r.id: r for r in CorsikaRun.select()}
+    assert runs[1].attempts == 1
+    assert runs[1].not_before is not None
+    assert runs[1].walltime == 2880
+    assert runs[2].walltime == 4000
+
+    # retried runs wait for the backoff
+    assert [job.id for job in get_pending_jobs(10, location=None)] == [3]
+
+    # no attempts left
+    update_job_status(CorsikaRun, 1, 'failed')
+    assert retry_failed_jobs(max_retries=1) == 0
+
+    update_job_status(CorsikaRun, 2, 'failed')
+    assert retry_failed_jobs(max_retries=2, backoff=0) == 2
+    assert {job.id for job in get_pending_jobs(10, location=None)} == {1, 2, 3}
+
+
+def test_retry_walltime_factor(add_corsika_runs):
+    from mopro.database import database, CorsikaRun
+    from mopro.queries import retry_failed_jobs, update_job_status
+    from peewee import fn
+
+    add_corsika_runs(2)
+    with database.connection_context():
+        CorsikaRun.update(walltime=45).where(CorsikaRun.id == 2).execute()
+    update_job_status(CorsikaRun, 1, 'walltime_exceeded')
+    update_job_status(CorsikaRun, 2, 'walltime_exceeded')
+
+    assert retry_failed_jobs(max_retries=1, walltime_factor=1.5) == 2
+
+    with database.connection_context():
+        walltimes = dict(CorsikaRun.select(CorsikaRun.id, CorsikaRun.walltime).tuples())
+    assert walltimes == {1: 4320, 2: 68}
+    with database.connection_context():
+        types = CorsikaRun.select(fn.TYPEOF(CorsikaRun.walltime)).distinct().tuples()
+        assert list(types) == [('integer', )]
+
+
+def test_pending_job_specs(add_corsika_runs):
+    from datetime import datetime
+    from mopro.database import database, CorsikaRun, CeresRun
+    from mopro.jobs import CorsikaJobSpec, CeresJobSpec
+    from mopro.queries import get_pending_jobs
+    from mopro.scripts.simulate_scheduling import fill_database, LOCATION
+
+    add_corsika_runs(2)
+    with database.connection_context():
+        fill_database(
+            [dict(program='ceres', settings='settings_12', primary='gamma', n_runs=2)],
+            datetime.utcnow(),
+        )
+
+    jobs = get_pending_jobs(10, location=LOCATION)
+    corsika_jobs = [job for job in jobs if isinstance(job, CorsikaJobSpec)]
+    ceres_jobs = [job for job in jobs if isinstance(job, CeresJobSpec)]
+    assert len(corsika_jobs) == 2 and len(ceres_jobs) == 2
+
+    with database.connection_context():
+        for job in jobs:
+            run = job.model.get(id=job.id)
+            assert job.directory_name == run.directory_name
+            assert job.basename == run.basename
+            assert job.walltime == run.walltime
+
+            if job.model is CorsikaRun:
+                settings = run.corsika_settings
+                assert (
+                    job.corsika_settings.format_input_card(job, 'test.eventio')
+                    == settings.format_input_card(run, 'test.eventio')
+                )
+            else:
+                assert job.model is CeresRun
+                assert job.corsika_run.result_file == run.corsika_run.result_file
+
+    # settings are shared between the runs
+    assert corsika_jobs[0].corsika_settings is corsika_jobs[1].corsika_settings
+    assert ceres_jobs[0].ceres_settings is ceres_jobs[1].ceres_settings
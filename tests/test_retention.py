@@ -0,0 +1,128 @@
+import os
+from datetime import datetime
+from mopro.config import config
+
+
+config.load_yaml('tests/test_config.yaml')
+
+
+def test_retention(sqlite_database, tmp_path):
+    from mopro.database import database, CorsikaRun, CeresRun, Status
+    from mopro.queries import get_pending_jobs, update_job_status
+    from mopro.retention import RetentionPolicy
+    from mopro.scripts.simulate_scheduling import fill_database, LOCATION
+
+    with database.connection_context():
+        fill_database(
+            [dict(program='ceres', settings='settings_12', primary='gamma', n_runs=3)],
+            datetime.utcnow(),
+        )
+        for run in CorsikaRun.select():
+            run.result_file = str(tmp_path / 'corsika' / f'{run.id}.eventio.zst')
+            run.save()
+            os.makedirs(os.path.dirname(run.result_file), exist_ok=True)
+            open(run.result_file, 'w').close()
+
+    for job_id in (1, 2):
+        update_job_status(CeresRun, job_id, 'success')
+
+    retention = RetentionPolicy(
+        ['settings_12'], action='archive',
+        archive_directory=str(tmp_path / 'archive'), mopro_directory=str(tmp_path),
+    )
+    # CERES run 3 still needs its input
+    assert retention.clean(LOCATION) == 2
+    assert retention.clean(LOCATION) == 0
+    assert not os.path.exists(tmp_path / 'corsika' / '1.eventio.zst')
+    assert os.path.isfile(tmp_path / 'archive' / 'corsika' / '1.eventio.zst')
+    assert os.path.isfile(tmp_path / 'corsika' / '3.eventio.zst')
+
+    # new CERES runs for removed inputs
+    with database.connection_context():
+        created = Status.get(name='created')
+        for corsika_run in (1, 2):
+            CeresRun.create(
+                ceres_settings=1, corsika_run=corsika_run, status=created,
+                diffuse=False, off_target_distance=0.6,
+            )
+    pending = get_pending_jobs(10, LOCATION)
+    assert [(job.model, job.id) for job in pending] == [(CeresRun, 3)]
+
+    # run 1 is restored from the archive, run 2 is simulated again
+    os.remove(tmp_path / 'archive' / 'corsika' / '2.eventio.zst')
+    assert retention.regenerate(LOCATION) == (1, 1)
+    assert os.path.isfile(tmp_path / 'corsika' / '1.eventio.zst')
+    assert {(job.model, job.id) for job in get_pending_jobs(10, LOCATION)} == {
+        (CeresRun, 3), (CeresRun, 4), (CorsikaRun, 2),
+    }
+
+    with database.connection_context():
+        corsika_run = CorsikaRun.get_by_id(2)
+    assert corsika_run.status.name == 'created'
+    assert corsika_run.cleaned_at is None
+
+
+def test_retention_settings_revisions(sqlite_database, tmp_path):
+    from mopro.database import database, CorsikaRun, CeresRun, CeresSettings, Status
+    from mopro.queries import update_job_status
+    from mopro.retention import RetentionPolicy
+    from mopro.scripts.simulate_scheduling import fill_database, LOCATION
+
+    with database.connection_context():
+        fill_database(
+            [dict(program='ceres', settings='settings_12', primary='gamma', n_runs=2)],
+            datetime.utcnow(),
+        )
+        for run in CorsikaRun.select():
+            run.result_file = str(tmp_path / f'{run.id}.eventio.zst')
+            run.save()
+            open(run.result_file, 'w').close()
+
+        # a second revision of the same settings, only used for CORSIKA run 1
+        settings = CeresSettings.get()
+        settings.id = None
+        settings.revision += 1
+        settings.save(force_insert=True)
+        CeresRun.create(
+            ceres_settings=settings, corsika_run=1, status=Status.get(name='created'),
+            diffuse=False, off_target_distance=0.6,
+        )
+
+    for job_id in (1, 2, 3):
+        update_job_status(CeresRun, job_id, 'success')
+
+    # a successful run of any revision counts for the settings name
+    retention = RetentionPolicy(['settings_12'])
+    assert retention.clean(LOCATION) == 2
+    assert not os.path.exists(tmp_path / '1.eventio.zst')
+    assert not os.path.exists(tmp_path / '2.eventio.zst')
+
+
+def test_retention_errors(sqlite_database, tmp_path):
+    from mopro.processing.submitter import JobSubmitter
+    from mopro.retention import RetentionPolicy
+    from mopro.scripts.simulate_scheduling import fill_database, LOCATION
+    from mopro.database import database
+
+    with database.connection_context():
+        fill_database(
+            [dict(program='ceres', settings='settings_12', primary='gamma', n_runs=1)],
+            datetime.utcnow(),
+        )
+
+    # configured before the settings are inserted
+    retention = RetentionPolicy(['settings_12', 'settings_13'])
+    assert retention.clean(LOCATION) == 0
+    assert retention.required is None
+
+    class BrokenRetention:
+        def regenerate(self, location):
+            raise OSError('archive not mounted')
+
+    submitter = JobSubmitter(
+        interval=1, max_queued_jobs=10, mopro_directory=str(tmp_path),
+        host='localhost', port=1337, cluster=None, location=LOCATION,
+        retention=BrokenRetention(),
+    )
+    # logged, does not stop the submission
+    submitter.apply_retention()
@@ -0,0 +1,80 @@
+import pytest
+from mopro.config import config
+
+
+config.load_yaml('tests/test_config.yaml')
+
+
+queue_state = [
+    dict(program='corsika', settings='epos', primary='proton', n_runs=100),
+    dict(program='corsika', settings='epos', primary='gamma', n_runs=10),
+]
+
+
+def test_priority_starves_small_group(sqlite_database):
+    from mopro.scheduling import PriorityPolicy
+    from mopro.scripts.simulate_scheduling import simulate
+
+    started = simulate(PriorityPolicy(), queue_state, n_ticks=1, slots=10)
+    assert len(started['CorsikaRun epos proton']) == 10
+    assert 'CorsikaRun epos gamma' not in started
+
+
+def test_fair_share(sqlite_database):
+    from mopro.scheduling import FairSharePolicy
+    from mopro.scripts.simulate_scheduling import simulate
+
+    started = simulate(FairSharePolicy(), queue_state, n_ticks=1, slots=10)
+    assert len(started['CorsikaRun epos proton']) == 5
+    assert len(started['CorsikaRun epos gamma']) == 5
+
+
+def test_fair_share_weights(sqlite_database):
+    from mopro.scheduling import FairSharePolicy
+    from mopro.scripts.simulate_scheduling import simulate
+
+    started = simulate(
+        FairSharePolicy(weights={'gamma': 4}, aging=1.0),
+        queue_state, n_ticks=1, slots=10,
+    )
+    assert len(started['CorsikaRun epos gamma']) == 8
+    assert len(started['CorsikaRun epos proton']) == 2
+
+
+def test_fair_share_active_jobs(sqlite_database):
+    from mopro.scheduling import FairSharePolicy
+    from mopro.scripts.simulate_scheduling import simulate
+
+    # proton runs started in the first tick still run in the second
+    state = [dict(program='corsika', settings='epos', primary='proton', n_runs=100)]
+    started = simulate(FairSharePolicy(), state, n_ticks=1, slots=10, duration=5)
+    assert len(started['CorsikaRun epos proton']) == 10
+
+    state = [dict(program='corsika', settings='epos', primary='gamma', n_runs=10)]
+    started = simulate(FairSharePolicy(), state, n_ticks=1, slots=20, duration=5)
+    # 10 active proton runs count towards the share of the proton group
+    assert len(started['CorsikaRun epos gamma']) == 10
+
+
+def test_ceres_bonus(sqlite_database):
+    from mopro.scheduling import FairSharePolicy
+    from mopro.scripts.simulate_scheduling import simulate
+
+    state = queue_state + [
+        dict(program='ceres', settings='settings_12', primary='gamma', n_runs=10),
+    ]
+    started = simulate(FairSharePolicy(ceres_bonus=100), state, n_ticks=1, slots=10)
+    assert len(started['CeresRun settings_12 gamma']) == 10
+
+
+def test_fair_share_needs_window_functions(sqlite_database, monkeypatch):
+    from mopro.config import SchedulingConfig
+    from mopro.database import database
+    from mopro.scheduling import FairSharePolicy, build_policy
+
+    scheduling = SchedulingConfig(policy='fair_share')
+    assert isinstance(build_policy(scheduling), FairSharePolicy)
+
+    monkeypatch.setattr(database.obj, 'server_version', (3, 22, 0))
+    with pytest.raises(ValueError, match='window functions'):
+        build_policy(scheduling)
@@ -0,0 +1,81 @@
+import os
+import subprocess as sp
+
+
+def test_env_file(tmp_path):
+    from mopro.slurm import write_env_file
+
+    env = {
+        'HOME': '/home/mopro',
+        'MOPRO_JOB_ID': '1',
+        'MOPRO_LOGFILE': "/data/logs/it's a run.log",
+        'PATH': '/opt/mars:/usr/bin:/bin',
+        # of the submitter, not of the job
+        'SLURM_JOB_ID': '42',
+        'BASH_FUNC_module%%': '() {  echo module\n}',
+    }
+    path = tmp_path / 'job.env'
+    write_env_file(env, str(path))
+
+    lines = path.read_text().splitlines()
+    assert [line.split('=')[0] for line in lines] == [
+        'export HOME', 'export MOPRO_JOB_ID', 'export MOPRO_LOGFILE', 'export PATH',
+    ]
+
+    # the job only gets the path of the file, sourcing it restores the environment
+    output = sp.check_output(
+        ['/bin/bash', '-c', 'source "$MOPRO_ENV_FILE" && env'],
+        env={'MOPRO_ENV_FILE': str(path)},
+    )
+    job_env = dict(line.split('=', 1) for line in output.decode().splitlines())
+    for name in ('HOME', 'MOPRO_JOB_ID', 'MOPRO_LOGFILE', 'PATH'):
+        assert job_env[name] == env[name]
+    assert 'SLURM_JOB_ID' not in job_env
+
+
+def test_job_export(tmp_path, monkeypatch):
+    from mopro.fake_slurm import FakeSlurm, FakeSlurmDaemon
+    from mopro.slurm import SlurmCluster
+    import mopro.slurm
+
+    calls = []
+    run = mopro.slurm.sp.run
+
+    def record_run(command, **kwargs):
+        calls.append((command, kwargs['env']))
+        return run(command, **kwargs)
+
+    monkeypatch.setattr(mopro.slurm.sp, 'run', record_run)
+
+    daemon = FakeSlurmDaemon(str(tmp_path), FakeSlurm({'short': (60, 1)}))
+    daemon.start()
+    monkeypatch.setenv('PATH', daemon.bin_directory + os.pathsep + os.environ['PATH'])
+    try:
+        cluster = SlurmCluster(partitions={'short': 60}, export='job')
+        env = dict(os.environ, MOPRO_JOB_ID='1')
+        cluster.submit_job(
+            '/bin/true', env=env, job_name='mopro_corsika_1', walltime=30,
+            stdout=str(tmp_path / 'corsika_1.log'),
+        )
+    finally:
+        daemon.stop()
+
+    env_file = tmp_path / 'corsika_1.env'
+    command, sbatch_env = calls[0]
+    assert command[0] == 'sbatch'
+    assert f'--export=MOPRO_ENV_FILE={env_file}' in command
+    assert sbatch_env is None
+    assert 'export MOPRO_JOB_ID=1\n' in env_file.read_text()
+
+
+def test_ceres_environment():
+    from mopro.processing.ceres import build_environment
+
+    env1 = build_environment('/opt/root', '/opt/mars')
+    env2 = build_environment('/opt/root', '/opt/mars')
+    assert env1 == env2
+    assert env1 is not env2
+    assert env1['PATH'].startswith('/opt/root/bin:/opt/mars:')
+
+    env1['MOPRO_JOB_ID'] = '1'
+    assert 'MOPRO_JOB_ID' not in build_environment('/opt/root', '/opt/mars')
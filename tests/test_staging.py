@@ -0,0 +1,86 @@
+import os
+
+
+def write_file(path, size):
+    with open(path, 'wb') as f:
+        f.write(b'\0' * size)
+    return str(path)
+
+
+def test_staging_hit(tmp_path):
+    from mopro.processing.staging import StagingCache
+
+    cache = StagingCache(str(tmp_path / 'cache'), max_size=1000)
+    input_file = write_file(tmp_path / 'input.eventio.zst', 100)
+
+    with cache.stage(input_file) as (path, hit):
+        assert not hit
+        assert path != input_file
+        assert os.path.getsize(path) == 100
+
+    with cache.stage(input_file) as (path, hit):
+        assert hit
+
+    assert cache.hit_rate == 0.5
+
+
+def test_staging_eviction(tmp_path):
+    from mopro.processing.staging import StagingCache
+
+    cache = StagingCache(str(tmp_path / 'cache'), max_size=250)
+    inputs = [write_file(tmp_path / f'input_{i}', 100) for i in range(3)]
+
+    with cache.stage(inputs[0]) as (first, _):
+        pass
+    with cache.stage(inputs[1]) as (second, _):
+        # first entry is least recently used and not in use
+        with cache.stage(inputs[2]) as (third, _):
+            assert not os.path.exists(first)
+            assert os.path.exists(second)
+            assert os.path.exists(third)
+
+    # too large for the cache, original path is used
+    large = write_file(tmp_path / 'large', 300)
+    with cache.stage(large) as (path, hit):
+        assert path == large
+
+
+def test_staging_evicted_before_shared_lock(tmp_path):
+    from mopro.processing.staging import StagingCache
+
+    cache = StagingCache(str(tmp_path / 'cache'), max_size=1000)
+    input_file = write_file(tmp_path / 'input', 100)
+
+    fill = cache.fill
+    calls = []
+
+    def fill_and_evict(path, entry, size):
+        hit = fill(path, entry, size)
+        calls.append(hit)
+        if len(calls) == 1:
+            # another job evicts the entry before the shared lock is taken
+            cache.make_room(1000)
+        return hit
+
+    cache.fill = fill_and_evict
+    with cache.stage(input_file) as (path, hit):
+        assert os.path.isfile(path)
+        assert not hit
+
+    assert calls == [False, False]
+    assert cache.misses == 1
+
+
+def test_staging_eviction_removes_lock(tmp_path):
+    from mopro.processing.staging import StagingCache
+
+    cache = StagingCache(str(tmp_path / 'cache'), max_size=150)
+    inputs = [write_file(tmp_path / f'input_{i}', 100) for i in range(2)]
+
+    with cache.stage(inputs[0]) as (first, _):
+        assert os.path.isfile(first + '.lock')
+    with cache.stage(inputs[1]) as (second, _):
+        assert os.path.isfile(second + '.lock')
+
+    assert not os.path.exists(first)
+    assert not os.path.exists(first + '.lock')
@@ -0,0 +1,50 @@
+from mopro.config import config
+
+
+config.load_yaml('tests/test_config.yaml')
+
+
+def test_storage_throttle(add_corsika_runs, tmp_path, monkeypatch):
+    import mopro.storage
+    from mopro.database import database, CorsikaRun, OutputFile
+    from mopro.queries import get_pending_jobs, update_job_status
+    from mopro.storage import StorageThrottle
+
+    add_corsika_runs(10)
+    for job_id in (1, 2):
+        update_job_status(CorsikaRun, job_id, 'success', tmp_high_water=50)
+    update_job_status(CorsikaRun, 3, 'queued', location='test')
+
+    with database.connection_context():
+        for job_id in (1, 2):
+            OutputFile.create(
+                kind='corsika', path=f'/data/{job_id}.eventio.zst',
+                corsika_run=job_id, corsika_settings=1, primary_particle=1,
+                zenith_bin=0, size=100, sha256='0' * 64,
+            )
+
+    monkeypatch.setattr(mopro.storage, 'free_space', lambda path: 1000)
+    jobs = get_pending_jobs(10, location='test')
+    assert len(jobs) == 7
+
+    # 500 bytes free minus 100 for the queued run
+    throttle = StorageThrottle(str(tmp_path), min_free=500, safety_factor=1.0)
+    assert [job.id for job in throttle.limit(jobs, 'test')] == [4, 5, 6, 7]
+
+    # 200 bytes free in tmp minus 50 for the queued run
+    throttle = StorageThrottle(
+        str(tmp_path), tmp_dir=str(tmp_path), min_free=500, tmp_min_free=800,
+        safety_factor=1.0,
+    )
+    assert [job.id for job in throttle.limit(jobs, 'test')] == [4, 5, 6]
+
+    # tmp is not checked without tmp_min_free, even if tmp_dir exists
+    throttle = StorageThrottle(
+        str(tmp_path), tmp_dir=str(tmp_path), min_free=500, safety_factor=1.0,
+    )
+    assert throttle.budget('test')[1] is None
+    assert [job.id for job in throttle.limit(jobs, 'test')] == [4, 5, 6, 7]
+
+    # output file system full, submission paused
+    throttle = StorageThrottle(str(tmp_path), min_free=950)
+    assert throttle.limit(jobs, 'test') == []
@@ -0,0 +1,88 @@
+from mopro.config import config
+
+
+config.load_yaml('tests/test_config.yaml')
+
+
+def test_group_ceres_jobs():
+    from mopro.jobs import CorsikaJobSpec, CeresJobSpec
+    from mopro.processing.submitter import JobSubmitter
+
+    jobs = [
+        CeresJobSpec(id=1, corsika_run_id=10),
+        CorsikaJobSpec(id=11),
+        CeresJobSpec(id=2, corsika_run_id=12),
+        CeresJobSpec(id=3, corsika_run_id=10),
+    ]
+
+    submitter = JobSubmitter(
+        interval=1, max_queued_jobs=10, mopro_directory='.',
+        host='localhost', port=1337, cluster=None,
+    )
+    assert submitter.group_jobs(jobs) == [[job] for job in jobs]
+
+    submitter.group_ceres = True
+    groups = submitter.group_jobs(jobs)
+    assert [[job.id for job in group] for group in groups] == [[1, 3], [11], [2]]
+
+
+def test_group_ceres_jobs_max_walltime(fake_cluster):
+    from mopro.jobs import CeresJobSpec
+    from mopro.processing.submitter import JobSubmitter
+
+    jobs = [
+        CeresJobSpec(id=i, corsika_run_id=10, walltime=walltime)
+        for i, walltime in enumerate([30, 60, 20, 90, 150], start=1)
+    ]
+    fake_cluster.max_walltime = 120
+    submitter = JobSubmitter(
+        interval=1, max_queued_jobs=10, mopro_directory='.',
+        host='localhost', port=1337, cluster=fake_cluster, group_ceres=True,
+    )
+    groups = submitter.group_jobs(jobs)
+    # runs longer than the longest partition are still submitted on their own
+    assert [[job.id for job in group] for group in groups] == [[1, 2, 3], [4], [5]]
+
+
+def test_reconcile_with_cluster(add_corsika_runs, fake_cluster):
+    from mopro.database import database, CorsikaRun
+    from mopro.queries import update_job_status, get_job_counts, reconcile_job_counts
+    from mopro.processing.submitter import JobSubmitter
+
+    add_corsika_runs(6)
+    reconcile_job_counts()
+    for job_id in (1, 2):
+        update_job_status(CorsikaRun, job_id, 'queued', location='test')
+    for job_id in (3, 4):
+        update_job_status(CorsikaRun, job_id, 'running', location='test')
+    # queued from another location, must not be touched
+    update_job_status(CorsikaRun, 5, 'queued', location='other')
+
+    fake_cluster.jobs = {
+        'mopro_corsika_1': 'queued',
+        'mopro_corsika_3': 'running',
+        # submitted right before a crash
+        'mopro_corsika_6': 'queued',
+        'some_other_job': 'running',
+    }
+    submitter = JobSubmitter(
+        interval=1, max_queued_jobs=10, mopro_directory='.',
+        host='localhost', port=1337, cluster=fake_cluster, location='test',
+    )
+    submitter.reconcile_with_cluster()
+
+    with database.connection_context():
+        status = {r.id: r.status.name for r in CorsikaRun.select()}
+        locations = {r.id: r.location for r in CorsikaRun.select()}
+
+    assert status == {
+        1: 'queued', 2: 'created', 3: 'running',
+        4: 'failed', 5: 'queued', 6: 'queued',
+    }
+    assert locations[2] is None
+    assert locations[6] == 'test'
+
+    counts = get_job_counts()
+    assert counts[('corsika', 'queued')] == 3
+    assert counts[('corsika', 'created')] == 1
+    assert counts[('corsika', 'failed')] == 1
@@ -0,0 +1,69 @@
+from mopro.config import config
+
+
+config.load_yaml('tests/test_config.yaml')
+
+
+def test_walltime_estimate(sqlite_database):
+    from mopro.database import database, CorsikaSettings, CorsikaRun, Status
+    from mopro.walltime import WalltimeEstimator
+
+    with database.connection_context():
+        settings = CorsikaSettings.create(name='test', config_h='', inputcard_template='')
+        success = Status.get(name='success')
+        # duration proportional to the number of showers, one second per shower
+        CorsikaRun.insert_many([
+            dict(
+                corsika_settings=settings,
+                primary_particle=1, n_showers=n_showers,
+                zenith_min=zenith, zenith_max=zenith,
+                azimuth_min=0, azimuth_max=0,
+                energy_min=100, energy_max=1e5, spectral_index=-2.7,
+                max_radius=300, status=success, duration=n_showers,
+            )
+            for n_showers in (1000, 2000, 5000, 10000)
+            for zenith in (0, 10, 20, 30, 40, 50)
+        ]).execute()
+        run = CorsikaRun(
+            corsika_settings=settings, primary_particle=1, n_showers=4000,
+            zenith_min=20, zenith_max=20, azimuth_min=0, azimuth_max=0,
+            energy_min=100, energy_max=1e5, spectral_index=-2.7, max_radius=300,
+        )
+
+    estimator = WalltimeEstimator(safety_factor=1.0, margin=0, min_walltime=1)
+    assert estimator.estimate(run) == 67
+    assert estimator.estimate(run, max_walltime=60) == 60
+
+    # not enough runs to fit
+    assert WalltimeEstimator(min_runs=100).estimate(run) is None
+    assert WalltimeEstimator(min_runs=20, max_runs=10).estimate(run) is None
+
+    # retried runs keep their walltime
+    run.attempts = 1
+    assert estimator.estimate(run) is None
+
+
+def test_walltime_report_requested(add_corsika_runs):
+    from mopro.database import database, CorsikaRun
+    from mopro.scripts.walltime_report import get_queue_waits, requested_walltime
+    from datetime import datetime
+
+    add_corsika_runs(3)
+    now = datetime.utcnow()
+    with database.connection_context():
+        CorsikaRun.update(queued_at=now, started_at=now).execute()
+        CorsikaRun.update(walltime=60, walltime_estimated=True).where(
+            CorsikaRun.id == 2
+        ).execute()
+        # retried after exceeding the estimated walltime
+        CorsikaRun.update(walltime=120, walltime_estimated=True, attempts=1).where(
+            CorsikaRun.id == 3
+        ).execute()
+
+    requested = {
+        requested_walltime(attempts, estimated): (walltime, n_runs)
+        for walltime, attempts, estimated, n_runs, _, _ in get_queue_waits()
+    }
+    assert requested == {
+        'default': (2880, 1), 'estimated': (60, 1), 'retried': (120, 1),
+    }